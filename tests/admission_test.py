@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+from vemm.core.admission import AdmissionController, Overloaded, estimate_cost, assign_threads
+from vemm.core.optimization_request import SolverSettings
+from vemm.core.metrics import metrics
+
+if __name__ == '__main__':
+
+    from vemm import app as service
+    data = {'algorithm': 'toyalgstr', 'objective': {'target': 'memory', 'type': 'min'}, 'robustness_fact': None,
+            'constraints': [{'target': 'time', 'type': 'leq', 'value': 120}], 'country': None}
+
+    ##### Cost: trees embedded and their leaves #####
+    for target in ['time', 'memory']:
+        service.models.get_model('toyalgstr', 'vm', target)
+    request = service.parse_request_json(data)
+    cost = estimate_cost(service.db, service.models, request)
+    print(cost)
+    leaves = sum(service.models.get_model_info('toyalgstr', 'vm', target)['leaves'] for target in ['time', 'memory'])
+    assert cost == {'hws': 1, 'trees': 2, 'leaves': leaves}
+
+    # the information of the models is read once, and again only when they are retrained
+    hits = metrics.counters['cache_requests_total']
+    hit_key, miss_key = (('cache', 'model_info'), ('result', 'hit')), (('cache', 'model_info'), ('result', 'miss'))
+    n_hits, n_misses = hits[hit_key], hits[miss_key]
+    assert estimate_cost(service.db, service.models, request) == cost
+    assert hits[hit_key] == n_hits + 2 and hits[miss_key] == n_misses
+    service.models.retrain('toyalgstr', 'vm')
+    service.models.wait_retraining()
+    assert estimate_cost(service.db, service.models, request)['leaves'] == \
+        sum(service.models.get_model_info('toyalgstr', 'vm', target)['leaves'] for target in ['time', 'memory'])
+    assert hits[miss_key] == n_misses + 2
+
+    ##### Solver threads are limited to the granted ones #####
+    settings = SolverSettings(service.db, 'toyalgstr')
+    assign_threads(settings, 2)
+    assert settings.get_settings()['threads'] == 2
+    settings.add_setting('threads', 1)
+    assign_threads(settings, 2)
+    assert settings.get_settings()['threads'] == 1
+    settings = SolverSettings(service.db, 'toyalgstr')
+    settings.add_setting('decompose', True)
+    assign_threads(settings, 4)
+    assert settings.get_settings()['workers'] == 4 and settings.get_settings()['threads'] == 1
+
+    ##### Lanes and budget #####
+    controller = AdmissionController(4, max_pending=1, timeout=0.3)
+    with controller.admit(5000) as threads:
+        # the regular lane has 3 threads (one reserved to the fast lane), all taken by this expensive request
+        assert threads == 3
+        # cheap requests are not queued behind it
+        with controller.admit(10) as fast_threads:
+            assert fast_threads == 1
+
+        # other expensive requests wait, and are rejected after the timeout (503)...
+        results = []
+        def waiting_request():
+            try:
+                with controller.admit(5000):
+                    results.append('admitted')
+            except Overloaded as e:
+                results.append(e.status)
+        waiting = threading.Thread(target=waiting_request)
+        waiting.start()
+        time.sleep(0.1)
+        # ...or at once (429) if too many are already waiting
+        try:
+            with controller.admit(1500):
+                assert False, 'admitted over the queue limit'
+        except Overloaded as e:
+            assert e.status == 429 and e.retry_after > 0
+        waiting.join()
+        assert results == [503]
+
+    # threads are released, and granted within what is free
+    with controller.admit(1500) as threads:
+        assert threads == 2
+        with controller.admit(5000) as threads:
+            assert threads == 1
+
+    ##### Requests not admitted get 429/503 with Retry-After #####
+    client = service.app.test_client()
+    response = client.post('/optimize', json=data)
+    assert response.status_code == 200 and 'solution' in response.json
+    admission = service.admission
+    service.admission = AdmissionController(1, max_pending=0)
+    try:
+        response = client.post('/optimize', json=data)
+    finally:
+        service.admission = admission
+    print(response.status_code, response.json)
+    assert response.status_code == 429 and response.headers['Retry-After'] == str(response.json['retry_after'])
+    print('Admission OK')
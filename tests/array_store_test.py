@@ -0,0 +1,120 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets, dataset_fingerprint
+from vemm.core.ml_models import MLModels
+from vemm.core.array_store import ArrayStore
+from vemm.core.ingestion import ingest_rows
+from vemm.core.metrics import metrics
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {name: os.path.join(tmp_dir, name) for name in ['data', 'categories', 'models', 'models_inp', 'arrays']}
+        shutil.copytree(data_path_no_inp, paths['data'])
+        os.makedirs(paths['categories'])
+        os.makedirs(paths['models'])
+        os.makedirs(paths['models_inp'])
+
+        ##### Entries are memory-mapped, read-only, and replaced by newer versions #####
+        store = ArrayStore(os.path.join(tmp_dir, 'store'))
+        arrays, attrs = store.put('a/b', 'v1', {'x': np.arange(6.).reshape(2, 3)}, {'columns': ['c0', 'c1', 'c2']})
+        assert isinstance(arrays['x'], np.memmap) and not arrays['x'].flags.writeable
+        assert attrs == {'columns': ['c0', 'c1', 'c2']} and arrays['x'][1, 2] == 5
+        assert store.get('a/b', 'v0') == (None, None)
+        store.put('a/b', 'v2', {'x': np.zeros(3)})
+        assert store.get('a/b', 'v1') == (None, None) and os.listdir(os.path.join(store.path, 'a/b')) == ['v2']
+        # mappings of the replaced version are still valid
+        assert arrays['x'][1, 2] == 5
+
+        # the same version stored meanwhile by another process is kept
+        arrays, _ = store.put('a/b', 'v2', {'x': np.ones(3)})
+        assert arrays['x'].sum() == 0
+
+        # temporary folders of crashed processes are removed, those of running processes are not
+        crashed = subprocess.Popen([sys.executable, '-c', 'pass'])
+        crashed.wait()
+        for pid in [crashed.pid, os.getpid()]:
+            os.makedirs(os.path.join(store.path, 'a/b', f'.tmp-{pid}-xyz'))
+        ArrayStore(store.path)
+        assert sorted(os.listdir(os.path.join(store.path, 'a/b'))) == [f'.tmp-{os.getpid()}-xyz', 'v2']
+
+        ##### Expanded datasets are stored once and shared #####
+        datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'],
+                                       paths['arrays'])
+        plain = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        models = MLModels(db, datasets, paths['models'], paths['models_inp'], arrays_path=paths['arrays'])
+
+        dataset = datasets.get_dataset('toyalgstr', 'vm')
+        expected = plain.get_dataset('toyalgstr', 'vm')
+        assert list(dataset.columns) == list(expected.columns)
+        assert np.array_equal(dataset.values, expected.values.astype(float))
+        assert dataset_fingerprint(dataset) == dataset_fingerprint(expected)
+        # a view of the shared array (no copy)
+        base = dataset.values
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        assert not dataset.values.flags.writeable and base is not None
+
+        # other processes (e.g. workers) attach to the stored dataset
+        hit_key = (('cache', 'stored_datasets'), ('result', 'hit'))
+        hits = metrics.counters['cache_requests_total'][hit_key]
+        other = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'],
+                                    paths['arrays'])
+        assert np.array_equal(other.get_dataset('toyalgstr', 'vm').values, dataset.values)
+        assert metrics.counters['cache_requests_total'][hit_key] == hits + 1
+
+        # models are trained on the stored dataset (read by the training process)
+        model = models.get_model('toyalgstr', 'vm', 'time')
+        assert models.get_model_info('toyalgstr', 'vm', 'time')['dataset_hash'] == datasets.get_fingerprint('toyalgstr', 'vm')
+        errors = datasets.get_error_stats(models, 'toyalgstr', 'vm', 'time')
+        ml_inputs = datasets.expander.get_expanded_ml_input_vars('toyalgstr')
+        assert np.allclose(errors, np.abs(expected['time'].values - model.predict(expected[ml_inputs].values)))
+
+        ##### Compiled rules are stored once and shared #####
+        rules = models.get_rules('toyalgstr', 'vm', 'time')
+        assert isinstance(rules.leaf_lb, np.memmap) and not rules.values.flags.writeable
+        hit_key = (('cache', 'stored_rules'), ('result', 'hit'))
+        hits = metrics.counters['cache_requests_total'][hit_key]
+        other_models = MLModels(db, datasets, paths['models'], paths['models_inp'], arrays_path=paths['arrays'])
+        other_rules = other_models.get_rules('toyalgstr', 'vm', 'time')
+        assert metrics.counters['cache_requests_total'][hit_key] == hits + 1
+        plain_rules = MLModels(db, datasets, paths['models'], paths['models_inp']).get_rules('toyalgstr', 'vm', 'time')
+        for name in ['values', 'leaf_lb', 'leaf_ub', 'integer', 'features']:
+            assert np.array_equal(getattr(other_rules, name), getattr(plain_rules, name))
+        assert all(np.array_equal(a, b) for a, b in zip(other_rules.lb_bounds + other_rules.ub_bounds,
+                                                           plain_rules.lb_bounds + plain_rules.ub_bounds))
+        assert other_rules.trained_leaves == plain_rules.trained_leaves and other_rules.tolerance == plain_rules.tolerance
+
+        ##### Added rows replace the stored dataset #####
+        rows = plain.get_raw_dataset('toyalgstr', 'vm').head(2).to_dict('records')
+        ingest_rows(datasets, models, 'toyalgstr', 'vm', rows, wait=True)
+        new_dataset = datasets.get_dataset('toyalgstr', 'vm')
+        assert len(new_dataset) == len(dataset) + 2
+        assert os.listdir(os.path.join(paths['arrays'], 'input-independent', 'toyalgstr_vm')) == \
+            [datasets._get_dataset_version('toyalgstr', 'vm')]
+        # the previous version is still readable by whoever holds it
+        assert len(dataset) == len(expected)
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'time') == []
+        # as do the rules of the retrained models
+        models.get_rules('toyalgstr', 'vm', 'time')
+        assert len(os.listdir(os.path.join(paths['arrays'], 'rules', 'input-independent'))) >= 1
+        for entry in os.listdir(os.path.join(paths['arrays'], 'rules', 'input-independent')):
+            assert len(os.listdir(os.path.join(paths['arrays'], 'rules', 'input-independent', entry))) == 1
+
+        ##### The store is removed as a whole (e.g. when vemm.serve stops) #####
+        ArrayStore(paths['arrays']).remove()
+        assert not os.path.exists(paths['arrays'])
+    print('Array store OK')
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+
+if __name__ == '__main__':
+
+    requests = []
+    for value in [120, 100, 80, 1]:
+        requests.append({'algorithm': 'toyalgstr', 'objective': {'target': 'memory', 'type': 'min'},
+                         'robustness_fact': 0.5, 'constraints': [{'target': 'time', 'type': 'leq', 'value': value}],
+                         'country': None})
+    requests.append({'algorithm': 'face-recognition', 'objective': {'target': 'PREPROCESSING_TIME', 'type': 'min'},
+                     'robustness_fact': None, 'constraints': [{'target': 'INFERENCE_TIME', 'type': 'leq', 'value': 600}],
+                     'country': None})
+    lines = [json.dumps(request) for request in requests] + ['{"algorithm": ']
+    env = dict(os.environ, INIT_TYPE='local')
+
+    # models are trained beforehand (without warm-up, the workers find them trained)
+    os.environ['INIT_TYPE'] = 'local'
+    from vemm import app as service
+    for request in requests:
+        for hw in service.db.get_hws(request['algorithm']):
+            for target in service.db.get_targets(request['algorithm']):
+                if target != 'price':
+                    service.models.get_model(request['algorithm'], hw, target)
+
+    ##### Results are written in the input order, failures reported #####
+    output = subprocess.run([sys.executable, '-m', 'vemm', 'batch', '--workers', '2', '--ordered', '--no-warm-up'],
+                            input='\n'.join(lines) + '\n', env=env, capture_output=True, text=True)
+    print(output.stderr[-1000:])
+    results = [json.loads(line) for line in output.stdout.splitlines()]
+    assert output.returncode == 1
+    assert [result['line'] for result in results] == list(range(1, len(lines) + 1))
+    assert 'error' in results[-1] and results[3]['solution'] is None
+
+    ##### Same responses as /optimize #####
+    client = service.app.test_client()
+    for request, result in zip(requests, results):
+        expected = client.post('/optimize', json=request).json
+        if request['algorithm'] == 'face-recognition':
+            # alternative optima: only the objective is compared
+            assert result['solution']['targets']['PREPROCESSING_TIME'] == expected['solution']['targets']['PREPROCESSING_TIME']
+        else:
+            assert dict(result, line=None) == dict(expected, line=None), (result, expected)
+
+    ##### Unordered results, from a file, with a single process #####
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        requests_path = os.path.join(tmp_dir, 'requests.jsonl')
+        summary_path = os.path.join(tmp_dir, 'summary.json')
+        with open(requests_path, 'w') as f:
+            f.write('\n'.join(lines[:2]) + '\n')
+        output = subprocess.run([sys.executable, '-m', 'vemm', 'batch', requests_path, '--workers', '1',
+                                 '--no-warm-up', '--summary', summary_path],
+                                env=env, capture_output=True, text=True, check=True)
+        summary = json.load(open(summary_path))
+    assert sorted(json.loads(line)['line'] for line in output.stdout.splitlines()) == [1, 2]
+    assert summary['requests'] == 2 and summary['failures'] == 0 and summary['latency']['p50'] > 0
+    print('Batch OK')
@@ -0,0 +1,144 @@
+import os
+import re
+import sys
+from contextlib import redirect_stdout
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+import docplex.mp.model
+from eml.backend import cplex_backend
+from eml.tree.reader.sklearn_reader import read_sklearn_tree
+from eml.tree import embed
+from vemm.core.hada import prepare_model, build_model, embed_tree
+from vemm.core.tree_rules import TreeRules, RULES_SUFFIX
+
+
+def new_model(lb, ub):
+    mdl = docplex.mp.model.Model()
+    tree_in = mdl.continuous_var_list(len(lb), lb=lb.tolist(), ub=ub.tolist(), name='x')
+    tree_out = mdl.continuous_var(lb=-1e20, name='y')
+    return mdl, tree_in, tree_out
+
+
+def canonical(mdl):
+    """Linear constraints of a model as sorted (variables, sense, coefficients and constant) tuples, with leaf variables named as by embed_tree."""
+    rows = []
+    for ct in mdl.iter_linear_constraints():
+        terms = sorted((re.sub(r'_p\[(\d+)\]', r'_p_\1', var.name), coeff) for var, coeff in ct.iter_net_linear_coefs())
+        constant, sense = -ct.cplex_num_rhs(), ct.sense.operator_symbol
+        # the same constraint can be written with its terms on either side
+        if sense == '>=' or sense == '==' and terms[0][1] < 0:
+            terms, constant = [(name, -coeff) for name, coeff in terms], -constant
+            sense = '<=' if sense == '>=' else sense
+        rows.append((tuple(name for name, _ in terms), sense, np.array([coeff for _, coeff in terms] + [constant], float)))
+    return sorted(rows, key=lambda row: (row[0], row[1], tuple(np.round(row[2], 3))))
+
+
+def same_constraints(mdl, other):
+    """Whether two models have the same linear constraints, up to the rounding of their coefficients."""
+    rows, other_rows = canonical(mdl), canonical(other)
+    return len(rows) == len(other_rows) and all(
+        names == other_names and sense == other_sense and np.allclose(coeffs, other_coeffs, rtol=1e-9, atol=1e-9)
+        for (names, sense, coeffs), (other_names, other_sense, other_coeffs) in zip(rows, other_rows))
+
+
+if __name__ == '__main__':
+
+    from vemm import app as service
+    from vemm.utils.benchmark import generate_request
+
+    for algorithm in ['toyalgstr', 'face-recognition', 'toyalg']:
+        with redirect_stdout(sys.stderr):
+            request = service.parse_request_json(generate_request(algorithm, False))
+            var_bounds = service.datasets.get_var_bounds_all(request)
+            spec, hws, trees, _ = prepare_model(service.db, service.datasets, request, service.models, var_bounds, None)
+
+        ##### Trees are embedded with the same constraints as emllib's backward implications #####
+        for (hw, target), rules in trees.items():
+            if rules.n_leaves <= 1:
+                continue
+            # bounds beyond all the thresholds, so that no leaf nor condition is left out
+            thresholds = np.concatenate([rules.leaf_lb[rules.lb_bounds], rules.leaf_ub[rules.ub_bounds]])
+            lb, ub = np.minimum(spec.ml_lb, thresholds.min() - 1), np.maximum(spec.ml_ub, thresholds.max() + 1)
+            mdl, tree_in, tree_out = new_model(lb, ub)
+            model = service.models.get_model(algorithm, hw, target)
+            embed_tree(mdl, TreeRules.from_model(model, len(lb)), tree_in, tree_out, lb, ub, f'DT_{hw}_{target}')
+
+            eml_mdl, eml_in, eml_out = new_model(lb, ub)
+            eml_tree = read_sklearn_tree(model)
+            for idx in eml_tree.attributes_ub.keys():
+                eml_tree.update_lb(idx, lb[idx])
+                eml_tree.update_ub(idx, ub[idx])
+            embed.encode_backward_implications(bkd=cplex_backend.CplexBackend(), mdl=eml_mdl, tree=eml_tree,
+                                               tree_in=eml_in, tree_out=eml_out, name=f'DT_{hw}_{target}')
+            assert mdl.number_of_binary_variables == eml_mdl.number_of_binary_variables
+            assert same_constraints(mdl, eml_mdl), (algorithm, hw, target)
+            mdl.end()
+            eml_mdl.end()
+
+            # within the bounds of the features, unreachable leaves and conditions always holding are left out
+            mdl, tree_in, tree_out = new_model(spec.ml_lb, spec.ml_ub)
+            embed_tree(mdl, rules, tree_in, tree_out, spec.ml_lb, spec.ml_ub, f'DT_{hw}_{target}')
+            reachable = np.all((rules.leaf_lb <= spec.ml_ub) & (rules.leaf_ub >= spec.ml_lb), axis=1)
+            conditions = (np.sum(rules.leaf_lb[reachable] > spec.ml_lb) + np.sum(rules.leaf_ub[reachable] < spec.ml_ub)
+                          if reachable.sum() > 1 else -1)
+            assert mdl.number_of_binary_variables == (reachable.sum() if reachable.sum() > 1 else 0)
+            assert mdl.number_of_constraints == 2 + conditions, (algorithm, hw, target)
+            mdl.end()
+
+        ##### The whole model has the expected size (see tree_rules.embedding_size) #####
+        mdl, _ = build_model(spec, hws, trees)
+        print(algorithm, mdl.number_of_variables, mdl.number_of_binary_variables, mdl.number_of_constraints)
+        assert mdl.get_var_by_name(f'{hws[0]}_{spec.target}') is not None
+        # integer features are inputs of the trees, with no auxiliary variables
+        leaves = sum(var.name.startswith('DT_') for var in mdl.iter_variables())
+        assert mdl.number_of_variables == ((len(hws) if len(hws) > 1 else 0) + len(spec.ml_input_vars)
+                                           + len(hws) * len(spec.targets) + leaves)
+        if len(hws) > 1:
+            assert mdl.number_of_indicator_constraints == len(hws) * len(spec.constraints)
+        mdl.end()
+
+    ##### With the features fixed, the output of an embedded tree is its prediction #####
+    with redirect_stdout(sys.stderr):
+        request = service.parse_request_json(generate_request('toyalgstr', False))
+        var_bounds = service.datasets.get_var_bounds_all(request)
+        spec, hws, trees, _ = prepare_model(service.db, service.datasets, request, service.models, var_bounds, None)
+    (hw, target), rules = next(item for item in trees.items() if item[1].n_leaves > 1)
+    model = service.models.get_model('toyalgstr', hw, target)
+    dataset = service.datasets.get_dataset('toyalgstr', hw)
+    features = dataset[spec.ml_input_vars].to_numpy(float)
+    for row in features[:: max(1, len(features) // 10)]:
+        # also when the bounds of the features are the fixed values (a single leaf is reachable, unless on a threshold)
+        for lb, ub in [(spec.ml_lb, spec.ml_ub), (row, row)]:
+            mdl, tree_in, tree_out = new_model(row, row)
+            embed_tree(mdl, rules, tree_in, tree_out, lb, ub, 'DT')
+            mdl.minimize(tree_out)
+            sol = mdl.solve()
+            assert sol is not None and abs(sol[tree_out] - model.predict(row.reshape(1, -1))[0]) < 1e-6
+            mdl.end()
+
+    ##### Rules are compiled once per model, and stored next to it #####
+    rules_path = service.models._MLModels__get_model_path('toyalgstr', hw, target) + RULES_SUFFIX
+    assert os.path.exists(rules_path)
+    assert service.models.get_rules('toyalgstr', hw, target) is rules
+    os.remove(rules_path)
+    service.models._rules.clear()
+    # (also shared by the processes of the node, see ArrayStore)
+    if service.models.store is not None:
+        service.models.store.clear()
+    assert np.array_equal(service.models.get_rules('toyalgstr', hw, target).leaf_lb, rules.leaf_lb)
+    assert os.path.exists(rules_path)
+
+    # ...and compiled again when the compaction tolerance changes
+    compaction_tolerance = service.models.compaction_tolerance
+    try:
+        service.models.compaction_tolerance = 0.5
+        service.models._rules.clear()
+        compacted = service.models.get_rules('toyalgstr', hw, target)
+        assert compacted.tolerance == 0.5 and compacted.trained_leaves == rules.n_leaves >= compacted.n_leaves
+    finally:
+        service.models.compaction_tolerance = compaction_tolerance
+        service.models._rules.clear()
+    assert service.models.get_rules('toyalgstr', hw, target).tolerance == compaction_tolerance
+    print('Build OK')
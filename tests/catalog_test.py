@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+from vemm.core.catalog import Catalog
+from vemm.core.ingestion import ingest_rows
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    data_path_inp = './vemm/algorithms/data/input-dependent'
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # datasets, mappings and models are copied/created in a temporary folder, not to alter the bundled ones
+        paths = {name: os.path.join(tmp_dir, name)
+                 for name in ['data', 'data_inp', 'categories', 'categories_inp', 'models', 'models_inp']}
+        shutil.copytree(data_path_no_inp, paths['data'])
+        shutil.copytree(data_path_inp, paths['data_inp'])
+        for name in ['categories', 'categories_inp', 'models', 'models_inp']:
+            os.makedirs(paths[name])
+
+        datasets = Datasets.from_local(db, paths['data'], paths['data_inp'], paths['categories'], paths['categories_inp'])
+        models = MLModels(db, datasets, paths['models'], paths['models_inp'])
+        catalog = Catalog(db, datasets, models)
+
+        ##### Profiles are computed once, and versioned by their content #####
+        body, version = catalog.get_algorithm('toyalgstr')
+        profile = json.loads(body)
+        assert profile['catalog_version'] == version
+        assert dict(profile, catalog_version=None) == dict(catalog.build_profile('toyalgstr'), catalog_version=None)
+        assert catalog.get_algorithm('toyalgstr')[0] is body
+        assert profile['input-independent']['models']['vm'] == {}
+
+        ##### Trained models and new bounds change the profile #####
+        models.get_model('toyalgstr', 'vm', 'time')
+        body_trained, version_trained = catalog.get_algorithm('toyalgstr')
+        assert version_trained != version
+        assert 'time' in json.loads(body_trained)['input-independent']['models']['vm']
+
+        row = datasets.get_raw_dataset('toyalgstr', 'vm').head(1)
+        ub = profile['input-independent']['targets']['time']['ub']
+        ingest_rows(datasets, models, 'toyalgstr', 'vm', [dict(row.to_dict('records')[0], time=ub * 2)], retrain=False)
+        body_ingested, version_ingested = catalog.get_algorithm('toyalgstr')
+        assert version_ingested != version_trained
+        assert json.loads(body_ingested)['input-independent']['targets']['time']['ub'] == ub * 2
+
+        # no change, same version
+        assert catalog.get_algorithm('toyalgstr')[1] == version_ingested
+        assert Catalog(db, datasets, models).get_algorithm('toyalgstr')[1] == version_ingested
+
+    ##### Clients with an up-to-date copy get 304 (Not Modified) #####
+    from vemm import app as service
+    client = service.app.test_client()
+    for url in ['/algorithms', '/algorithms/toyalgstr']:
+        response = client.get(url)
+        assert response.status_code == 200 and response.json['catalog_version'] in response.headers['ETag']
+        assert 'no-cache' in response.headers['Cache-Control']
+        response = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304 and response.data == b''
+        assert client.get(url, headers={'If-None-Match': '"outdated"'}).status_code == 200
+
+    ##### The GUI session holds only the selection, rendering data is kept server-side #####
+    client = service.app.test_client()
+    response = client.post('/', data={'form_id': 'select_algo', 'selected_input_dep': 'False', 'algorithm': 'toyalgstr'})
+    assert response.status_code == 200 and b'toyalgstr' in response.data
+    with client.session_transaction() as session:
+        assert set(session) == {'last_selected_algo', 'last_input_dependent', 'last_rendered'}
+    # errors are shown on the page, also in a fresh session (nothing rendered yet)
+    response = service.app.test_client().post('/', data={'form_id': 'optimize'})
+    assert response.status_code == 200
+    rendering_kwargs = service.catalog.get_rendering_kwargs('toyalgstr', False)
+    assert service.catalog.get_rendering_kwargs('toyalgstr', False) is rendering_kwargs
+    assert rendering_kwargs['lb_per_var'] == service.datasets.extract_var_bounds('toyalgstr', False)[0]
+    print('Catalog OK')
@@ -0,0 +1,67 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+from vemm.core.hada import HADA, prepare_model, solve_decomposed
+from vemm.core.configdb import ConfigDB
+from vemm.core.optimization_request import OptimizationRequest, UserConstraints, HardwarePrices, SolverSettings
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    data_path_inp = './vemm/algorithms/data/input-dependent'
+    categories_path_no_inp = temp_state.categories_path_no_inp
+    categories_path_inp = temp_state.categories_path_inp
+    models_path_no_inp = temp_state.models_path_no_inp
+    models_path_inp = temp_state.models_path_inp
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    ##### Init #####
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+    datasets = Datasets.from_local(db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp)
+    models = MLModels(db, datasets, models_path_no_inp, models_path_inp)
+
+    ##### Monolithic and decomposed models find the same optimum #####
+    algorithm = 'face-recognition'
+    for opt_type in ['min', 'max']:
+        objectives = []
+        for decompose, workers in [(False, 1), (True, 1), (True, 2)]:
+            user_constraints = UserConstraints(db, algorithm)
+            user_constraints.add_constraint('INFERENCE_TIME', 'leq', 600)
+            solver_settings = SolverSettings(db, algorithm)
+            solver_settings.add_setting('decompose', decompose)
+            solver_settings.add_setting('workers', workers)
+            solver_settings.add_setting('solve_stats', True)
+            request = OptimizationRequest(db, algorithm, 'PREPROCESSING_TIME', opt_type, None, user_constraints,
+                                          HardwarePrices(db, algorithm), None, solver_settings=solver_settings)
+
+            var_bounds = datasets.get_var_bounds_all(request)
+            solution = HADA(db, datasets, request, models, var_bounds, None)
+            assert solution is not None and solution.proven_optimal
+            assert solution.targets_values['INFERENCE_TIME'] <= 600
+            print(opt_type, decompose, workers, solution.chosen_hw, solution.solve_stats)
+            objectives.append(solution.solve_stats['objective'])
+        assert max(objectives) - min(objectives) < 1e-6
+
+    ##### The time limit bounds the whole decomposed solve #####
+    os.environ['INIT_TYPE'] = 'local'
+    from vemm import app as service
+    from vemm.utils.benchmark import generate_request
+    data = generate_request('anticipate', True)
+    data['solver'] = {'time_limit': 0.001, 'decompose': True, 'workers': 1, 'solve_stats': True}
+    request = service.parse_request_json(data)
+    var_bounds = service.datasets.get_var_bounds_all(request)
+    solution = HADA(service.db, service.datasets, request, service.models, var_bounds, None)
+    print(solution.solve_stats)
+    # the second hw is not started once the time is over
+    assert solution.solve_stats['subproblems'] == 1 and solution.solve_stats['unsolved_hws'] == 1
+    assert not solution.solve_stats['proven_optimal'] and 'time limit' in solution.solve_stats['status']
+    # the threads of the subproblems are not written into the request's settings (e.g. exported with the models)
+    spec, hws, trees, _ = prepare_model(service.db, service.datasets, request, service.models, var_bounds, None)
+    solve_decomposed(spec, hws, trees)
+    assert 'threads' not in spec.solver_settings
+    print('Decomposition OK')
@@ -0,0 +1,45 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+from vemm import app as service
+from vemm.core.optimization_request import OptimizationRequest, UserConstraints, HardwarePrices, Inputs, OptimizationSolution
+
+if __name__ == '__main__':
+
+    db = service.db
+    algorithm = 'anticipate'
+    inputs = Inputs(db, algorithm)
+    for input_var in db.get_inputs(algorithm):
+        inputs.add_input(input_var, 1)
+
+    def make_request(country):
+        return OptimizationRequest(db, algorithm, 'time(sec)', 'min', None, UserConstraints(db, algorithm, True),
+                                   HardwarePrices(db, algorithm, True), country, inputs=inputs)
+
+    ##### Countries are checked #####
+    for country in ['Italy', ['Italy', 'France'], 'all', None]:
+        assert make_request(country).country == country
+    for country in ['Narnia', ['Italy', 'Narnia'], [], 42]:
+        try:
+            make_request(country)
+            assert False, f'{country} accepted'
+        except AttributeError as e:
+            print(e)
+
+    ##### Emissions are converted for each country, the solution being the same #####
+    def solution(country):
+        return OptimizationSolution('leonardo', {'nScenarios': 10}, {'time(sec)': 1.5, 'CO2e(kg)': 2.0}, country,
+                                    algorithm, True)
+
+    single = {country: service.format_solution(solution(country)) for country in ['Italy', 'France']}
+    multi = service.format_solution(solution(['Italy', 'France']))
+    print(multi)
+    assert multi['targets'] == {'time(sec)': 1.5, 'CO2e(kg)': 2.0}
+    assert multi['emissions_per_country'] == {country: out['targets']['CO2e(kg)'] for country, out in single.items()}
+    assert single['Italy']['targets']['CO2e(kg)'] == 2.0 * db.get_conversion_factor('Italy')
+    assert 'emissions_per_country' not in single['Italy']
+
+    every = service.format_solution(solution('all'))['emissions_per_country']
+    assert list(every) == db.get_countries() and every['France'] == multi['emissions_per_country']['France']
+    print('Emissions OK')
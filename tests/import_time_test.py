@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import subprocess
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+
+# maximum time (seconds) to import the service and serve the first metadata request, in a new interpreter
+BUDGET = float(os.getenv('IMPORT_TIME_BUDGET', 1.0))
+# modules loaded on first use only
+HEAVY_MODULES = ['pandas', 'sklearn', 'docplex', 'eml', 'scipy']
+
+# run in a new interpreter, for a cold start
+SCRIPT = f"""
+import sys
+import json
+import time
+import multiprocessing
+start = time.perf_counter()
+from vemm import app as service
+imported = time.perf_counter()
+response = service.app.test_client().get('/algorithms')
+first_response = time.perf_counter()
+print(json.dumps({{'import': imported - start,
+                  'first_response': first_response - start,
+                  'status': response.status_code,
+                  'modules': [module for module in {HEAVY_MODULES} if module in sys.modules],
+                  'processes': len(multiprocessing.active_children())}}))
+"""
+
+if __name__ == '__main__':
+
+    env = dict(os.environ, INIT_TYPE='local')
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    output = subprocess.run([sys.executable, '-c', SCRIPT], env=env, cwd=root, capture_output=True, text=True, check=True)
+    ret = json.loads(output.stdout.splitlines()[-1])
+    print(ret)
+
+    ##### Heavy modules are not loaded, and no process is started, to serve metadata #####
+    assert ret['status'] == 200
+    assert ret['modules'] == [], f'{ret["modules"]} loaded at start-up'
+    assert ret['processes'] == 0
+
+    ##### Cold start within budget #####
+    assert ret['first_response'] <= BUDGET, f'first response after {ret["first_response"]:.2f} s (budget {BUDGET} s)'
+    print('Import time OK')
@@ -0,0 +1,108 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+from vemm.core.ingestion import ingest_rows
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # datasets, mappings and models are copied/created in a temporary folder, not to alter the bundled ones
+        paths = {name: os.path.join(tmp_dir, name) for name in ['data', 'categories', 'models']}
+        shutil.copytree(data_path_no_inp, paths['data'])
+        os.makedirs(paths['categories'])
+        os.makedirs(paths['models'])
+
+        ##### Init #####
+        datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        models = MLModels(db, datasets, paths['models'], paths['models'])
+        lb_per_var, ub_per_var = datasets.extract_var_bounds('toyalgstr')
+        old_model = models.get_model('toyalgstr', 'vm', 'time')
+        old_errors = datasets.get_error_stats(models, 'toyalgstr', 'vm', 'time')
+        dataset = datasets.get_raw_dataset('toyalgstr', 'vm')
+
+        ##### Invalid rows are rejected #####
+        rows = dataset.head(2).to_dict('records')
+        for invalid_rows in [[{var: value for var, value in rows[0].items() if var != 'time'}],
+                             [dict(rows[0], var_3=2)]]:
+            try:
+                ingest_rows(datasets, models, 'toyalgstr', 'vm', invalid_rows)
+                assert False, 'invalid rows accepted'
+            except (AttributeError, ValueError) as e:
+                print(e)
+        assert len(datasets.get_raw_dataset('toyalgstr', 'vm')) == len(dataset)
+
+        ##### Rows are added, derived data updated #####
+        new_rows = [dict(rows[0], var_0=ub_per_var['var_0'] + 1, time=ub_per_var['time'] * 2), rows[1]]
+        ret = ingest_rows(datasets, models, 'toyalgstr', 'vm', new_rows, wait=True)
+        print(ret)
+        assert ret['rows'] == 2 and set(ret['bounds_changed']) == {'var_0', 'time'}
+        assert len(datasets.get_raw_dataset('toyalgstr', 'vm')) == len(dataset) + 2
+
+        # the updated bounds match the ones computed from scratch
+        new_lb_per_var, new_ub_per_var = datasets.extract_var_bounds('toyalgstr')
+        assert new_ub_per_var['time'] == ub_per_var['time'] * 2 and new_ub_per_var['var_0'] == ub_per_var['var_0'] + 1
+        fresh = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        assert fresh.extract_var_bounds('toyalgstr') == (new_lb_per_var, new_ub_per_var)
+
+        # models were retrained on the new rows, error statistics computed again
+        new_model = models.get_model('toyalgstr', 'vm', 'time')
+        new_errors = datasets.get_error_stats(models, 'toyalgstr', 'vm', 'time')
+        assert len(new_errors) == len(old_errors) + 2
+        expanded = fresh.get_dataset('toyalgstr', 'vm')
+        ml_inputs = datasets.expander.get_expanded_ml_input_vars('toyalgstr')
+        assert np.allclose(new_errors, np.abs(expanded['time'].values - new_model.predict(expanded[ml_inputs].values)))
+
+        ##### New categories extend the mapping, all the models of the algorithm are retrained #####
+        old_rules = models.get_rules('toyalgstr', 'vm', 'time')
+        ret = ingest_rows(datasets, models, 'toyalgstr', 'vm', [dict(rows[0], cat_0='unknown')], wait=True)
+        print(ret)
+        assert ret['new_categories'] == {'cat_0': ['unknown']}
+        assert 'unknown' in fresh.expander.get_categories_per_str_var('toyalgstr')['cat_0']
+        new_ml_inputs = datasets.expander.get_expanded_ml_input_vars('toyalgstr')
+        assert set(new_ml_inputs) - set(ml_inputs) == {'cat_0_unknown'}
+        for hw in db.get_hws('toyalgstr'):
+            for target in db.get_targets('toyalgstr'):
+                if target != 'price':
+                    assert models.get_model_info('toyalgstr', hw, target)['features'] == new_ml_inputs
+                    assert not models.get_stale_reasons('toyalgstr', hw, target)
+        assert models.get_rules('toyalgstr', 'vm', 'time').leaf_lb.shape[1] == len(new_ml_inputs)
+
+        # until retrained, models are used with the features they were trained on
+        reindexed = old_rules.reindex(ml_inputs, new_ml_inputs)
+        unknown = new_ml_inputs.index('cat_0_unknown')
+        assert np.isinf(reindexed.leaf_lb[:, unknown]).all() and np.isinf(reindexed.leaf_ub[:, unknown]).all()
+        assert np.array_equal(reindexed.leaf_lb[:, [new_ml_inputs.index(var) for var in ml_inputs]], old_rules.leaf_lb)
+        expanded = fresh.get_dataset('toyalgstr', 'vm')
+        assert expanded['cat_0_unknown'].sum() == 1
+        assert np.allclose(datasets.get_error_stats(models, 'toyalgstr', 'vm', 'time'),
+                           np.abs(expanded['time'].values - models.get_model('toyalgstr', 'vm', 'time').predict(expanded[new_ml_inputs].values)))
+
+        ##### Rows appended concurrently by several processes (e.g. workers) are all kept #####
+        n_rows = len(datasets.get_raw_dataset('toyalgstr', 'vm'))
+        pids = []
+        for _ in range(4):
+            pid = os.fork()
+            if pid == 0:
+                worker_datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+                for _ in range(10):
+                    worker_datasets.append_rows('toyalgstr', 'vm', dataset.head(1))
+                os._exit(0)
+            pids.append(pid)
+        assert all(os.waitpid(pid, 0)[1] == 0 for pid in pids)
+        assert len(datasets.get_raw_dataset('toyalgstr', 'vm')) == n_rows + 40
+        assert not [f for f in os.listdir(paths['data']) if f.endswith('.tmp')]
+    print('Ingestion OK')
@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets, dataset_fingerprint, smallest_dtype
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+
+    ##### Smallest dtypes represent the values exactly #####
+    assert smallest_dtype(np.array([0, 1, 127])) == np.int8
+    assert smallest_dtype(np.array([0., 300.])) == np.int16
+    assert smallest_dtype(np.array([0.5, 1.25])) == np.float32
+    assert smallest_dtype(np.array([0.1, 1.])) == np.float64
+    assert smallest_dtype(np.array([np.nan, 1.])) == np.float32
+    assert smallest_dtype(np.array([True, False])) == bool
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {name: os.path.join(tmp_dir, name) for name in ['data', 'categories', 'arrays']}
+        shutil.copytree(data_path_no_inp, paths['data'])
+        os.makedirs(paths['categories'])
+
+        ##### Compact datasets hold the same values in less memory #####
+        plain = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        compact = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'],
+                                      compact=True)
+        stored = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'],
+                                     paths['arrays'], compact=True)
+        for algorithm, hw in [('toyalgstr', 'vm'), ('toyalg', 'pc'), ('huaweitask', db.get_hws('huaweitask')[0])]:
+            expected = plain.get_dataset(algorithm, hw)
+            for dataset in [compact.get_dataset(algorithm, hw), stored.get_dataset(algorithm, hw)]:
+                assert list(dataset.columns) == list(expected.columns)
+                assert np.array_equal(dataset.to_numpy(dtype=float), expected.to_numpy(dtype=float), equal_nan=True)
+                assert dataset_fingerprint(dataset) == dataset_fingerprint(expected)
+            nbytes = stored.get_dataset_nbytes(algorithm, hw)
+            print(algorithm, hw, expected.memory_usage(index=False).sum(), nbytes)
+            assert nbytes < expected.memory_usage(index=False).sum()
+        # one-hot columns are stored as category codes
+        arrays, attrs = stored.store.get('input-independent/toyalgstr_vm', stored._get_dataset_version('toyalgstr', 'vm'))
+        onehot = list(stored.expander.get_expanded_vars_per_str_var('toyalgstr').values())
+        assert list(attrs['codes'].values()) == onehot and all(arrays[codes].dtype == np.int8 for codes in attrs['codes'])
+        assert plain.get_dataset_nbytes('toyalgstr', 'vm') is None
+
+    ##### Memory report #####
+    from vemm import app as service
+    client = service.app.test_client()
+    request = {'algorithm': 'toyalgstr', 'objective': {'target': 'memory', 'type': 'min'}, 'robustness_fact': 0.5,
+               'constraints': [{'target': 'time', 'type': 'leq', 'value': 120}], 'country': None}
+    assert 'error' not in client.post('/optimize', json=request).json
+    report = client.get('/debug/memory').json
+    print(report['totals'], report['process'])
+    entry = report['algorithms']['input-independent']['toyalgstr']['vm']
+    assert entry['dataset'] > 0 and set(entry['models']) == {'time', 'memory'} and set(entry['error_stats']) == {'time'}
+    assert report['totals']['catalog'] == service.catalog.get_nbytes() and report['process']['rss'] > 0
+    print('Memory OK')
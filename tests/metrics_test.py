@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from vemm.core.metrics import Metrics
+
+if __name__ == '__main__':
+
+    metrics = Metrics()
+
+    ##### Recording #####
+    with metrics.span('solve', algorithm='toyalg', input_case='input-independent'):
+        pass
+    metrics.observe_phase('build', 0.2, algorithm='toyalg', input_case='input-independent')
+    metrics.observe_phase('build', 3, algorithm='toyalg', input_case='input-independent')
+    metrics.cache_lookup('models', hit=True)
+    metrics.cache_lookup('models', hit=True)
+    metrics.cache_lookup('models', hit=False)
+    metrics.register_gauge('models_training', lambda: 2)
+
+    ##### Exporting #####
+    out = metrics.render()
+    print(out)
+
+    build_labels = 'algorithm="toyalg",input_case="input-independent",phase="build"'
+    assert f'vemm_phase_duration_seconds_bucket{{{build_labels},le="0.25"}} 1' in out
+    assert f'vemm_phase_duration_seconds_bucket{{{build_labels},le="5.0"}} 2' in out
+    assert f'vemm_phase_duration_seconds_bucket{{{build_labels},le="+Inf"}} 2' in out
+    assert f'vemm_phase_duration_seconds_count{{{build_labels}}} 2' in out
+    assert 'vemm_cache_hit_ratio{cache="models"} 0.6666666666666666' in out
+    assert 'vemm_models_training 2' in out
+
+    # callbacks are evaluated without holding the lock: metrics can be recorded meanwhile (e.g. by other threads)
+    def training_callback():
+        metrics.cache_lookup('datasets', hit=True)
+        return 3
+    metrics.register_gauge('models_training', training_callback)
+    out = metrics.render()
+    assert 'vemm_models_training 3' in out and 'vemm_cache_hit_ratio{cache="datasets"} 1.0' in out
+
+    ##### Sharing across processes #####
+    with tempfile.TemporaryDirectory() as path:
+        metrics.share(path)
+        pid = os.fork()
+        if pid == 0:
+            # e.g. a worker: its values are added to the ones of the others, gauges only while it runs
+            metrics.reset()
+            metrics.cache_lookup('models', hit=False)
+            metrics.observe_phase('build', 0.2, algorithm='toyalg', input_case='input-independent')
+            metrics.register_gauge('solver_threads_in_use', lambda: 4)
+            metrics.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        metrics.register_gauge('solver_threads_in_use', lambda: 1)
+        out = metrics.render()
+        assert f'vemm_phase_duration_seconds_count{{{build_labels}}} 3' in out
+        assert f'vemm_phase_duration_seconds_bucket{{{build_labels},le="0.25"}} 2' in out
+        assert 'vemm_cache_requests_total{cache="models",result="miss"} 2.0' in out
+        assert 'vemm_cache_hit_ratio{cache="models"} 0.5' in out
+        assert 'vemm_solver_threads_in_use 1' in out and 'vemm_models_training 3' in out
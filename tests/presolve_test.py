@@ -0,0 +1,205 @@
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+from sklearn.tree import DecisionTreeRegressor
+from vemm.core.tree_rules import TreeRules, extract_leaf_boxes, snap_integer_boxes, prediction_range, embedding_size
+from vemm.core.presolve import prune_hws, get_target_ranges, get_ml_input_bounds
+from vemm.core.configdb import ConfigDB
+from vemm.core.optimization_request import OptimizationRequest, UserConstraints, HardwarePrices
+
+
+def leaf_range(rules, var_bounds, target, lb, ub):
+    """Range of the values of the leaves whose box meets [lb, ub], within the bounds of the target (None if empty)."""
+    values = rules.values[np.all((rules.leaf_lb <= ub) & (lb <= rules.leaf_ub), axis=1)]
+    target_lb, target_ub = var_bounds[target]['lb'], var_bounds[target]['ub']
+    if len(values) == 0 or values.min() > target_ub or values.max() < target_lb:
+        return None
+    return max(values.min(), target_lb), min(values.max(), target_ub)
+
+
+def presolve(algorithm, input_dependent, var_bounds=None):
+    """Presolve of the representative request for an algorithm (see benchmark.generate_request), and the model built after it."""
+    from vemm import app as service
+    from vemm.utils.benchmark import generate_request
+    from vemm.core.hada import prepare_model, build_model
+    with redirect_stdout(sys.stderr):
+        request = service.parse_request_json(generate_request(algorithm, input_dependent))
+        if var_bounds is None:
+            var_bounds = service.datasets.get_var_bounds_all(request)
+        spec, hws, trees, _ = prepare_model(service.db, service.datasets, request, service.models, var_bounds, None)
+        mdl, _ = build_model(spec, hws, trees)
+    return spec, hws, trees, mdl
+
+if __name__ == '__main__':
+
+    ##### Leaf boxes #####
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 10, size=(500, 3))
+    y = X[:, 0] * 2 + np.sin(X[:, 1]) * 5 + (X[:, 2] > 5) * 3
+    dt = DecisionTreeRegressor(max_depth=6, random_state=42).fit(X, y)
+
+    values, leaf_lb, leaf_ub = extract_leaf_boxes(dt, 3)
+    assert len(values) == dt.get_n_leaves()
+    # each sample falls in the box of the leaf it is assigned to
+    for x, pred in zip(X, dt.predict(X)):
+        inside = np.all((leaf_lb <= x) & (x <= leaf_ub), axis=1)
+        assert np.isclose(values[inside], pred).any()
+
+    # the range within a box contains all the predictions in the box
+    lb, ub = np.array([2, 0, 6]), np.array([4, 10, 10])
+    min_pred, max_pred = prediction_range(dt, lb, ub)
+    samples = rng.uniform(lb, ub, size=(2000, 3))
+    preds = dt.predict(samples)
+    assert min_pred <= preds.min() and preds.max() <= max_pred
+    print(f'Range in box: ({min_pred}, {max_pred}); sampled: ({preds.min()}, {preds.max()})')
+
+    ##### Compiled rules #####
+    rules = TreeRules.from_model(dt, 3)
+    assert rules.n_leaves == dt.get_n_leaves() and rules.prediction_range(lb, ub) == (min_pred, max_pred)
+    assert rules.features.tolist() == [feature in dt.tree_.feature for feature in range(3)]
+    assert embedding_size(dt, 3)['constraints'] == 2 + np.isfinite(leaf_lb).sum() + np.isfinite(leaf_ub).sum()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.rules.npz')
+        rules.save(path, 123)
+        assert os.listdir(tmp) == ['model.rules.npz']
+        loaded = TreeRules.load(path, 123)
+        assert np.array_equal(loaded.values, values) and np.array_equal(loaded.leaf_ub, leaf_ub)
+        # compiled from another version of the model, or with another compaction tolerance
+        assert TreeRules.load(path, 456) is None and TreeRules.load(os.path.join(tmp, 'missing'), 123) is None
+        assert TreeRules.load(path, 123, tolerance=0.0) is None
+        TreeRules.from_model(dt, 3, tolerance=0.0).save(path, 123)
+        assert TreeRules.load(path, 123) is None and TreeRules.load(path, 123, tolerance=0.0).tolerance == 0.0
+
+    ##### Compaction #####
+    def predict(rules, X):
+        # first leaf whose box contains each sample (left branches come first, as x <= th goes left)
+        return np.array([rules.values[np.argmax(np.all((rules.leaf_lb <= x) & (x <= rules.leaf_ub), axis=1))] for x in X])
+
+    # sibling leaves with the same value are merged, without changing the predictions
+    dt_same = DecisionTreeRegressor(max_depth=4, random_state=42).fit(X[:, :2], y)
+    tree = dt_same.tree_
+    left, right = tree.children_left, tree.children_right
+    node = next(node for node in range(tree.node_count) if left[node] != right[node] and left[left[node]] == right[left[node]]
+                and left[right[node]] == right[right[node]])
+    tree.value[right[node]] = tree.value[left[node]]
+    rules = TreeRules.from_model(dt_same, 2, tolerance=0.0)
+    assert rules.trained_leaves == dt_same.get_n_leaves() and rules.n_leaves == dt_same.get_n_leaves() - 1
+    assert np.array_equal(predict(rules, X[:, :2]), dt_same.predict(X[:, :2]))
+    assert TreeRules.from_model(dt_same, 2).n_leaves == dt_same.get_n_leaves()
+
+    range_ = values.max() - values.min()
+    leaves = dt.get_n_leaves()
+    for tolerance in [0.0, 0.01, 0.05, 0.2]:
+        rules = TreeRules.from_model(dt, 3, tolerance)
+        assert rules.n_leaves <= leaves and rules.trained_leaves == dt.get_n_leaves()
+        leaves = rules.n_leaves
+        assert np.abs(predict(rules, samples) - dt.predict(samples)).max() <= tolerance * range_ / 2 + 1e-9
+        print(f'Compaction with tolerance {tolerance}: {rules.trained_leaves} -> {rules.n_leaves} leaves')
+    assert leaves < dt.get_n_leaves()
+
+    ##### Snapping of the integer features #####
+    X_int = np.column_stack([rng.integers(0, 10, 500), rng.integers(0, 2, 500), rng.uniform(0, 10, 500)])
+    y_int = X_int[:, 0] ** 2 + X_int[:, 1] * 20 + X_int[:, 2]
+    dt_int = DecisionTreeRegressor(max_depth=6, random_state=42).fit(X_int, y_int)
+    integer = np.array([True, True, False])
+    rules = TreeRules.from_model(dt_int, 3, integer=integer)
+    bounds = np.concatenate([rules.leaf_lb[:, integer], rules.leaf_ub[:, integer]])
+    assert np.all(bounds[np.isfinite(bounds)] % 1 == 0)
+    # integer values fall in exactly one box, the one of the leaf the tree assigns them to
+    grid = np.array([[x0, x1, x2] for x0 in range(10) for x1 in range(2) for x2 in np.linspace(0.05, 9.95, 7)])
+    inside = np.all((rules.leaf_lb <= grid[:, None]) & (grid[:, None] <= rules.leaf_ub), axis=2)
+    assert np.all(inside.sum(axis=1) == 1)
+    assert np.array_equal(rules.values[inside.argmax(axis=1)], dt_int.predict(grid))
+
+    # leaves with no integer value in their box are dropped
+    leaf_lb, leaf_ub = np.array([[-np.inf], [3.2], [3.5]]), np.array([[3.2], [3.5], [np.inf]])
+    values, leaf_lb, leaf_ub = snap_integer_boxes(np.array([1., 2., 3.]), leaf_lb, leaf_ub, np.array([True]))
+    assert values.tolist() == [1, 3] and leaf_ub[0, 0] == 3 and leaf_lb[1, 0] == 4
+
+    ##### Pruning #####
+    db = ConfigDB.from_local('./vemm/algorithms/configs/input-independent',
+                             './vemm/algorithms/configs/input-dependent',
+                             './vemm/algorithms/carbon_intensity')
+    user_constraints = UserConstraints(db, 'toyalg')
+    user_constraints.add_constraint('time', 'leq', 50)
+    user_constraints.add_constraint('price', 'leq', 250)
+    hws_prices = HardwarePrices(db, 'toyalg')
+    hws_prices.add_hw_price('pc', 100)
+    hws_prices.add_hw_price('g100', 200)
+    hws_prices.add_hw_price('vm', 300)
+    request = OptimizationRequest(db, 'toyalg', 'memory', 'min', None, user_constraints, hws_prices, None)
+
+    target_ranges = {('pc', 'time'): (60, 100), ('g100', 'time'): (10, 100), ('vm', 'time'): (10, 100)}
+    # pc is too slow, vm too expensive
+    reasons = {}
+    assert prune_hws(request, ['pc', 'g100', 'vm'], target_ranges, None, reasons) == ['g100']
+    assert set(reasons) == {'pc', 'vm'} and reasons['pc'].startswith('time leq 50') and reasons['vm'].startswith('price leq 250')
+    # robustness makes g100 infeasible too
+    robust_coeff = {('pc', 'time'): 0, ('g100', 'time'): 45, ('vm', 'time'): 0,
+                    ('pc', 'price'): 0, ('g100', 'price'): 0, ('vm', 'price'): 0}
+    assert prune_hws(request, ['pc', 'g100', 'vm'], target_ranges, robust_coeff) == []
+
+    ##### Target ranges #####
+    # the bounds of each (hw, target) variable are the range of the leaves its tree can reach
+    spec, hws, trees, mdl = presolve('toyalg', False)
+    for (hw, target), rules in trees.items():
+        target_range = leaf_range(rules, spec.var_bounds, target, spec.ml_lb, spec.ml_ub)
+        assert target_range is not None and spec.target_ranges[(hw, target)] == target_range
+        var = mdl.get_var_by_name(f'{hw}_{target}')
+        assert (var.lb, var.ub) == target_range, (hw, target, var.lb, var.ub, target_range)
+    # all the leaves are reachable within unbounded features
+    for rules in trees.values():
+        n = rules.leaf_lb.shape[1]
+        assert rules.prediction_range(np.full(n, -np.inf), np.full(n, np.inf)) == (rules.values.min(), rules.values.max())
+
+    # user bounds on the variables narrow the ranges: hyperparameters restrict the leaves, targets clip them
+    narrow_bounds = {var: dict(bounds) for var, bounds in spec.var_bounds.items()}
+    narrow_bounds['var_0']['ub'] = narrow_bounds['var_0']['lb'] + 1
+    narrow_bounds['time']['ub'] = np.mean(spec.target_ranges[('g100', 'time')])
+    narrow_spec, narrow_hws, _, narrow_mdl = presolve('toyalg', False, narrow_bounds)
+    narrower = 0
+    for (hw, target), rules in trees.items():
+        target_range = leaf_range(rules, narrow_bounds, target, narrow_spec.ml_lb, narrow_spec.ml_ub)
+        assert narrow_spec.target_ranges[(hw, target)] == target_range
+        if target_range is None:
+            assert hw not in narrow_hws
+            continue
+        old_range = spec.target_ranges[(hw, target)]
+        assert old_range[0] <= target_range[0] and target_range[1] <= old_range[1]
+        narrower += target_range != old_range
+        if hw in narrow_hws:
+            var = narrow_mdl.get_var_by_name(f'{hw}_{target}')
+            assert (var.lb, var.ub) == target_range
+    assert narrower > 0 and narrow_spec.target_ranges[('g100', 'time')][1] == narrow_bounds['time']['ub']
+
+    # fixed inputs narrow the ranges too
+    spec, hws, trees, mdl = presolve('anticipate', True)
+    assert spec.fixed_inputs
+    free_ranges = get_target_ranges(trees, spec.var_bounds, *get_ml_input_bounds(spec.ml_input_vars, spec.var_bounds, {}))
+    narrower = 0
+    for (hw, target), rules in trees.items():
+        target_range = spec.target_ranges[(hw, target)]
+        assert target_range == leaf_range(rules, spec.var_bounds, target, spec.ml_lb, spec.ml_ub)
+        free_range = free_ranges[(hw, target)]
+        assert free_range[0] <= target_range[0] and target_range[1] <= free_range[1]
+        narrower += target_range != free_range
+        var = mdl.get_var_by_name(f'{hw}_{target}')
+        assert (var.lb, var.ub) == target_range
+    assert narrower > 0
+
+    ##### Requests whose hws are all dropped tell why #####
+    from vemm import app as service
+    data = {'algorithm': 'toyalg', 'objective': {'target': 'memory', 'type': 'min'}, 'robustness_fact': None,
+            'constraints': [{'target': 'time', 'type': 'leq', 'value': 1}], 'country': None}
+    with redirect_stdout(sys.stderr):
+        ret = service.solve_request_json(data)
+    print(ret)
+    assert ret['solution'] is None and ret['status'] == 'infeasible'
+    assert set(ret['pruned_hws']) == set(service.db.get_hws('toyalg'))
+    assert all(reason.startswith('time leq 1 cannot be met') for reason in ret['pruned_hws'].values())
+    print('Pruning OK')
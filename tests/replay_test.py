@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import tempfile
+from contextlib import redirect_stdout
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+from vemm.core.model_export import ModelExporter, list_models
+from vemm.utils.replay import run_replay
+
+if __name__ == '__main__':
+
+    from vemm import app as service
+    data = {'algorithm': 'toyalgstr', 'objective': {'target': 'memory', 'type': 'min'}, 'robustness_fact': None,
+            'constraints': [{'target': 'time', 'type': 'leq', 'value': 120}], 'country': None}
+    decomposed = {'algorithm': 'face-recognition', 'objective': {'target': 'PREPROCESSING_TIME', 'type': 'max'},
+                  'robustness_fact': None, 'constraints': [{'target': 'INFERENCE_TIME', 'type': 'leq', 'value': 600}],
+                  'country': None, 'solver': {'decompose': True, 'workers': 1}}
+
+    ##### Requests can be written back in the /optimize schema #####
+    request = service.parse_request_json(decomposed)
+    assert service.parse_request_json(request.to_json()).get_fingerprint() == request.get_fingerprint()
+
+    with tempfile.TemporaryDirectory() as corpus:
+        ##### Sampled models are exported, along with their request and solve statistics #####
+        service.model_exporter = ModelExporter(corpus, sample_rate=0)
+        service.solve_request_json(data)
+        assert os.listdir(corpus) == []
+
+        service.model_exporter = ModelExporter(corpus, max_models=2)
+        solution = service.solve_request_json(data)
+        service.solve_request_json(decomposed)
+        # the limit is reached
+        service.solve_request_json(dict(data, constraints=[{'target': 'time', 'type': 'leq', 'value': 100}]))
+        service.model_exporter = None
+
+        exported = list_models(corpus)
+        print([(metadata['name'], metadata['hws']) for metadata in exported])
+        assert len({metadata['fingerprint'] for metadata in exported}) == 2
+        assert not any(name.startswith('.') for name in os.listdir(corpus))
+        monolithic = next(metadata for metadata in exported if metadata['algorithm'] == 'toyalgstr')
+        assert os.path.exists(os.path.join(corpus, monolithic['model'])) and monolithic['model'].endswith('.mps')
+        assert monolithic['request']['objective'] == data['objective'] and monolithic['stats']['proven_optimal']
+        assert abs(monolithic['stats']['objective'] - solution['solution']['targets']['memory']) < 1e-3
+        subproblems = [metadata for metadata in exported if metadata['algorithm'] == 'face-recognition']
+        # one model per hw solved (hws whose bound cannot improve the best solution are skipped)
+        assert subproblems and all(len(metadata['hws']) == 1 and metadata['name'].endswith(metadata['hws'][0]) for metadata in subproblems)
+
+        ##### Exported models solve again to the same objectives #####
+        with redirect_stdout(sys.stderr):
+            report = run_replay(corpus, settings={'threads': 1}, repeats=2)
+        print(json.dumps(report['summary']))
+        assert report['summary']['instances'] == len(exported) and report['summary']['errors'] == 0
+        assert report['summary']['objective_mismatches'] == 0
+        for result in report['results']:
+            assert result['replayed']['nodes'] is not None and result['replayed']['variables'] > 0
+
+        ##### Rebuilt from their requests, one instance per request #####
+        with redirect_stdout(sys.stderr):
+            rebuilt = run_replay(corpus, rebuild=True, baseline=None)
+        print(json.dumps(rebuilt['summary']))
+        assert rebuilt['summary']['instances'] == 2 and rebuilt['summary']['objective_mismatches'] == 0
+        assert {result['name'] for result in rebuilt['results']} == {metadata['request_name'] for metadata in exported}
+
+        # a replay can be the reference of another one
+        with redirect_stdout(sys.stderr):
+            compared = run_replay(corpus, rebuild=True, baseline=rebuilt)
+        assert compared['meta']['reference'] == 'baseline' and compared['summary']['reference_time'] == rebuilt['summary']['time']
+    print('Replay OK')
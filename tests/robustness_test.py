@@ -0,0 +1,92 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+from vemm.core.optimization_request import OptimizationRequest, UserConstraints, HardwarePrices
+from vemm.core.tree_rules import TreeRules
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {name: os.path.join(tmp_dir, name) for name in ['data', 'categories', 'models', 'models_inp', 'arrays']}
+        shutil.copytree(data_path_no_inp, paths['data'])
+        for name in ['categories', 'models', 'models_inp']:
+            os.makedirs(paths[name])
+
+        datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'],
+                                       paths['arrays'])
+        models = MLModels(db, datasets, paths['models'], paths['models_inp'])
+        hws = db.get_hws('toyalg')
+        for hw in hws:
+            for target in ['time', 'memory']:
+                models.get_model('toyalg', hw, target)
+
+        def make_request(constraints, robustness_fact=0.9):
+            user_constraints = UserConstraints(db, 'toyalg')
+            for target, (constr_type, value) in constraints.items():
+                user_constraints.add_constraint(target, constr_type, value)
+            hws_prices = HardwarePrices(db, 'toyalg')
+            for hw, price in db.get_prices_per_hw('toyalg').items():
+                hws_prices.add_hw_price(hw, price)
+            return OptimizationRequest(db, 'toyalg', 'time', 'min', robustness_fact, user_constraints, hws_prices, None)
+
+        ##### Coefficients (computed on a cold cache, one thread per hw) only for the constrained targets #####
+        request = make_request({'memory': ('leq', 100), 'price': ('leq', 10)})
+        robust_coeff = datasets.get_robust_coeff(models, request)
+        print(robust_coeff)
+        assert set(robust_coeff) == {(hw, target) for hw in hws for target in ['memory', 'price']}
+        assert all(robust_coeff[(hw, 'price')] == 0 for hw in hws)
+
+        # same as computed target by target with pandas
+        ml_inputs = datasets.expander.get_expanded_ml_input_vars('toyalg')
+        for hw in hws:
+            dataset = datasets.get_dataset('toyalg', hw)
+            errors = (dataset['memory'] - models.get_model('toyalg', hw, 'memory').predict(dataset[ml_inputs].values)).abs()
+            assert np.isclose(robust_coeff[(hw, 'memory')], errors.std() * errors.quantile(0.9))
+            # the dataset is not altered
+            assert list(dataset.columns) == list(datasets.get_dataset('toyalg', hw).columns)
+
+        ##### Warm cache: the stored errors are reused #####
+        for hw in hws:
+            datasets.get_error_stats_per_target(models, 'toyalg', hw, ['time', 'memory'])
+        assert datasets.get_robust_coeff(models, request) == robust_coeff
+        request = make_request({'time': ('leq', 1000), 'memory': ('leq', 100)}, robustness_fact=0)
+        robust_coeff = datasets.get_robust_coeff(models, request)
+        assert set(robust_coeff) == {(hw, target) for hw in hws for target in ['time', 'memory']}
+
+        # no constraints, no coefficients; no robustness, no coefficients at all
+        assert datasets.get_robust_coeff(models, make_request({})) == {}
+        assert datasets.get_robust_coeff(models, make_request({'time': ('leq', 1000)}, robustness_fact=None)) is None
+
+        ##### With compacted trees, errors are the ones of the trees as embedded #####
+        compacting_datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        compacting_models = MLModels(db, compacting_datasets, paths['models'], paths['models_inp'], compaction_tolerance=0.2)
+        hw = hws[0]
+        model = compacting_models.get_model('toyalg', hw, 'time')
+        dataset = compacting_datasets.get_dataset('toyalg', hw)
+        X = dataset[ml_inputs].to_numpy(dtype=np.float64)
+        rules = TreeRules.from_model(model, X.shape[1], 0.2)
+        assert rules.n_leaves < rules.trained_leaves
+        # prediction of the leaf whose box holds each row (the left one, on a threshold)
+        holds = np.all((X[:, None, :] >= rules.leaf_lb[None]) & (X[:, None, :] <= rules.leaf_ub[None]), axis=2)
+        embedded = rules.values[np.argmax(holds, axis=1)]
+        errors = compacting_datasets.get_error_stats(compacting_models, 'toyalg', hw, 'time')
+        assert np.allclose(errors, np.abs(dataset['time'].values - embedded))
+        plain_errors = datasets.get_error_stats(models, 'toyalg', hw, 'time')
+        assert not np.allclose(errors, plain_errors)
+        # predictions are shifted by at most half the tolerance times the range of the tree's predictions
+        shift = 0.1 * (model.tree_.value.max() - model.tree_.value.min())
+        assert np.all(np.abs(errors - plain_errors) <= shift + 1e-9)
+    print('Robustness OK')
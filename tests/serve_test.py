@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import socket
+import signal
+import tempfile
+import subprocess
+import requests
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+
+if __name__ == '__main__':
+
+    # free port for the service
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    url = f'http://127.0.0.1:{port}'
+
+    ##### The master warms up the state, then forks the workers #####
+    # entries left by a previous run are dropped at start-up
+    arrays_path = os.path.join(tempfile.mkdtemp(), 'arrays')
+    os.makedirs(os.path.join(arrays_path, 'stale'))
+    env = dict(os.environ, INIT_TYPE='local', PYTHONUNBUFFERED='1', ARRAYS_PATH=arrays_path)
+    master = subprocess.Popen([sys.executable, '-m', 'vemm.serve', '--workers', '2', '--port', str(port)],
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        for _ in range(300):
+            try:
+                response = requests.get(f'{url}/algorithms')
+                break
+            except requests.ConnectionError:
+                time.sleep(0.5)
+        assert response.status_code == 200 and 'toyalgstr' in response.json()['algorithms']['input-independent']
+        assert not os.path.exists(os.path.join(arrays_path, 'stale'))
+
+        ##### Requests are served by the workers #####
+        request = {'algorithm': 'toyalgstr', 'objective': {'target': 'memory', 'type': 'min'}, 'robustness_fact': 0.5,
+                   'constraints': [{'target': 'time', 'type': 'leq', 'value': 120}], 'country': None}
+        for _ in range(4):
+            solution = requests.post(f'{url}/optimize', json=request).json()
+            print(solution)
+            assert 'error' not in solution and solution['solution']['hw'] == 'vm'
+        # the compiled rules of the models are shared by the workers
+        assert os.listdir(os.path.join(arrays_path, 'rules', 'input-independent'))
+        # memory is reported a second after start-up
+        time.sleep(1.5)
+
+        ##### Metrics of all the workers are exported by each of them #####
+        # (snapshots are written every second)
+        for _ in range(6):
+            out = requests.get(f'{url}/metrics').text
+            admitted = sum(float(line.split()[-1]) for line in out.splitlines() if line.startswith('vemm_admitted_requests_total'))
+            assert admitted == 4, out
+    finally:
+        master.send_signal(signal.SIGTERM)
+        output = master.communicate(timeout=60)[0]
+    assert master.returncode == 0
+    # the store of the shared arrays is removed at exit
+    assert not os.path.exists(arrays_path)
+    os.rmdir(os.path.dirname(arrays_path))
+
+    ##### Unique memory of each worker is reported #####
+    report = [line for line in output.splitlines() if line.strip().startswith('worker')]
+    print('\n'.join(report))
+    assert len(report) == 2 and all('unique' in line for line in report)
+    print('Serve OK')
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+from vemm.core.single_flight import SingleFlight
+from vemm.core.metrics import metrics
+
+
+def run_concurrently(fn, n):
+    """Calls fn from n threads started together; returns the results (or exceptions)."""
+    barrier = threading.Barrier(n)
+    results = [None] * n
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def coalesced(call):
+    return metrics.counters['coalesced_calls_total'][(('call', call),)]
+
+
+if __name__ == '__main__':
+
+    ##### Concurrent calls with the same key share one result (or exception) #####
+    flights = SingleFlight('test')
+    calls = []
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.3)
+        return object()
+    results = run_concurrently(lambda: flights.do('key', slow_call), 4)
+    assert len(calls) == 1 and all(result is results[0] for result in results) and coalesced('test') == 3
+
+    def failing_call():
+        time.sleep(0.3)
+        raise ValueError('failed')
+    results = run_concurrently(lambda: flights.do('key', failing_call), 3)
+    assert all(isinstance(result, ValueError) for result in results)
+
+    # ended calls are not reused
+    assert flights.do('key', lambda: 1) == 1 and flights._calls == {}
+
+    ##### Identical requests have the same fingerprint #####
+    from vemm import app as service
+    data = {'algorithm': 'toyalgstr', 'objective': {'target': 'memory', 'type': 'min'}, 'robustness_fact': 0.5,
+            'constraints': [{'target': 'time', 'type': 'leq', 'value': 120}, {'target': 'memory', 'type': 'geq', 'value': 0}],
+            'country': None}
+    reordered = dict(data, constraints=data['constraints'][::-1])
+    fingerprint = service.parse_request_json(data).get_fingerprint()
+    assert service.parse_request_json(reordered).get_fingerprint() == fingerprint
+    assert service.parse_request_json(dict(data, robustness_fact=0.6)).get_fingerprint() != fingerprint
+
+    ##### Concurrent identical requests are solved once #####
+    before = coalesced('optimize')
+    results = run_concurrently(lambda: service.solve_request_json(data), 4)
+    print(results[0], coalesced('optimize') - before)
+    assert all(result == results[0] for result in results) and 'error' not in results[0]
+    assert coalesced('optimize') > before
+
+    ##### Concurrent callers of a missing model wait for one training #####
+    db = service.db
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = {name: os.path.join(tmp_dir, name) for name in ['data', 'categories', 'models', 'models_inp']}
+        shutil.copytree('./vemm/algorithms/data/input-independent', paths['data'])
+        for name in ['categories', 'models', 'models_inp']:
+            os.makedirs(paths[name])
+        datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        models = MLModels(db, datasets, paths['models'], paths['models_inp'])
+
+        before = coalesced('training')
+        results = run_concurrently(lambda: models.get_model('toyalgstr', 'vm', 'time'), 4)
+        assert not any(isinstance(result, Exception) for result in results), results
+        assert all(result is results[0] for result in results) and coalesced('training') == before + 3
+        assert len(models.ongoing_training) == 0
+    print('Single flight OK')
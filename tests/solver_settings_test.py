@@ -0,0 +1,62 @@
+import os
+import sys
+from contextlib import redirect_stdout
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+os.environ['INIT_TYPE'] = 'local'
+from vemm.core.optimization_request import SolverSettings
+
+if __name__ == '__main__':
+
+    ##### Settings are checked #####
+    for setting, value in [('time_limit', 0.5), ('mip_gap', 0), ('threads', 2), ('emphasis', 'feasibility'),
+                           ('solve_stats', True), ('workers', 1)]:
+        SolverSettings.check_setting(setting, value)
+    for setting, value in [('time_limit', -1), ('mip_gap', -0.1), ('emphasis', 'fastest'), ('emphasis', 1),
+                           ('threads', True), ('threads', 1.5), ('time_limit', '10'), ('workers', 0), ('solve_stats', 1),
+                           ('nodes', 10)]:
+        try:
+            SolverSettings.check_setting(setting, value)
+            assert False, f'{setting}={value!r} accepted'
+        except AttributeError as e:
+            print(e)
+
+    from vemm import app as service
+    from vemm.utils.benchmark import generate_request
+
+    # None keeps the default, invalid settings reject the request
+    settings = SolverSettings(service.db, 'anticipate', True)
+    settings.add_setting('time_limit', None)
+    assert 'time_limit' not in settings.get_settings()
+    data = generate_request('anticipate', True)
+    ret = service.solve_request_json(dict(data, solver={'threads': True}))
+    assert 'error' in ret and 'Number of threads' in ret['error']
+
+    ##### Anytime: on a time limit, the incumbent is returned, not proven optimal #####
+    with redirect_stdout(sys.stderr):
+        ret = service.solve_request_json(dict(data, solver={'time_limit': 0.001, 'threads': 1, 'solve_stats': True}))
+    print(ret)
+    solution = ret['solution']
+    assert solution is not None and solution['proven_optimal'] is False
+    stats = solution['solve_stats']
+    assert stats['proven_optimal'] is False and 'time limit' in stats['status']
+    assert stats['objective'] is not None and stats['best_bound'] is not None and stats['gap'] > 0
+    assert stats['variables'] > 0 and stats['constraints'] > 0 and stats['time'] < 1
+
+    # without an incumbent, the response tells that the time limit was reached (not that there is no solution)
+    for decompose in [False, True]:
+        solver = {'time_limit': 0, 'threads': 1, 'solve_stats': True, 'decompose': decompose, 'workers': 1}
+        with redirect_stdout(sys.stderr):
+            ret = service.solve_request_json(dict(data, solver=solver))
+            solution = service.run_hada(service.parse_request_json(dict(data, solver=solver)))
+        print(ret)
+        assert ret['solution'] is None and ret['status'] == 'time_limit'
+        assert ret['solve_stats']['objective'] is None and not ret['solve_stats']['proven_optimal']
+        assert not solution and 'time limit' in str(solution)
+
+    # without a limit, the optimum is proven
+    with redirect_stdout(sys.stderr):
+        ret = service.solve_request_json(dict(data, solver={'solve_stats': True}))
+    assert 'proven_optimal' not in ret['solution'] and ret['solution']['solve_stats']['proven_optimal']
+    assert ret['solution']['solve_stats']['objective'] <= stats['objective'] + 1e-6
+    print('Solver settings OK')
@@ -0,0 +1,67 @@
+import os
+import sys
+import shutil
+import tempfile
+import time
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # datasets, mappings and models are copied/created in a temporary folder, not to alter the bundled ones
+        paths = {name: os.path.join(tmp_dir, name) for name in ['data', 'categories', 'models', 'models_inp']}
+        shutil.copytree(data_path_no_inp, paths['data'])
+        os.makedirs(paths['categories'])
+        os.makedirs(paths['models'])
+        os.makedirs(paths['models_inp'])
+
+        ##### Init: models carry the metadata of their training #####
+        datasets = Datasets.from_local(db, paths['data'], paths['data'], paths['categories'], paths['categories'])
+        models = MLModels(db, datasets, paths['models'], paths['models_inp'])
+        old_model = models.get_model('toyalgstr', 'vm', 'time')
+        models.get_model('toyalgstr', 'vm', 'memory')
+        info = models.get_model_info('toyalgstr', 'vm', 'time')
+        print({key: value for key, value in info.items() if key in ['dataset_hash', 'features', 'versions']})
+        assert info['dataset_hash'] == datasets.get_fingerprint('toyalgstr', 'vm')
+        assert info['features'] == datasets.expander.get_expanded_ml_input_vars('toyalgstr')
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'time') == []
+        assert models.scan_stale() == []
+
+        # loaded models are reused
+        assert models.get_model('toyalgstr', 'vm', 'time') is old_model
+
+        ##### A dataset changed by other means makes its models stale #####
+        dataset_path = os.path.join(paths['data'], 'toyalgstr_vm.csv')
+        dataset = pd.read_csv(dataset_path)
+        dataset['time'] = dataset['time'] * 2
+        dataset.to_csv(dataset_path, index=False)
+
+        # not detected until the datasets are read again
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'time') == []
+        assert models.scan_stale() == [('toyalgstr', 'vm', False)]
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'time') == ['dataset changed']
+
+        # retrained in background, the old model being replaced when the new one is ready
+        while ('toyalgstr', 'vm', False) in models.retraining:
+            time.sleep(0.1)
+        new_model = models.get_model('toyalgstr', 'vm', 'time')
+        assert new_model is not old_model
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'time') == []
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'memory') == []
+
+        ##### Different training settings make the models stale #####
+        info = models.get_model_info('toyalgstr', 'vm', 'time')
+        info['settings']['min_samples_leaf'] = 2
+        assert models.get_stale_reasons('toyalgstr', 'vm', 'time', info=info) == ['training settings changed']
+    print('Staleness OK')
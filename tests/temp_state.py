@@ -0,0 +1,17 @@
+"""
+Imported by the tests using the service (see vemm/app.py), before it: categorical mappings and models are created
+and trained in a temporary folder (removed at exit), not in the source tree. The processes started by the tests
+inherit it through CATEGORIES_PATH and MODELS_PATH.
+"""
+import os
+import tempfile
+
+_state_dir = tempfile.TemporaryDirectory(prefix='vemm-tests-')
+categories_path = os.environ.setdefault('CATEGORIES_PATH', os.path.join(_state_dir.name, 'categorical_mappings'))
+models_path = os.environ.setdefault('MODELS_PATH', os.path.join(_state_dir.name, 'models'))
+categories_path_no_inp = os.path.join(categories_path, 'input-independent')
+categories_path_inp = os.path.join(categories_path, 'input-dependent')
+models_path_no_inp = os.path.join(models_path, 'input-independent')
+models_path_inp = os.path.join(models_path, 'input-dependent')
+for path in [categories_path_no_inp, categories_path_inp, models_path_no_inp, models_path_inp]:
+    os.makedirs(path, exist_ok=True)
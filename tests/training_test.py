@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import temp_state
+import docplex.mp.model
+from eml.backend import cplex_backend
+from eml.tree.reader.sklearn_reader import read_sklearn_tree
+from eml.tree import embed
+from vemm.core.configdb import ConfigDB
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels, TrainingSettings
+
+if __name__ == '__main__':
+
+    configs_path_no_inp = './vemm/algorithms/configs/input-independent'
+    configs_path_inp = './vemm/algorithms/configs/input-dependent'
+    data_path_no_inp = './vemm/algorithms/data/input-independent'
+    data_path_inp = './vemm/algorithms/data/input-dependent'
+    categories_path_no_inp = temp_state.categories_path_no_inp
+    categories_path_inp = temp_state.categories_path_inp
+    path_carbon_intensity = './vemm/algorithms/carbon_intensity'
+
+    ##### Init #####
+    db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, path_carbon_intensity)
+    datasets = Datasets.from_local(db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp)
+
+    ##### Settings are checked #####
+    for setting, value in [('max_depth', 0), ('max_leaf_nodes', 1), ('auto', 1), ('validation_split', 1.0), ('depth', 3)]:
+        try:
+            TrainingSettings.check_setting(setting, value)
+            assert False, f'{setting}={value} accepted'
+        except AttributeError as e:
+            print(e)
+    # default settings keep the original artifact names
+    assert TrainingSettings.get_tag(TrainingSettings.DEFAULTS) == '10'
+
+    with tempfile.TemporaryDirectory() as models_path:
+        ##### Auto mode selects a tree no deeper than max_depth #####
+        models = MLModels(db, datasets, models_path, models_path, training_settings={'auto': True, 'max_depth': 8})
+        dt = models.get_model('toyalg', 'pc', 'time')
+        info = models.get_model_info('toyalg', 'pc', 'time')
+        print(info)
+        assert info['params']['max_depth'] <= 8 and info['validation_error'] is not None
+        assert info['leaves'] == dt.get_n_leaves() and info['depth'] == dt.get_depth()
+        assert os.path.basename(os.listdir(models_path)[0]).startswith('toyalg_pc_time_DecisionTree_d8-lNone-s1-auto')
+
+        ##### A budget on the leaves bounds the size of the MILP #####
+        models = MLModels(db, datasets, models_path, models_path, training_settings={'max_leaf_nodes': 16})
+        dt = models.get_model('toyalg', 'pc', 'time')
+        info = models.get_model_info('toyalg', 'pc', 'time')
+        assert info['leaves'] <= 16
+
+        # the expected size matches the size of the encoding
+        input_vars = datasets.expander.get_expanded_ml_input_vars('toyalg', False)
+        tree = read_sklearn_tree(dt)
+        for idx in tree.attributes_ub.keys():
+            tree.update_lb(idx, -1e6)
+            tree.update_ub(idx, 1e6)
+        mdl = docplex.mp.model.Model()
+        tree_in = [mdl.continuous_var(lb=-1e6, ub=1e6) for _ in input_vars]
+        embed.encode_backward_implications(bkd=cplex_backend.CplexBackend(), mdl=mdl, tree=tree,
+                                           tree_in=tree_in, tree_out=mdl.continuous_var(lb=-1e6, ub=1e6), name='DT')
+        assert info['milp']['binary_variables'] == mdl.number_of_binary_variables
+        assert info['milp']['constraints'] == mdl.number_of_constraints
+    print('Training OK')
@@ -0,0 +1,130 @@
+"""
+Command-line interface of the service.
+
+batch: solves requests in the /optimize schema, one per line (JSON Lines), from a file or stdin, in-process and
+across multiple worker processes. The service state is warmed up once and shared by the workers (see serve).
+For each request, the /optimize response is written to stdout as a JSON line (along with the number of the line,
+starting from 1) as soon as it is solved, or in the input order with --ordered; a summary (throughput, failures,
+latency percentiles) is written to stderr at the end. Other messages of the service are written to stderr too.
+
+Usage (from the root folder):
+    python -m vemm batch requests.jsonl --workers 4 > solutions.jsonl
+    cat requests.jsonl | python -m vemm batch --ordered --summary summary.json
+"""
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+PERCENTILES = (50, 95, 99)
+
+
+def solve_line(numbered_line):
+    """Solves the request in a line; returns the number of the line, the /optimize response and the latency."""
+    from vemm import app as service
+    number, line = numbered_line
+    start = time.perf_counter()
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        ret = {'error': f'Invalid JSON: {e}'}
+    else:
+        ret = service.solve_request_json(data)
+    return number, ret, time.perf_counter() - start
+
+
+def read_lines(f):
+    """Numbered non-empty lines of a file."""
+    for number, line in enumerate(f, start=1):
+        if line.strip():
+            yield number, line
+
+
+def summarize(latencies, failures, no_solution, elapsed):
+    """Summary of a batch: number of requests, failures, requests without solution, throughput and latency (s)."""
+    from vemm.utils.benchmark import percentile
+    summary = {'requests': len(latencies),
+               'failures': failures,
+               'no_solution': no_solution,
+               'elapsed': elapsed,
+               'throughput': len(latencies) / elapsed if elapsed > 0 else None}
+    if latencies:
+        summary['latency'] = {f'p{q}': percentile(latencies, q) for q in PERCENTILES}
+        summary['latency']['mean'] = sum(latencies) / len(latencies)
+    return summary
+
+
+def batch(args, out):
+    from vemm import serve
+
+    lines = read_lines(sys.stdin if args.file == '-' else open(args.file))
+
+    start = time.perf_counter()
+    if args.warm_up:
+        serve.warm_up(serve.service.db, serve.service.datasets, serve.service.models)
+    warm_up_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        # the solver threads of the node are shared by the workers (see admission)
+        if 'SOLVER_THREADS' not in os.environ:
+            serve.service.admission.set_thread_budget(max(1, (os.cpu_count() or 1) // args.workers))
+        # workers are forked from the warmed-up process, sharing its state (see serve)
+        gc.collect()
+        gc.freeze()
+        pool = multiprocessing.get_context('fork').Pool(args.workers)
+        imap = pool.imap if args.ordered else pool.imap_unordered
+        results = imap(solve_line, lines)
+    else:
+        pool = None
+        results = map(solve_line, lines)
+
+    latencies, failures, no_solution = [], 0, 0
+    try:
+        for number, ret, latency in results:
+            out.write(json.dumps(dict(line=number, **ret)) + '\n')
+            out.flush()
+            latencies.append(latency)
+            failures += 'error' in ret
+            no_solution += 'solution' in ret and ret['solution'] is None
+    finally:
+        if pool is not None:
+            pool.terminate()
+    summary = summarize(latencies, failures, no_solution, time.perf_counter() - start)
+    summary['warm_up'] = warm_up_time
+
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    if args.summary:
+        json.dump(summary, open(args.summary, 'w'), indent=2)
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='vemm', description='Vertical Matchmaking command-line interface.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = subparsers.add_parser('batch', help='solve the requests in a JSON Lines file (or stdin)')
+    batch_parser.add_argument('file', nargs='?', default='-', help='requests in the /optimize schema, one per line (default: stdin)')
+    batch_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    batch_parser.add_argument('--ordered', action='store_true', help='write the results in the input order')
+    batch_parser.add_argument('--no-warm-up', dest='warm_up', action='store_false',
+                              help='do not load all the algorithms before solving (useful for few requests)')
+    batch_parser.add_argument('--summary', help='file where the summary is also written (JSON)')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    # stdout is reserved to the results
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        return batch(args, out)
+    finally:
+        sys.stdout = out
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,12 +2,20 @@
 import os
 import json
 import traceback
-from flask import Flask, request, session, render_template, jsonify
+import multiprocessing
+from io import StringIO
+from flask import Flask, Response, request, session, render_template, jsonify
 from vemm.core.configdb import ConfigDB
 from vemm.core.datasets import Datasets
+from vemm.core.array_store import ArrayStore
 from vemm.core.ml_models import MLModels
-from vemm.core.optimization_request import OptimizationRequest, UserConstraints, HardwarePrices, Inputs
-from vemm.core.hada import HADA
+from vemm.core.catalog import Catalog
+from vemm.core.single_flight import SingleFlight
+from vemm.core.admission import AdmissionController, Overloaded, estimate_cost, assign_threads, FAST_LANE_COST
+from vemm.core.model_export import ModelExporter
+from vemm.core.optimization_request import OptimizationRequest, UserConstraints, HardwarePrices, Inputs, SolverSettings
+from vemm.core.ingestion import ingest_rows
+from vemm.core.metrics import metrics, input_case, process_memory
 
 
 # ==============================================================================
@@ -21,39 +29,102 @@ app.secret_key = ';u_QC&vzGaAR;&67vma[(4_cHZ;(F!;]dwjh&tJRBF;S(7aWYz/e=z!]^Fhk.K
 # Init HADA
 # ==============================================================================
 
+# resources are relative to this module, so that the service can be started from any folder
+algorithms_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'algorithms')
 # for local init modality
-data_path_no_inp = 'algorithms/data/input-independent'
-data_path_inp = 'algorithms/data/input-dependent'
-configs_path_no_inp = 'algorithms/configs/input-independent'
-configs_path_inp = 'algorithms/configs/input-dependent'
-carbon_intensity_path = 'algorithms/carbon_intensity'
-# for both init modalities
-categories_path_no_inp = "algorithms/categorical_mappings/input-independent"
-categories_path_inp = "algorithms/categorical_mappings/input-dependent"
-models_path_no_inp = 'algorithms/models/input-independent'
-models_path_inp = 'algorithms/models/input-dependent'
+data_path_no_inp = os.path.join(algorithms_path, 'data/input-independent')
+data_path_inp = os.path.join(algorithms_path, 'data/input-dependent')
+configs_path_no_inp = os.path.join(algorithms_path, 'configs/input-independent')
+configs_path_inp = os.path.join(algorithms_path, 'configs/input-dependent')
+carbon_intensity_path = os.path.join(algorithms_path, 'carbon_intensity')
+# for both init modalities: categorical mappings and trained models are built from the datasets at their first use;
+# CATEGORIES_PATH and MODELS_PATH set where (by default, next to the datasets), with a folder per input case
+categories_path = os.getenv('CATEGORIES_PATH', os.path.join(algorithms_path, 'categorical_mappings'))
+models_path = os.getenv('MODELS_PATH', os.path.join(algorithms_path, 'models'))
+categories_path_no_inp = os.path.join(categories_path, 'input-independent')
+categories_path_inp = os.path.join(categories_path, 'input-dependent')
+models_path_no_inp = os.path.join(models_path, 'input-independent')
+models_path_inp = os.path.join(models_path, 'input-dependent')
+for path in [categories_path_no_inp, categories_path_inp, models_path_no_inp, models_path_inp]:
+    os.makedirs(path, exist_ok=True)
+# expanded local datasets and compiled model rules are shared by the processes of the node (workers, training), see ArrayStore;
+# ARRAYS_PATH sets where (by default, in /dev/shm), and an empty value disables the store
+arrays_path = os.getenv('ARRAYS_PATH', ArrayStore.default_path(algorithms_path))
+# COMPACT_DATASETS=1 holds the expanded datasets with the smallest dtypes (see Datasets.from_local)
+compact_datasets = os.getenv('COMPACT_DATASETS', '0') == '1'
 
 init_type = os.getenv('INIT_TYPE')
 if init_type == 'local' or init_type is None:
     db = ConfigDB.from_local(configs_path_no_inp, configs_path_inp, carbon_intensity_path)
-    datasets = Datasets.from_local(db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp)
+    datasets = Datasets.from_local(db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp,
+                                   arrays_path, compact_datasets)
 elif init_type == 'remote':
     db = ConfigDB.from_remote('http://localhost:5333')
-    datasets = Datasets.from_remote(db, 'http://localhost:5333', categories_path_no_inp, categories_path_inp)
+    datasets = Datasets.from_remote(db, 'http://localhost:5333', categories_path_no_inp, categories_path_inp,
+                                    compact_datasets)
 else:
     raise AttributeError('Environment variable INIT_TYPE must be se to "local" or "remote"')
 
-models = MLModels(db, datasets, models_path_no_inp, models_path_inp)
+# trees are compacted when compiling their rules, merging the leaves whose predictions differ by at most
+# TREE_COMPACTION_TOLERANCE times the range of the tree's predictions (by default, only identical ones);
+# an empty value disables the compaction
+compaction_tolerance = os.getenv('TREE_COMPACTION_TOLERANCE', '0')
+models = MLModels(db, datasets, models_path_no_inp, models_path_inp,
+                  compaction_tolerance=float(compaction_tolerance) if compaction_tolerance else None, arrays_path=arrays_path)
+
+# responses of /algorithms and /algorithms/<algorithm>, which clients may cache for CATALOG_MAX_AGE seconds
+# (by default, they have to check whether their copy is still valid)
+catalog = Catalog(db, datasets, models)
+catalog_max_age = int(os.getenv('CATALOG_MAX_AGE', 0))
+
+# identical optimization requests being solved concurrently are solved once (see run_hada)
+optimization_flights = SingleFlight('optimize')
+
+# solver threads shared by the requests solved at the same time (SOLVER_THREADS, by default the number of CPUs),
+# and limits of the requests waiting for them (see AdmissionController)
+admission = AdmissionController(int(os.getenv('SOLVER_THREADS', 0)) or None,
+                                max_pending=int(os.getenv('ADMISSION_MAX_PENDING', 16)),
+                                timeout=float(os.getenv('ADMISSION_TIMEOUT', 30)),
+                                fast_lane_cost=int(os.getenv('FAST_LANE_COST', FAST_LANE_COST)))
+
+# optional export of a sample of the models built to a corpus folder (MODEL_EXPORT_PATH), see vemm.utils.replay
+model_exporter = None
+if os.getenv('MODEL_EXPORT_PATH'):
+    model_exporter = ModelExporter(os.getenv('MODEL_EXPORT_PATH'),
+                                   sample_rate=float(os.getenv('MODEL_EXPORT_RATE', 1)),
+                                   max_models=int(os.getenv('MODEL_EXPORT_MAX', 0)) or None,
+                                   format=os.getenv('MODEL_EXPORT_FORMAT', 'mps'))
+
+# optional periodic check of the trained models (retraining the stale ones), every MODELS_SCAN_INTERVAL seconds;
+# not started in the processes spawned by the service (e.g. to solve decomposed requests)
+models_scan_interval = float(os.getenv('MODELS_SCAN_INTERVAL', 0))
+if models_scan_interval > 0 and multiprocessing.parent_process() is None:
+    models.start_staleness_scan(models_scan_interval)
 
 # ==============================================================================
 # Utility functions
 # ==============================================================================
 def run_hada(optimization_request):
-    
-    var_bounds = datasets.get_var_bounds_all(optimization_request)
-    robust_coeff = datasets.get_robust_coeff(models, optimization_request)
-
-    solution = HADA(db, datasets, optimization_request, models, var_bounds, robust_coeff)
+    # concurrent identical requests wait for the same solve, and share its solution (not to be modified)
+    return optimization_flights.do(optimization_request.get_fingerprint(), lambda: _run_hada(optimization_request))
+
+def _run_hada(optimization_request):
+    # the solver stack (docplex) is imported on first use, not to delay the start of the service
+    from vemm.core.hada import HADA
+    labels = {'algorithm': optimization_request.algorithm,
+              'input_case': input_case(optimization_request.input_dependent)}
+
+    # waiting for a share of the solver threads, according to the size of the models to embed (see admission)
+    cost = estimate_cost(db, models, optimization_request)
+    with admission.admit(cost['leaves'], **labels) as threads:
+        assign_threads(optimization_request.solver_settings, threads)
+
+        with metrics.span('var_bounds', **labels):
+            var_bounds = datasets.get_var_bounds_all(optimization_request)
+        with metrics.span('robust_coeff', **labels):
+            robust_coeff = datasets.get_robust_coeff(models, optimization_request)
+
+        solution = HADA(db, datasets, optimization_request, models, var_bounds, robust_coeff, exporter=model_exporter)
     return solution
 
 def parse_request_form(algorithm, form_dict, input_dependent=False, inputs_file=None):
@@ -127,10 +198,22 @@ def parse_request_json(data):
         "country": "Italy",
         ...
     ],
+        "solver": {  # optional, overrides the defaults for the algorithm
+            "time_limit": 10,
+            "mip_gap": 0.01,
+            "mip_gap_abs": 0.1,
+            "threads": 2,
+            "emphasis": "feasibility",
+            "solve_stats": true
+        }
     }
     """
     input_dependent = 'inputs' in data
 
+    with metrics.span('parse', algorithm=data.get('algorithm'), input_case=input_case(input_dependent)):
+        return _parse_request_json(data, input_dependent)
+
+def _parse_request_json(data, input_dependent):
     inputs = None
     if input_dependent:
         inputs = Inputs(db, data['algorithm'])
@@ -148,6 +231,11 @@ def parse_request_json(data):
         for hw_price in data['price_per_hw']:
             hws_prices.add_hw_price(hw_price['hw'], hw_price['price'])
 
+    solver_settings = SolverSettings(db, data['algorithm'], input_dependent)
+    if 'solver' in data:
+        for setting, value in data['solver'].items():
+            solver_settings.add_setting(setting, value)
+
     optimization_request = OptimizationRequest(db=db,
                                                algorithm=data['algorithm'],
                                                target=data['objective']['target'],
@@ -156,23 +244,129 @@ def parse_request_json(data):
                                                user_constraints=user_constraints,
                                                hws_prices=hws_prices,
                                                inputs=inputs,
-                                               country=data['country'])
+                                               country=data['country'],
+                                               solver_settings=solver_settings)
     return optimization_request
 
 
 def format_solution(solution):
+    with metrics.span('format', algorithm=solution.algorithm, input_case=input_case(solution.input_dependent)):
+        return _format_solution(solution)
+
+def _format_solution(solution):
+    # no solution (see NoSolution): why, and the solve statistics if requested
+    if not solution:
+        out = {'status': solution.status}
+        if solution.pruned_hws:
+            out['pruned_hws'] = solution.pruned_hws
+        if solution.solve_stats is not None:
+            out['solve_stats'] = solution.solve_stats
+        return out
     sol_hyperparams = {hyperparam:val for hyperparam,val in solution.hyperparams_values.items()}
     sol_targets = {target:val for target,val in solution.targets_values.items()}
-    # converts emissions based on country
-    if 'CO2e(kg)' in sol_targets:
-        scaling_factor = db.get_conversion_factor(country=solution.country)
-        sol_targets['CO2e(kg)'] = sol_targets['CO2e(kg)'] * scaling_factor
-
     out = {'hw': solution.chosen_hw, 'hyperparams': sol_hyperparams, 'targets': sol_targets}
+    # converts emissions based on country: for a list of countries (or all), the emissions in each of them are added,
+    # the solution being the same for all countries
+    if 'CO2e(kg)' in sol_targets:
+        emissions = convert_emissions(sol_targets['CO2e(kg)'], solution.country)
+        if isinstance(emissions, dict):
+            out['emissions_per_country'] = emissions
+        else:
+            sol_targets['CO2e(kg)'] = emissions
+    # the solver stopped on a limit: the solution is the best found, but not proven optimal
+    if not solution.proven_optimal:
+        out['proven_optimal'] = False
+    if solution.solve_stats is not None:
+        out['solve_stats'] = solution.solve_stats
     return out
 
-def convert_emissions():
-    pass
+def solve_request_json(data):
+    """Solves a request in the /optimize schema (see parse_request_json); returns the /optimize response."""
+    return _solve_request_json(data)[0]
+
+def _solve_request_json(data):
+    """Same as solve_request_json; also returns the HTTP status (429/503 if the request is not admitted, see admission)."""
+    status = 200
+    try:
+        optimization_request = parse_request_json(data)
+        solution = run_hada(optimization_request)
+
+        if solution:
+            ret = {'solution': format_solution(solution)}
+        else:
+            ret = dict({'solution': None}, **format_solution(solution))
+
+    except Overloaded as e:
+        ret = {'error': str(e), 'retry_after': e.retry_after}
+        status = e.status
+    except Exception as e:
+        print(e)
+        ret = {'error': str(e)}
+
+    return ret, status
+
+def convert_emissions(emissions, country):
+    """
+    Converts emissions (CO2e(kg), as predicted) according to the carbon intensity of a country.
+
+    Args:
+        emissions (float): emissions, as predicted.
+        country (str or list[str]): country, list of countries or 'all' (all countries with carbon intensity data).
+
+    Returns:
+        float or dict: emissions in the country, or in each of the countries (for a list or 'all').
+    """
+    if country == 'all':
+        country = db.get_countries()
+    if isinstance(country, list):
+        return {c: emissions * db.get_conversion_factor(country=c) for c in country}
+    return emissions * db.get_conversion_factor(country=country)
+
+def memory_report():
+    """
+    Memory held by the service: resident memory of the process (see metrics.process_memory), and bytes of the
+    expanded dataset, models and error statistics of each (algorithm, hw), by input case, and of the catalog.
+    Datasets are held only with the store (see ArrayStore), models and error statistics once used.
+    """
+    try:
+        process = process_memory()
+    except OSError:
+        # not on Linux
+        process = None
+    report = {'process': process, 'algorithms': {}, 'catalog': catalog.get_nbytes()}
+    totals = {'datasets': 0, 'models': 0, 'error_stats': 0}
+    for input_dependent in [False, True]:
+        per_algorithm = {}
+        for algorithm in db.get_algorithms(input_dependent):
+            per_hw = {}
+            for hw in db.get_hws(algorithm, input_dependent):
+                dataset = datasets.get_dataset_nbytes(algorithm, hw, input_dependent)
+                models_nbytes = {target: models.get_model_nbytes(algorithm, hw, target, input_dependent)
+                                 for target in db.get_targets(algorithm, input_dependent) if target != 'price'}
+                models_nbytes = {target: nbytes for target, nbytes in models_nbytes.items() if nbytes is not None}
+                error_stats = datasets.get_error_stats_nbytes(algorithm, hw, input_dependent)
+                if dataset is None and not models_nbytes and not error_stats:
+                    continue
+                per_hw[hw] = {'dataset': dataset, 'models': models_nbytes, 'error_stats': error_stats}
+                totals['datasets'] += dataset or 0
+                totals['models'] += sum(models_nbytes.values())
+                totals['error_stats'] += sum(error_stats.values())
+            if per_hw:
+                per_algorithm[algorithm] = per_hw
+        report['algorithms'][input_case(input_dependent)] = per_algorithm
+    report['totals'] = dict(totals, catalog=report['catalog'])
+    return report
+
+def catalog_response(body, version):
+    """Response for the catalog endpoints: answers 304 (Not Modified) if the client's copy is still valid (ETag)."""
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(version)
+    if catalog_max_age > 0:
+        response.cache_control.public = True
+        response.cache_control.max_age = catalog_max_age
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 # ==============================================================================
 # Routes (GUI)
@@ -185,6 +379,10 @@ def hada_gui():
     if 'last_selected_algo' not in session:
         session['last_selected_algo'] = db.get_algorithms(input_dependent=False)[0]
         session['last_input_dependent'] = False
+    # selection the page is rendered for if the current one cannot be (e.g. on errors in a fresh session)
+    if 'last_rendered' not in session:
+        session['last_rendered'] = [session['last_selected_algo'], session['last_input_dependent']]
+    rendering_kwargs = None
     try:
         # two separate forms, one for algorithm selection and one for optimization requests
         if request.method == 'POST':
@@ -214,34 +412,21 @@ def hada_gui():
                 if solution:
                     out = format_solution(solution)
                 else:
-                    out = 'No solution.'
-
-        # rendering
-        lb_per_var, ub_per_var = datasets.extract_var_bounds(session['last_selected_algo'], session['last_input_dependent'])
-        description_per_var = db.get_description_per_var(session['last_selected_algo'], session['last_input_dependent'])
-        input_independent_algos = db.get_algorithms(input_dependent=False)
-        input_dependent_algos = db.get_algorithms(input_dependent=True)
-        # add country list only if emissions data are present
-        countries = []
-        if db.has_emission_data(session['last_selected_algo'], session['last_input_dependent']):
-            countries = db.get_countries()
-        #rendering_kwargs = {'algorithms': db.get_algorithms(input_dependent=session['last_input_dependent']),
-        rendering_kwargs = {'algorithms': {'input-dependent': input_dependent_algos, 'input-independent': input_independent_algos},
-                            'input_dependent': session['last_input_dependent'],
-                            'targets': db.get_targets(session['last_selected_algo'], session['last_input_dependent']),
-                            'price_per_hw': db.get_prices_per_hw(session['last_selected_algo'], session['last_input_dependent']),
-                            'lb_per_var': lb_per_var,
-                            'ub_per_var': ub_per_var,
-                            'description_per_var': description_per_var,
-                            'countries': countries}
-                
-        session['last_rendering_kwargs'] = rendering_kwargs
+                    out = str(solution)
+
+        # rendering: data is kept server-side (see Catalog), the session holds only the selection it was rendered for
+        rendering_kwargs = catalog.get_rendering_kwargs(session['last_selected_algo'], session['last_input_dependent'])
+        session['last_rendered'] = [session['last_selected_algo'], session['last_input_dependent']]
     except Exception as e:
         traceback.print_exc()
         out=str(e)
 
+    if rendering_kwargs is None:
+        rendering_kwargs = catalog.get_rendering_kwargs(*session['last_rendered'])
+    # sessions from previous versions held the whole rendering data
+    session.pop('last_rendering_kwargs', None)
     return render_template('hada_gui.html',
-                           **session['last_rendering_kwargs'],
+                           **rendering_kwargs,
                            selected_algo=session['last_selected_algo'],
                            out=out)
 
@@ -250,86 +435,56 @@ def hada_gui():
 # ==============================================================================
 @app.route('/algorithms', methods=['GET'])
 def get_algorithms():
-    return jsonify({'algorithms':
-                    {'input-independent': db.get_algorithms(input_dependent=False),
-                    'input-dependent': db.get_algorithms(input_dependent=True)}})
+    return catalog_response(*catalog.get_algorithms())
 
 
 @app.route('/algorithms/<algorithm>', methods=['GET'])
 def get_algo_info(algorithm):
+    return catalog_response(*catalog.get_algorithm(algorithm))
 
-    cases = []
-    if algorithm in db.get_algorithms(input_dependent=True):
-        cases.append(('input-dependent', True))
-    if algorithm in db.get_algorithms(input_dependent=False):
-        cases.append(('input-independent', False))
-
-
-    ret = {'algorithm': algorithm,
-           'input-independent': None,
-           'input-dependent': None}
-
-    for name, input_dependent in cases:
-        hyperparams = db.get_hyperparams(algorithm, input_dependent)
-        # types are relevant only for hyperparameters, targets are assumed to be 'float'
-        types = db.get_type_per_var(algorithm, input_dependent)
-        targets = db.get_targets(algorithm, input_dependent)
-        description_per_var = db.get_description_per_var(algorithm, input_dependent)
-        lb_per_var, ub_per_var = datasets.extract_var_bounds(algorithm, input_dependent)
-        lb_per_var['price'] = None
-        ub_per_var['price'] = None
-        description_per_var['price'] = None
-
-        
-        hyperparams_profiles = {hyperparam: {'description': description_per_var[hyperparam],
-                                                        'type': types[hyperparam],
-                                                        'lb': lb_per_var[hyperparam],
-                                                        'ub': ub_per_var[hyperparam]}
-                                for hyperparam in hyperparams}
-
-        targets_profiles = {target: {'description': description_per_var[target],
-                                                'lb': lb_per_var[target],
-                                                'ub': ub_per_var[target]} 
-                            for target in targets}
-
-        hws_with_prices = {hw: {'default_price': price} 
-                        for hw,price in db.get_prices_per_hw(algorithm, input_dependent).items()}
-
-        case = {'hws': hws_with_prices,
-                'hyperparameters': hyperparams_profiles,
-                'targets': targets_profiles}
-        
-        # only for input-dependent cases
-        if input_dependent:
-            inputs = db.get_inputs(algorithm)
-            inputs_profiles = {input: {'description': description_per_var[input],
-                                   'type': types[input],
-                                   'lb': lb_per_var[input],
-                                   'ub': ub_per_var[input]}
-                                    for input in inputs}
-            case['inputs'] = inputs_profiles
-
-        ret[name] = case
-
-    return ret
-
-@app.route('/optimize', methods=['POST'])
-def optimize():
-    data = request.get_json()
-    try:
-        optimization_request = parse_request_json(data)
-        solution = run_hada(optimization_request)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-        ret = {'solution': None}
-        if solution:
-            ret = {'solution': format_solution(solution)}
+@app.route('/debug/memory', methods=['GET'])
+def get_memory_report():
+    return jsonify(memory_report())
 
+@app.route('/datasets/<algorithm>/<hw>', methods=['POST'])
+@app.route('/datasets/<algorithm>/<hw>/input', methods=['POST'], defaults={'input_dependent': True})
+def add_rows(algorithm, hw, input_dependent=False):
+    """
+    Adds rows to the dataset of an (algorithm, hw); its models are retrained in background.
+    Rows are sent either as CSV (with header) or as JSON: {"rows": [{"var_0": 1.0, ..., "time": 12.3}, ...]}
+    Datasets served by the storage web service (INIT_TYPE=remote) cannot be extended: 405 is returned.
+    """
+    if not datasets.appendable:
+        response = jsonify({'error': 'Adding rows is supported only for local datasets.'})
+        response.status_code = 405
+        return response
+    try:
+        if request.mimetype == 'text/csv':
+            import pandas as pd
+            rows = pd.read_csv(StringIO(request.get_data(as_text=True)))
+        else:
+            rows = request.get_json()['rows']
+        ret = ingest_rows(datasets, models, algorithm, hw, rows, input_dependent)
     except Exception as e:
         print(e)
         ret = {'error': str(e)}
 
     return jsonify(ret)
 
+@app.route('/optimize', methods=['POST'])
+def optimize():
+    data = request.get_json()
+    ret, status = _solve_request_json(data)
+    response = jsonify(ret)
+    response.status_code = status
+    if 'retry_after' in ret:
+        response.headers['Retry-After'] = str(ret['retry_after'])
+    return response
+
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,164 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from vemm.core.metrics import metrics
+
+# requests whose models have at most this many leaves in total (i.e. binary variables of the MILP) are cheap
+FAST_LANE_COST = 200
+# leaves (binary variables) per solver thread assigned to a request, up to the budget
+LEAVES_PER_THREAD = 1000
+# leaves assumed for a model not trained yet, when its training settings do not bound them
+DEFAULT_LEAVES = 1000
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is not admitted: too many requests already waiting (status 429), or waited longer than
+    the timeout (status 503). retry_after suggests when to retry (seconds).
+    """
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def estimate_cost(db, models, request):
+    """
+    Estimated cost of solving a request: the predictive models embedded (one per hw and estimated target, objective
+    or constrained) and their total number of leaves, i.e. binary variables of the MILP. Leaves of the models not
+    trained yet are bounded by their training settings.
+
+    Args:
+        db (ConfigDB): instance of ConfigDB.
+        models (MLModels): instance of MLModels.
+        request (OptimizationRequest): represents the user's request.
+
+    Returns:
+        dict: number of hws, trees and leaves.
+    """
+    targets = set(request.user_constraints.get_constraints()) | {request.target}
+    targets = [target for target in targets if target != 'price']
+    hws = db.get_hws(request.algorithm, request.input_dependent)
+    settings = models.get_training_settings(request.algorithm, request.input_dependent)
+    default_leaves = settings.get('max_leaf_nodes') or min(2 ** (settings.get('max_depth') or 30), DEFAULT_LEAVES)
+
+    leaves = 0
+    for hw in hws:
+        for target in targets:
+            info = models.get_model_info(request.algorithm, hw, target, request.input_dependent)
+            leaves += info['leaves'] if info is not None else default_leaves
+    return {'hws': len(hws), 'trees': len(hws) * len(targets), 'leaves': leaves}
+
+
+def assign_threads(solver_settings, threads):
+    """
+    Limits the solver threads of a request to the granted ones (see AdmissionController.admit); in decomposition
+    mode, they are split among the subproblems solved at the same time.
+
+    Args:
+        solver_settings (SolverSettings): settings of the request (modified).
+        threads (int): threads granted.
+    """
+    settings = solver_settings.get_settings()
+    if settings.get('decompose', False):
+        workers = min(settings.get('workers', threads), threads)
+        solver_settings.add_setting('workers', workers)
+        threads = max(1, threads // workers)
+    # 0 lets the solver use all the cores
+    if settings.get('threads', 0) == 0 or settings['threads'] > threads:
+        solver_settings.add_setting('threads', threads)
+
+
+class AdmissionController():
+    """
+    Bounds the solver threads used by the requests solved at the same time (thread budget), in two lanes: cheap
+    requests (see estimate_cost and FAST_LANE_COST) get one thread from a reserved share of the budget, so that
+    they are not queued behind the expensive ones; the others get threads in proportion to their cost, within
+    what is free when their turn comes. Requests wait in FIFO order within each lane; they are rejected when
+    too many are already waiting in their lane (Overloaded, status 429) or after waiting longer than the
+    timeout (status 503).
+
+    Args:
+        thread_budget (int): solver threads shared by the requests (default: number of CPUs).
+        max_pending (int): maximum number of requests waiting in each lane.
+        timeout (float): maximum time (seconds) a request waits to be admitted.
+        fast_lane_cost (int): maximum cost (leaves) of the requests in the fast lane.
+    """
+    def __init__(self, thread_budget=None, max_pending=16, timeout=30, fast_lane_cost=FAST_LANE_COST):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.fast_lane_cost = fast_lane_cost
+        self._cond = threading.Condition()
+        self._in_use = {'fast': 0, 'regular': 0}
+        self._waiting = {'fast': deque(), 'regular': deque()}
+        self.set_thread_budget(thread_budget)
+        metrics.register_gauge('solver_threads_in_use', lambda: sum(self._in_use.values()))
+
+    def set_thread_budget(self, thread_budget=None):
+        """Sets the thread budget (default: number of CPUs): a quarter (at least one thread) is reserved to the fast lane."""
+        with self._cond:
+            self.thread_budget = thread_budget or os.cpu_count() or 1
+            fast = max(1, self.thread_budget // 4)
+            # each lane has at least one thread
+            self._capacity = {'fast': fast, 'regular': max(1, self.thread_budget - fast)}
+            self._cond.notify_all()
+
+    def get_lane(self, cost):
+        return 'fast' if cost <= self.fast_lane_cost else 'regular'
+
+    def get_wanted_threads(self, cost):
+        """Threads a request would get with the whole budget free."""
+        if self.get_lane(cost) == 'fast':
+            return 1
+        return min(max(1, math.ceil(cost / LEAVES_PER_THREAD)), self._capacity['regular'])
+
+    @contextmanager
+    def admit(self, cost, algorithm=None, input_case=None):
+        """
+        Waits for the turn of a request, and for a free thread in its lane; yields the threads granted (to be
+        used for solving, see assign_threads), released at the end of the block.
+
+        Args:
+            cost (int): estimated cost of the request (leaves, see estimate_cost).
+            algorithm (str): algorithm id (metrics label).
+            input_case (str): input case (metrics label).
+
+        Raises:
+            Overloaded: if the request is not admitted.
+        """
+        lane = self.get_lane(cost)
+        start = time.perf_counter()
+        with self._cond:
+            waiting = self._waiting[lane]
+            if len(waiting) >= self.max_pending:
+                metrics.inc('rejected_requests_total', lane=lane, reason='queue_full')
+                raise Overloaded(f'Too many requests waiting to be solved ({len(waiting)}); retry later.', 429, 1)
+
+            ticket = object()
+            waiting.append(ticket)
+            try:
+                while waiting[0] is not ticket or self._in_use[lane] >= self._capacity[lane]:
+                    remaining = start + self.timeout - time.perf_counter()
+                    if remaining <= 0:
+                        metrics.inc('rejected_requests_total', lane=lane, reason='timeout')
+                        raise Overloaded(f'The service is busy: request not solved within {self.timeout} seconds; retry later.',
+                                         503, max(1, math.ceil(self.timeout / 2)))
+                    self._cond.wait(remaining)
+            finally:
+                waiting.remove(ticket)
+                self._cond.notify_all()
+
+            threads = min(self.get_wanted_threads(cost), self._capacity[lane] - self._in_use[lane])
+            self._in_use[lane] += threads
+        metrics.observe_phase('admission', time.perf_counter() - start, algorithm, input_case)
+        metrics.inc('admitted_requests_total', lane=lane)
+
+        try:
+            yield threads
+        finally:
+            with self._cond:
+                self._in_use[lane] -= threads
+                self._cond.notify_all()
@@ -0,0 +1,113 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+TMP_PREFIX = '.tmp-'
+
+
+class ArrayStore():
+    """
+    Node-local store of read-only NumPy arrays, shared by all the processes of the service (workers, training
+    subprocesses): each entry is written once, as .npy files, and memory-mapped by the processes reading it, so
+    that its pages are held once per node regardless of the number of processes. By default the store lives in
+    /dev/shm (memory-backed), if available.
+
+    Entries are identified by a key and a version (e.g. derived from the source file): a new version replaces the
+    previous ones, which processes still using them keep mapped until they drop them. Entries are written in a
+    temporary folder and renamed, so that readers never see partial entries; temporary folders left by crashed
+    processes are removed when the store is opened.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.cleanup()
+
+    @staticmethod
+    def default_path(name):
+        """Default location of the store identified by name (e.g. the folder of the data it holds)."""
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        return os.path.join(base, f'vemm-arrays-{hashlib.sha256(name.encode()).hexdigest()[:12]}')
+
+    def get(self, key, version):
+        """
+        Memory-mapped (read-only) arrays of an entry.
+
+        Args:
+            key (str): entry id (may contain '/').
+            version (str): version of the entry.
+
+        Returns:
+            dict: arrays by name (None if the entry is not stored).
+            dict: attributes of the entry (JSON-serializable).
+        """
+        path = os.path.join(self.path, key, version)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in meta['arrays']}
+        except FileNotFoundError:
+            # not stored, or replaced meanwhile
+            return None, None
+        return arrays, meta['attrs']
+
+    def put(self, key, version, arrays, attrs=None):
+        """
+        Stores an entry, replacing its previous versions, and returns it as stored (see get). If the same
+        version is stored meanwhile by another process, the latter is kept.
+
+        Args:
+            key (str): entry id (may contain '/').
+            version (str): version of the entry.
+            arrays (dict): arrays by name (numeric, not object).
+            attrs (dict): attributes of the entry (JSON-serializable).
+        """
+        entry_path = os.path.join(self.path, key)
+        os.makedirs(entry_path, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=f'{TMP_PREFIX}{os.getpid()}-', dir=entry_path)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                json.dump({'arrays': list(arrays), 'attrs': attrs or {}}, f)
+            os.rename(tmp_path, os.path.join(entry_path, version))
+        except OSError as e:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+
+        for other in os.listdir(entry_path):
+            if other != version and not other.startswith(TMP_PREFIX):
+                shutil.rmtree(os.path.join(entry_path, other), ignore_errors=True)
+        return self.get(key, version)
+
+    def cleanup(self):
+        """Removes the temporary folders of the processes no longer running (e.g. crashed while writing an entry)."""
+        for root, dirs, _ in os.walk(self.path):
+            for name in [name for name in dirs if name.startswith(TMP_PREFIX)]:
+                dirs.remove(name)
+                pid = name[len(TMP_PREFIX):].split('-')[0]
+                if not pid.isdigit() or not _is_running(int(pid)):
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def clear(self):
+        """Removes all the entries."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    def remove(self):
+        """Removes the store (entries and folder); processes still mapping entries keep them until they drop them."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
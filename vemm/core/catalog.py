@@ -0,0 +1,195 @@
+import json
+import hashlib
+import threading
+from vemm.core.metrics import metrics
+
+
+def content_version(content):
+    """Version of a JSON-serializable content (hash of its serialization), used as catalog version and ETag."""
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()[:16]
+
+
+class Catalog():
+    """
+    Responses of the discovery endpoints (/algorithms, /algorithms/<algorithm>), serialized once and kept in memory,
+    along with the data for rendering the GUI. The profile of an algorithm is computed again only when its variable
+    bounds or its models change (see Datasets.get_generation and MLModels.get_generation).
+
+    Each response carries a catalog_version, identifying its content (also used as ETag): clients polling the
+    catalog refresh their copy only when it changes.
+    """
+    def __init__(self, db, datasets, models):
+        self.db = db
+        self.datasets = datasets
+        self.models = models
+        # algorithm : (generations of its data, serialized profile, version)
+        self._profiles = {}
+        # (algorithm, input_dependent) : (generation of its bounds, data for rendering the GUI)
+        self._rendering_kwargs = {}
+        self._algorithms = None
+        self._lock = threading.Lock()
+
+    def get_algorithms(self):
+        """
+        Algorithms available for each input case.
+
+        Returns:
+            bytes: serialized response.
+            str: catalog version.
+        """
+        if self._algorithms is None:
+            algorithms = {'algorithms': {'input-independent': self.db.get_algorithms(input_dependent=False),
+                                         'input-dependent': self.db.get_algorithms(input_dependent=True)}}
+            self._algorithms = self._serialize(algorithms)
+        return self._algorithms
+
+    def get_algorithm(self, algorithm):
+        """
+        Profile of an algorithm (see build_profile), computed again if its data changed since last time.
+
+        Returns:
+            bytes: serialized response.
+            str: catalog version.
+        """
+        cases = self._get_cases(algorithm)
+        # unknown algorithms are not cached
+        if not cases:
+            return self._serialize(self.build_profile(algorithm))
+
+        generations = tuple((self.datasets.get_generation(algorithm, input_dependent),
+                             self.models.get_generation(algorithm, input_dependent)) for _, input_dependent in cases)
+        cached = self._profiles.get(algorithm)
+        metrics.cache_lookup('catalog', hit=cached is not None and cached[0] == generations)
+        if cached is None or cached[0] != generations:
+            body, version = self._serialize(self.build_profile(algorithm))
+            cached = (generations, body, version)
+            with self._lock:
+                self._profiles[algorithm] = cached
+        return cached[1], cached[2]
+
+    def get_rendering_kwargs(self, algorithm, input_dependent=False):
+        """
+        Data for rendering the GUI with an algorithm selected: available algorithms, targets, default prices,
+        bounds and descriptions of the variables, countries (if emissions are available). Computed again if the
+        bounds of the algorithm changed since last time; not to be modified.
+
+        Args:
+            algorithm (str): algorithm id.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+
+        Returns:
+            dict: keyword arguments for the GUI template.
+        """
+        key = (algorithm, input_dependent)
+        generation = self.datasets.get_generation(algorithm, input_dependent)
+        cached = self._rendering_kwargs.get(key)
+        metrics.cache_lookup('gui', hit=cached is not None and cached[0] == generation)
+        if cached is None or cached[0] != generation:
+            lb_per_var, ub_per_var = self.datasets.extract_var_bounds(algorithm, input_dependent)
+            # add country list only if emissions data are present
+            countries = []
+            if self.db.has_emission_data(algorithm, input_dependent):
+                countries = self.db.get_countries()
+            rendering_kwargs = {'algorithms': {'input-dependent': self.db.get_algorithms(input_dependent=True),
+                                               'input-independent': self.db.get_algorithms(input_dependent=False)},
+                                'input_dependent': input_dependent,
+                                'targets': self.db.get_targets(algorithm, input_dependent),
+                                'price_per_hw': self.db.get_prices_per_hw(algorithm, input_dependent),
+                                'lb_per_var': lb_per_var,
+                                'ub_per_var': ub_per_var,
+                                'description_per_var': self.db.get_description_per_var(algorithm, input_dependent),
+                                'countries': countries}
+            cached = (generation, rendering_kwargs)
+            with self._lock:
+                self._rendering_kwargs[key] = cached
+        return cached[1]
+
+    def get_nbytes(self):
+        """Bytes of the serialized responses held (discovery endpoints only)."""
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return sum(len(body) for _, body, _ in profiles) + (len(self._algorithms[0]) if self._algorithms else 0)
+
+    def build(self):
+        """Computes the profiles of all the algorithms (e.g. at start-up, before serving requests)."""
+        self.get_algorithms()
+        for algorithm in set(self.db.get_algorithms(False) + self.db.get_algorithms(True)):
+            self.get_algorithm(algorithm)
+
+    def build_profile(self, algorithm):
+        """
+        Profile of an algorithm, for each input case: hws (with default prices), hyperparameters, targets and inputs
+        (with description, type and bounds), and the trained models (see MLModels.get_model_info).
+
+        Args:
+            algorithm (str): algorithm id.
+
+        Returns:
+            dict: profile of the algorithm (None for the input cases not available).
+        """
+        ret = {'algorithm': algorithm,
+               'input-independent': None,
+               'input-dependent': None}
+
+        for name, input_dependent in self._get_cases(algorithm):
+            hyperparams = self.db.get_hyperparams(algorithm, input_dependent)
+            # types are relevant only for hyperparameters, targets are assumed to be 'float'
+            types = self.db.get_type_per_var(algorithm, input_dependent)
+            targets = self.db.get_targets(algorithm, input_dependent)
+            description_per_var = self.db.get_description_per_var(algorithm, input_dependent)
+            lb_per_var, ub_per_var = self.datasets.extract_var_bounds(algorithm, input_dependent)
+            lb_per_var['price'] = None
+            ub_per_var['price'] = None
+            description_per_var['price'] = None
+
+            hyperparams_profiles = {hyperparam: {'description': description_per_var[hyperparam],
+                                                 'type': types[hyperparam],
+                                                 'lb': lb_per_var[hyperparam],
+                                                 'ub': ub_per_var[hyperparam]}
+                                    for hyperparam in hyperparams}
+
+            targets_profiles = {target: {'description': description_per_var[target],
+                                         'lb': lb_per_var[target],
+                                         'ub': ub_per_var[target]}
+                                for target in targets}
+
+            hws_with_prices = {hw: {'default_price': price}
+                               for hw, price in self.db.get_prices_per_hw(algorithm, input_dependent).items()}
+
+            # trained models only: depth, leaves and expected size of their MILP encoding
+            models_info = {hw: {target: self.models.get_model_info(algorithm, hw, target, input_dependent)
+                                for target in targets if target != 'price'}
+                           for hw in self.db.get_hws(algorithm, input_dependent)}
+
+            case = {'hws': hws_with_prices,
+                    'hyperparameters': hyperparams_profiles,
+                    'targets': targets_profiles,
+                    'models': {hw: {target: info for target, info in info_per_target.items() if info is not None}
+                               for hw, info_per_target in models_info.items()}}
+
+            # only for input-dependent cases
+            if input_dependent:
+                inputs = self.db.get_inputs(algorithm)
+                inputs_profiles = {input: {'description': description_per_var[input],
+                                           'type': types[input],
+                                           'lb': lb_per_var[input],
+                                           'ub': ub_per_var[input]}
+                                   for input in inputs}
+                case['inputs'] = inputs_profiles
+
+            ret[name] = case
+
+        return ret
+
+    def _get_cases(self, algorithm):
+        cases = []
+        if algorithm in self.db.get_algorithms(input_dependent=True):
+            cases.append(('input-dependent', True))
+        if algorithm in self.db.get_algorithms(input_dependent=False):
+            cases.append(('input-independent', False))
+        return cases
+
+    @staticmethod
+    def _serialize(content):
+        version = content_version(content)
+        return json.dumps(dict(content, catalog_version=version)).encode(), version
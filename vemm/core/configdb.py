@@ -2,6 +2,8 @@ import os
 import json
 import requests
 from urllib.parse import urljoin
+from vemm.core.optimization_request import SolverSettings
+from vemm.core.ml_models import TrainingSettings
 
 
 class ConfigDB():
@@ -35,13 +37,13 @@ class ConfigDB():
 
         # expected fnames: <algorithm>_<hw>.csv
         for fname in fnames_no_inp:
-            algorithm, part = fname.split('_')
+            algorithm, part = os.path.basename(fname).split('_')
             hw = part.split('.')[0]
             #algo_hw_couples.add((algorithm, hw))
             configs_by_algo_hw_no_inp[(algorithm, hw)] = json.load(open(fname))
 
         for fname in fnames_inp:
-            algorithm, part = fname.split('_')
+            algorithm, part = os.path.basename(fname).split('_')
             hw = part.split('.')[0]
             #algo_hw_couples.add((algorithm, hw))
             configs_by_algo_hw_inp[(algorithm, hw)] = json.load(open(fname))
@@ -161,12 +163,18 @@ class ConfigDB():
             if set.intersection(set(inputs), set(targets)):
                     raise AttributeError(f'Names of inputs and targets must not overlap.')
 
+        # optional, default solver and training settings for the algorithm
+        solver = config.get('solver', {})
+        training = config.get('training', {})
+
         case_key = 'input-dependent' if input_dependent else 'input-independent'
         # checking consistency across hws for a given algorithm
         if config['name'] not in self.db[case_key]:
             self.db[case_key][config['name']] = {'hyperparams': hyperparams,
                                         'targets': targets,
-                                        'hws': {config['HW_ID']: config['HW_price']}}
+                                        'hws': {config['HW_ID']: config['HW_price']},
+                                        'solver': dict(solver),
+                                        'training': dict(training)}
             if input_dependent:
                 self.db[case_key][config['name']]['inputs'] = inputs
 
@@ -182,6 +190,16 @@ class ConfigDB():
                 if self.db[case_key][config['name']]['inputs'] != inputs:
                     raise AttributeError(f'Inputs not matching for algorithm {config["name"]} on different hws.')
 
+            # solver settings can be declared in any of the configs for the algorithm, but must not conflict
+            for setting, value in solver.items():
+                if self.db[case_key][config['name']]['solver'].get(setting, value) != value:
+                    raise AttributeError(f'Solver settings not matching for algorithm {config["name"]} on different hws.')
+                self.db[case_key][config['name']]['solver'][setting] = value
+            for setting, value in training.items():
+                if self.db[case_key][config['name']]['training'].get(setting, value) != value:
+                    raise AttributeError(f'Training settings not matching for algorithm {config["name"]} on different hws.')
+                self.db[case_key][config['name']]['training'][setting] = value
+
             # TODO (eventually): check consistency of HW prices (suggested in config) for a given HW across all algorithms.
             # Not needed; prices could be different for same hw and different algorithms (e.g. different contracts) 
 
@@ -220,6 +238,14 @@ class ConfigDB():
         """Get dict HW_name:price for all hws found for a given algorithm."""
         return self.get_db_by_case(input_dependent)[algorithm]['hws']
 
+    def get_solver_settings(self, algorithm, input_dependent=False):
+        """Get default solver settings for a given algorithm (only the ones specified in the configs)."""
+        return dict(self.get_db_by_case(input_dependent)[algorithm]['solver'])
+
+    def get_training_settings(self, algorithm, input_dependent=False):
+        """Get training settings for the models of a given algorithm (only the ones specified in the configs)."""
+        return dict(self.get_db_by_case(input_dependent)[algorithm]['training'])
+
     def get_lb_per_var(self, algorithm, input_dependent=False):
         """Get LBs for all variables (hyperparameters and targets); inputs too for the input-dependent cases."""
         lb_per_var = {}
@@ -390,6 +416,20 @@ class ConfigDB():
                 if target['LB'] is not None and type(target['LB']) not in [int, float]:
                     raise AttributeError("Targets lower bound must be a number or None")
 
+            # checking solver settings (optional)
+            if 'solver' in config:
+                if type(config['solver']) is not dict:
+                    raise AttributeError("Solver settings must be an object")
+                for setting, value in config['solver'].items():
+                    SolverSettings.check_setting(setting, value)
+
+            # checking training settings (optional)
+            if 'training' in config:
+                if type(config['training']) is not dict:
+                    raise AttributeError("Training settings must be an object")
+                for setting, value in config['training'].items():
+                    TrainingSettings.check_setting(setting, value)
+
         except AttributeError as e:
             print(f'Error in config ({algorithm}, {hw})')
             raise e
@@ -1,62 +1,218 @@
 import os
 import requests
 import pickle
+import hashlib
+import tempfile
+import threading
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from urllib.parse import urljoin
 import numpy as np
-import pandas as pd
+# pandas is imported on first use (see the functions below), not to delay the start of the service
 from vemm.core.optimization_request import OptimizationRequest
+from vemm.core.array_store import ArrayStore
+from vemm.core.metrics import metrics, input_case
+from vemm.core.tree_rules import compacted_predict
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on a file (on a lock file next to it, path + '.lock'), between the processes of the node (e.g. the
+    workers of vemm.serve) as well as between threads: for read-modify-replace updates not to lose each other's changes.
+    """
+    import fcntl
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def replace_file(path, write, mode='w'):
+    """Replaces a file atomically with what write(f) writes, through a unique temporary file in the same folder."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def dataset_fingerprint(df):
+    """
+    Hash of the content of a (numeric) dataset: column names and values, regardless of the order of the columns
+    and of their dtypes (values are hashed as float64).
+    """
+    columns = sorted(df.columns)
+    digest = hashlib.sha256(','.join(columns).encode())
+    digest.update(np.ascontiguousarray(df[columns].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def smallest_dtype(values):
+    """Smallest dtype representing all the values exactly: bool, int8 to int64 (integral values), float32 or float64."""
+    if values.dtype == bool:
+        return np.dtype(bool)
+    if values.size and (np.issubdtype(values.dtype, np.integer) or
+                        (np.isfinite(values).all() and (values == np.round(values)).all())):
+        for dtype in [np.int8, np.int16, np.int32, np.int64]:
+            if np.iinfo(dtype).min <= values.min() and values.max() <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+    if np.array_equal(values.astype(np.float32).astype(values.dtype), values, equal_nan=True):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def dataset_to_arrays(df, expanded_vars_per_str_var=None, compact=False):
+    """
+    Arrays holding an expanded dataset (see dataset_from_arrays): a float64 matrix, or, if compact, a matrix for each
+    of the smallest dtypes of the columns (see smallest_dtype) and, for each str variable, the index of the category
+    of each row (int8 or int16) instead of its one-hot columns.
+
+    Args:
+        df (pd.DataFrame): expanded dataset.
+        expanded_vars_per_str_var (dict): one-hot columns of each str variable (see StrExpander), if compact.
+        compact (bool): whether to use the compact representation.
+
+    Returns:
+        dict: arrays by name.
+        dict: attributes (JSON-serializable) for rebuilding the dataset.
+    """
+    if not compact:
+        return {'float64': df.to_numpy(dtype=np.float64)}, {'columns': list(df.columns), 'groups': {'float64': list(df.columns)}, 'codes': {}}
+
+    arrays, codes = {}, {}
+    onehot_columns = set()
+    for i, onehot_vars in enumerate((expanded_vars_per_str_var or {}).values()):
+        onehot_vars = [var for var in onehot_vars if var in df.columns]
+        if not onehot_vars:
+            continue
+        onehot = df[onehot_vars].to_numpy(dtype=bool)
+        # rows with no category (missing value) get -1
+        index = np.where(onehot.any(axis=1), onehot.argmax(axis=1), -1)
+        arrays[f'codes{i}'] = index.astype(np.int8 if len(onehot_vars) < 128 else np.int16)
+        codes[f'codes{i}'] = onehot_vars
+        onehot_columns.update(onehot_vars)
+
+    groups = defaultdict(list)
+    for column in df.columns:
+        if column not in onehot_columns:
+            groups[smallest_dtype(df[column].to_numpy()).name].append(column)
+    for dtype, columns in groups.items():
+        arrays[dtype] = df[columns].to_numpy(dtype=dtype)
+    return arrays, {'columns': list(df.columns), 'groups': dict(groups), 'codes': codes}
+
+
+def dataset_from_arrays(arrays, attrs):
+    """Dataset held by the arrays (see dataset_to_arrays); a view of the float64 matrix (no copy), if not compact."""
+    import pandas as pd
+    if not attrs['codes'] and list(attrs['groups']) == ['float64']:
+        return pd.DataFrame(arrays['float64'], columns=attrs['columns'], copy=False)
+
+    columns = {}
+    for dtype, names in attrs['groups'].items():
+        for i, name in enumerate(names):
+            columns[name] = arrays[dtype][:, i]
+    for codes, names in attrs['codes'].items():
+        for i, name in enumerate(names):
+            columns[name] = arrays[codes] == i
+    return pd.DataFrame({name: columns[name] for name in attrs['columns']})
 
 
 class Datasets(ABC):
     """Class that handles all the operations on the datasets."""
+    # whether rows can be added to the datasets (see append_rows and ingestion.ingest_rows)
+    appendable = False
+
     @abstractmethod
-    def __init__(self, db, categories_path_no_inp, categories_path_inp):
+    def __init__(self, db, categories_path_no_inp, categories_path_inp, compact=False):
         self.db = db 
+        # whether expanded datasets use the compact representation (see dataset_to_arrays)
+        self.compact = compact
         # handles expansion of str hyperparameters (one-hot encoding)
         self.expander = StrExpander(self, categories_path_no_inp, categories_path_inp)
 
+        # derived data, computed at the first use and updated when rows are added (see ingestion):
+        # (algorithm, hw, input_dependent) : {'min': {var: value}, 'max': {var: value}}, for numerical variables
+        self._bounds_index = {}
+        # (algorithm, hw, target, input_dependent) : absolute errors of the model on the dataset (np.ndarray)
+        self._error_stats = {}
+        # (algorithm, hw, input_dependent) : fingerprint of the (expanded) dataset, see get_fingerprint
+        self._fingerprints = {}
+        # (algorithm, input_dependent) : number of changes of the bounds of its variables, see get_generation
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+
     @classmethod
-    def from_local(cls, db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp):
+    def from_local(cls, db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp, arrays_path=None,
+                   compact=False):
         """Initialize Datasets using local datasets.
 
         Args:
             db (ConfigDB): instance of ConfigDB.
             data_path_no_inp (str): local path containing the datasets (non input-dependent case).
             data_path_inp (str): local path containing the datasets (input-dependent case).
+            arrays_path (str): path of the store where the expanded datasets are shared by the processes of the
+                node (see ArrayStore); if None, datasets are read and expanded at each use.
+            compact (bool): whether expanded datasets use the smallest dtypes, and category codes for the str
+                variables (see dataset_to_arrays), trading some time to rebuild them for memory.
 
         Returns:
             Datasets: instance of Datasets.
         """
-        return DatasetsLocal(db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp)
+        return DatasetsLocal(db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp, arrays_path,
+                             compact)
 
     @classmethod
-    def from_remote(cls, db, address, categories_path_no_inp, categories_path_inp):
+    def from_remote(cls, db, address, categories_path_no_inp, categories_path_inp, compact=False):
         """Initialize Datasets using remote datasets (VM storage ervice).
 
         Args:
             db (ConfigDB): instance of ConfigDB.
             address (str): complete URL relative to the service that handles the datasets.
+            compact (bool): whether expanded datasets use the compact representation (see from_local).
 
         Returns:
             Datasets: instance of Datasets.
         """
-        return DatasetsRemote(db, address, categories_path_no_inp, categories_path_inp)
+        return DatasetsRemote(db, address, categories_path_no_inp, categories_path_inp, compact)
 
     @abstractmethod
-    def get_raw_dataset(self, algorithm, hw, input_dependent) -> pd.DataFrame:
+    def get_raw_dataset(self, algorithm, hw, input_dependent) -> 'pd.DataFrame':
         """Returns the dataset (Pandas DataFrame) relative to the (algorithm, hw), if present. No categorical expansion."""
         pass
 
     @abstractmethod
-    def get_dataset(self, algorithm, hw, input_dependent) -> pd.DataFrame:
-        """Returns the dataset (Pandas DataFrame) relative to the (algorithm, hw), if present. Includes categorical expansion."""
+    def get_dataset(self, algorithm, hw, input_dependent) -> 'pd.DataFrame':
+        """Returns the dataset (Pandas DataFrame, not to be modified) relative to the (algorithm, hw), if present. Includes categorical expansion."""
         pass
 
-    def _check_dataset_consistency(self, df, algorithm, hw, input_dependent=False):
-        """Checking the columns are the expected ones and that they are numericals."""
+    def _to_arrays(self, dataset, algorithm, input_dependent=False):
+        """Arrays holding an expanded dataset, compact or not (see dataset_to_arrays)."""
+        expanded_vars_per_str_var = None
+        if self.compact:
+            expanded_vars_per_str_var = self.expander.get_expanded_vars_per_str_var(algorithm, input_dependent)
+        return dataset_to_arrays(dataset, expanded_vars_per_str_var, self.compact)
+
+    def get_dataset_nbytes(self, algorithm, hw, input_dependent=False):
+        """Bytes of the expanded dataset relative to the (algorithm, hw) held by the service (None if not held)."""
+        return None
+
+    def get_error_stats_nbytes(self, algorithm, hw, input_dependent=False):
+        """Bytes of the error statistics of each model of the (algorithm, hw), if computed (see get_error_stats)."""
+        return {key[2]: errors.nbytes for key, errors in list(self._error_stats.items())
+                if key[:2] == (algorithm, hw) and key[3] == input_dependent}
+
+    def _check_dataset_consistency(self, df, algorithm, hw, input_dependent=False, partial=False):
+        """Checking the columns are the expected ones and that they are numericals (partial: df holds only some rows)."""
+        import pandas as pd
         hyperparams = self.db.get_hyperparams(algorithm, input_dependent)
         data_targets = self.db.get_targets(algorithm, input_dependent)
         data_targets.remove('price')
@@ -81,7 +237,7 @@ class Datasets(ABC):
             expected_dtype = type_per_var[column]
             if expected_dtype == 'int' and not pd.api.types.is_integer_dtype(df[column]):
                 raise ValueError(f'Column {column} in the dataset for algorithm {algorithm} and hardware {hw} is expected to be integer, but has non-integer values.')
-            elif expected_dtype == 'bin' and set(df[column].unique()) != {0, 1}:
+            elif expected_dtype == 'bin' and (not set(df[column].unique()).issubset({0, 1}) if partial else set(df[column].unique()) != {0, 1}):
                 raise ValueError(f'Column {column} in the dataset for algorithm {algorithm} and hardware {hw} is expected to be binary, but has non-binary values.')
 
     def extract_var_bounds(self, algorithm, input_dependent=False):
@@ -120,17 +276,17 @@ class Datasets(ABC):
 
             for hw in self.db.get_hws(algorithm, input_dependent):
             
-                dataset = self.get_dataset(algorithm, hw, input_dependent)
+                hw_bounds = self.get_hw_bounds(algorithm, hw, input_dependent)
 
                 for var in lb_missing_vars:
-                    all_mins_per_var[var].append(dataset[var].min())
+                    all_mins_per_var[var].append(hw_bounds['min'][var])
                 for var in ub_missing_vars:
-                    all_maxes_per_var[var].append(dataset[var].max())
+                    all_maxes_per_var[var].append(hw_bounds['max'][var])
 
             for var in lb_missing_vars:
-                lb_per_var[var] = min(all_mins_per_var[var]).item()
+                lb_per_var[var] = min(all_mins_per_var[var])
             for var in ub_missing_vars:
-                ub_per_var[var] = max(all_maxes_per_var[var]).item()
+                ub_per_var[var] = max(all_maxes_per_var[var])
 
             # checking that dtypes of variables are compatible with the bounds
             type_per_var = self.db.get_type_per_var(algorithm, input_dependent)
@@ -146,6 +302,183 @@ class Datasets(ABC):
 
         return lb_per_var, ub_per_var
 
+    def get_hw_bounds(self, algorithm, hw, input_dependent=False):
+        """
+        Minimum and maximum value of each numerical variable in the dataset relative to the (algorithm, hw).
+        Computed once and kept up to date as rows are added (see update_bounds_index).
+
+        Returns:
+            dict: {'min': {var: value}, 'max': {var: value}}.
+        """
+        key = (algorithm, hw, input_dependent)
+        metrics.cache_lookup('bounds_index', hit=key in self._bounds_index)
+        if key not in self._bounds_index:
+            dataset = self.get_raw_dataset(algorithm, hw, input_dependent)
+            str_vars = self.db.get_str_vars(algorithm, input_dependent)
+            numerical_vars = [var for var in dataset.columns if var not in str_vars]
+            bounds = {'min': {var: dataset[var].min().item() for var in numerical_vars},
+                      'max': {var: dataset[var].max().item() for var in numerical_vars}}
+            with self._lock:
+                self._bounds_index.setdefault(key, bounds)
+        return self._bounds_index[key]
+
+    def get_fingerprint(self, algorithm, hw, input_dependent=False, refresh=False):
+        """
+        Fingerprint of the dataset relative to the (algorithm, hw), with str variables one-hot encoded (see
+        dataset_fingerprint). Computed once, and again when rows are added or refresh is set (e.g. to detect
+        datasets changed by other means, such as another process); in the latter case, if the dataset changed,
+        the bounds and error statistics derived from it are computed again when needed.
+        """
+        key = (algorithm, hw, input_dependent)
+        if refresh or key not in self._fingerprints:
+            fingerprint = dataset_fingerprint(self.get_dataset(algorithm, hw, input_dependent))
+            previous = self._fingerprints.get(key)
+            with self._lock:
+                self._fingerprints[key] = fingerprint
+                if previous is not None and previous != fingerprint:
+                    self._bounds_index.pop(key, None)
+                    self._generations[(algorithm, input_dependent)] += 1
+            if previous is not None and previous != fingerprint:
+                self.reset_error_stats(algorithm, hw, input_dependent)
+        return self._fingerprints[key]
+
+    def validate_rows(self, algorithm, hw, rows, input_dependent=False):
+        """
+        Checks new rows for the dataset relative to the (algorithm, hw): the columns must be the expected ones,
+        with values of the declared types, within the bounds declared in the configs (if any), and
+        categories of str variables either known for the algorithm or new (see StrExpander.get_new_categories).
+
+        Args:
+            algorithm (str): algorithm id.
+            hw (str): hardware platform id.
+            rows (list[dict] or pd.DataFrame): new rows, with a value for each column of the dataset.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+
+        Returns:
+            pd.DataFrame: the new rows.
+        """
+        import pandas as pd
+        if hw not in self.db.get_hws(algorithm, input_dependent):
+            raise AttributeError(f'Hardware platform {hw} not available for algorithm {algorithm}.')
+        df = pd.DataFrame(rows)
+        if df.empty:
+            raise AttributeError('No rows to add.')
+        self._check_dataset_consistency(df, algorithm, hw, input_dependent, partial=True)
+        if df.isnull().values.any():
+            raise AttributeError(f'Rows for algorithm {algorithm} and hardware {hw} have missing values.')
+
+        lb_per_var = self.db.get_lb_per_var(algorithm, input_dependent)
+        ub_per_var = self.db.get_ub_per_var(algorithm, input_dependent)
+        for var in df.columns:
+            if lb_per_var.get(var) is not None and (df[var] < lb_per_var[var]).any():
+                raise AttributeError(f'Values of {var} below its lower bound ({lb_per_var[var]}).')
+            if ub_per_var.get(var) is not None and (df[var] > ub_per_var[var]).any():
+                raise AttributeError(f'Values of {var} above its upper bound ({ub_per_var[var]}).')
+        return df
+
+    def add_categories(self, algorithm, new_categories, input_dependent=False):
+        """
+        Adds categories to the mapping of the algorithm's str variables (see StrExpander.extend_categories). The
+        features of all its models change: they have to be retrained (see MLModels.get_stale_reasons), and are
+        meanwhile used with the features they were trained on (see MLModels.get_model_features).
+        """
+        self.expander.extend_categories(algorithm, new_categories, input_dependent)
+        with self._lock:
+            self._generations[(algorithm, input_dependent)] += 1
+
+    def update_bounds_index(self, algorithm, hw, rows, input_dependent=False):
+        """
+        Updates the bounds of the (algorithm, hw) with new rows (see get_hw_bounds).
+
+        Returns:
+            list[str]: variables whose bounds changed.
+        """
+        key = (algorithm, hw, input_dependent)
+        changed = []
+        with self._lock:
+            bounds = self._bounds_index.get(key)
+            # not computed yet: it will be, including the new rows
+            if bounds is None:
+                return changed
+            bounds = {'min': dict(bounds['min']), 'max': dict(bounds['max'])}
+            for var in bounds['min']:
+                new_min, new_max = rows[var].min().item(), rows[var].max().item()
+                if new_min < bounds['min'][var] or new_max > bounds['max'][var]:
+                    changed.append(var)
+                bounds['min'][var] = min(bounds['min'][var], new_min)
+                bounds['max'][var] = max(bounds['max'][var], new_max)
+            self._bounds_index[key] = bounds
+            if changed:
+                self._generations[(algorithm, input_dependent)] += 1
+        return changed
+
+    def get_generation(self, algorithm, input_dependent=False):
+        """Counter increased whenever the bounds of the variables of the algorithm (may) change, e.g. to refresh data derived from them."""
+        return self._generations[(algorithm, input_dependent)]
+
+    def get_error_stats(self, models, algorithm, hw, target, input_dependent=False):
+        """
+        Absolute errors of the model for (algorithm, hw, target) on its dataset, as embedded (i.e. compacted, see
+        MLModels.get_rules). Computed once, extended as rows are added and recomputed when the model is retrained.
+
+        Returns:
+            np.ndarray: absolute error on each row of the dataset.
+        """
+        return self.get_error_stats_per_target(models, algorithm, hw, [target], input_dependent)[target]
+
+    def get_error_stats_per_target(self, models, algorithm, hw, targets, input_dependent=False):
+        """
+        Absolute errors of the models for (algorithm, hw) and each of the targets (see get_error_stats). The missing
+        ones are computed together: the dataset is read, and its feature matrix built, once for all the targets.
+
+        Returns:
+            dict: absolute error on each row of the dataset (np.ndarray), for each target.
+        """
+        errors_per_target = {}
+        for target in targets:
+            errors = self._error_stats.get((algorithm, hw, target, input_dependent))
+            metrics.cache_lookup('error_stats', hit=errors is not None)
+            if errors is not None:
+                errors_per_target[target] = errors
+
+        missing = [target for target in targets if target not in errors_per_target]
+        if missing:
+            dataset = self.get_dataset(algorithm, hw, input_dependent)
+            # feature matrices by features (models trained before new categories were added have fewer of them)
+            X = {}
+            for target in missing:
+                model = models.get_model(algorithm, hw, target, input_dependent)
+                features = models.get_model_features(algorithm, hw, target, input_dependent)
+                if tuple(features) not in X:
+                    X[tuple(features)] = dataset[features].to_numpy(dtype=np.float64)
+                # errors of the tree as embedded, i.e. including the shift of the predictions due to its compaction
+                predictions = compacted_predict(model, X[tuple(features)], models.compaction_tolerance)
+                errors = np.abs(dataset[target].to_numpy(dtype=np.float64) - predictions)
+                with self._lock:
+                    errors_per_target[target] = self._error_stats.setdefault((algorithm, hw, target, input_dependent), errors)
+        return errors_per_target
+
+    def extend_error_stats(self, models, algorithm, hw, rows, input_dependent=False):
+        """Adds the errors of the current models on new rows to the error statistics of the (algorithm, hw), if computed."""
+        expanded_rows = self.expander._expand_categoricals(rows.copy(), algorithm, input_dependent)
+        for target in self.db.get_targets(algorithm, input_dependent):
+            key = (algorithm, hw, target, input_dependent)
+            if key not in self._error_stats:
+                continue
+            model = models.get_model(algorithm, hw, target, input_dependent)
+            X = expanded_rows[models.get_model_features(algorithm, hw, target, input_dependent)].to_numpy(dtype=np.float64)
+            predictions = compacted_predict(model, X, models.compaction_tolerance)
+            errors = np.abs(expanded_rows[target].to_numpy(dtype=np.float64) - predictions)
+            with self._lock:
+                if key in self._error_stats:
+                    self._error_stats[key] = np.concatenate([self._error_stats[key], errors])
+
+    def reset_error_stats(self, algorithm, hw, input_dependent=False):
+        """Drops the error statistics of the (algorithm, hw) (e.g. when its models are retrained)."""
+        with self._lock:
+            for key in [key for key in self._error_stats if key[:2] == (algorithm, hw) and key[3] == input_dependent]:
+                del self._error_stats[key]
+
     def get_var_bounds_all(self, request: OptimizationRequest):
         """
         Compute upper and lower bounds of each variable, including price.
@@ -171,71 +504,154 @@ class Datasets(ABC):
     def get_robust_coeff(self, models, request):
         """
         Compute robustness coefficients for each predictive model, according to the specified robustness factor.
+        Only the targets bounded by the user constraints are tightened (see HADA), so only their coefficients are
+        computed; the hws whose errors are not computed yet are handled in parallel.
 
         Args:
             models (MLModels): object that handles ML models.
             request (OptimizationRequest): represents the user's request.
 
         Returns:
-            robust_coeff (dict): robustness coefficient for each predictive model.
+            robust_coeff (dict): robustness coefficient for each (hw, target) in the user constraints.
         """
 
         if request.robustness_fact or request.robustness_fact == 0:
+            algorithm, input_dependent = request.algorithm, request.input_dependent
+            constrained_targets = list(request.user_constraints.get_constraints())
+            # The target price is not estimated: it does not require any robustness coefficient
+            targets = [target for target in constrained_targets if target != 'price']
+            hws = self.db.get_hws(algorithm, input_dependent)
+
+            def get_coeff_per_target(hw):
+                errors_per_target = self.get_error_stats_per_target(models, algorithm, hw, targets, input_dependent)
+                # same as pandas' std (sample standard deviation) and quantile (linear interpolation)
+                return {target: (np.std(errors, ddof=1) * np.quantile(errors, request.robustness_fact)).item()
+                        for target, errors in errors_per_target.items()}
+
+            # reading the datasets and predicting is worth a thread per hw only on a cold cache
+            cold_hws = [hw for hw in hws
+                        if any((algorithm, hw, target, input_dependent) not in self._error_stats for target in targets)]
+            if len(cold_hws) > 1:
+                with ThreadPoolExecutor(min(len(hws), os.cpu_count() or 1)) as executor:
+                    coeff_per_target_per_hw = dict(zip(hws, executor.map(get_coeff_per_target, hws)))
+            else:
+                coeff_per_target_per_hw = {hw: get_coeff_per_target(hw) for hw in hws}
+
             robust_coeff = {}
-            for target in self.db.get_targets(request.algorithm, request.input_dependent): 
-                for hw in self.db.get_hws(request.algorithm, request.input_dependent): 
-                    # The target price is not estimated: it does not require any robustness coefficient 
-                    if target == 'price': 
-                        robust_coeff[(hw, "price")] = 0
-                    else: 
-                        dataset = self.get_dataset(request.algorithm, hw, request.input_dependent)
-                        model = models.get_model(request.algorithm, hw, target, request.input_dependent)
-
-                        #ml_inputs = [col for col in dataset.columns if col not in self.db.get_targets(request.algorithm)]
-                        ml_inputs = self.expander.get_expanded_ml_input_vars(request.algorithm, request.input_dependent)
-                        dataset[f'{target}_pred'] = model.predict(dataset[ml_inputs])
-                        dataset[f'{target}_error'] = (dataset[f'{target}'] - dataset[f'{target}_pred']).abs()
-                        robust_coeff[(hw, target)] = dataset[f'{target}_error'].std() * dataset[f'{target}_error'].quantile(request.robustness_fact)
+            for hw in hws:
+                if 'price' in constrained_targets:
+                    robust_coeff[(hw, 'price')] = 0
+                for target, coeff in coeff_per_target_per_hw[hw].items():
+                    robust_coeff[(hw, target)] = coeff
             return robust_coeff
         else:
             return None 
 
 
 class DatasetsLocal(Datasets):
-    """Handles datasets stored locally."""
-    def __init__(self, db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp):
-        super().__init__(db, categories_path_no_inp, categories_path_inp)
+    """
+    Handles datasets stored locally. With a store (see ArrayStore), each expanded dataset is kept once per node
+    as a float64 array, memory-mapped by all the processes of the service: it is read and expanded again only
+    when its file (or the categorical mapping of its algorithm) changes.
+    """
+    appendable = True
+
+    def __init__(self, db, data_path_no_inp, data_path_inp, categories_path_no_inp, categories_path_inp, arrays_path=None,
+                 compact=False):
+        super().__init__(db, categories_path_no_inp, categories_path_inp, compact)
         self.data_path_no_inp = data_path_no_inp
         self.data_path_inp = data_path_inp
+        self.store = ArrayStore(arrays_path) if arrays_path else None
 
-    def get_raw_dataset(self, algorithm, hw, input_dependent=False):
+    def _get_dataset_path(self, algorithm, hw, input_dependent=False):
         path = self.data_path_inp if input_dependent else self.data_path_no_inp
         dataset_path = os.path.join(path, f'{algorithm}_{hw}.csv')
         if not os.path.exists(dataset_path):
             raise FileNotFoundError(f'Dataset for ({algorithm}, {hw}) not found.')
+        return dataset_path
+
+    def _get_dataset_version(self, algorithm, hw, input_dependent=False):
+        """Version of the expanded dataset, changing whenever its file or the categorical mapping is replaced."""
+        stat = os.stat(self._get_dataset_path(algorithm, hw, input_dependent))
+        representation = 'compact' if self.compact else 'float64'
+        return f'{representation}-{stat.st_mtime_ns}-{stat.st_size}-{self._get_categories_version(algorithm, input_dependent)}'
 
-        dataset = pd.read_csv(dataset_path)
+    def _get_categories_version(self, algorithm, input_dependent=False):
+        categories_path = self.expander._get_categories_path(algorithm, input_dependent)
+        return str(os.stat(categories_path).st_mtime_ns if os.path.exists(categories_path) else 0)
+
+    def get_raw_dataset(self, algorithm, hw, input_dependent=False):
+        import pandas as pd
+        dataset = pd.read_csv(self._get_dataset_path(algorithm, hw, input_dependent))
 
         # checking if data complies to configs
         self._check_dataset_consistency(dataset, algorithm, hw, input_dependent)
 
         return dataset
 
-    def get_dataset(self, algorithm, hw, input_dependent=False):
-
-        dataset = self.get_raw_dataset(algorithm, hw, input_dependent)
-        # expanding str variables into bin (one-hot encoding) internally
-        dataset = self.expander._expand_categoricals(dataset, algorithm, input_dependent)
+    def _get_store_key(self, algorithm, hw, input_dependent=False):
+        return f'{input_case(input_dependent)}/{algorithm}_{hw}'
 
-        return dataset
+    def get_dataset(self, algorithm, hw, input_dependent=False):
+        if self.store is None:
+            dataset = self.get_raw_dataset(algorithm, hw, input_dependent)
+            # expanding str variables into bin (one-hot encoding) internally
+            dataset = self.expander._expand_categoricals(dataset, algorithm, input_dependent)
+            return dataset_from_arrays(*self._to_arrays(dataset, algorithm, input_dependent)) if self.compact else dataset
+
+        key = self._get_store_key(algorithm, hw, input_dependent)
+        # taken before reading the dataset: if the file is replaced meanwhile, the stored version is outdated
+        version = self._get_dataset_version(algorithm, hw, input_dependent)
+        arrays, attrs = self.store.get(key, version)
+        metrics.cache_lookup('stored_datasets', hit=arrays is not None)
+        if arrays is None:
+            dataset = self.get_raw_dataset(algorithm, hw, input_dependent)
+            dataset = self.expander._expand_categoricals(dataset, algorithm, input_dependent)
+            # the categorical mapping may have just been created by the expansion
+            version = version.rsplit('-', 1)[0] + '-' + self._get_categories_version(algorithm, input_dependent)
+            arrays, attrs = self.store.put(key, version, *self._to_arrays(dataset, algorithm, input_dependent))
+            # replaced meanwhile by a newer version
+            if arrays is None:
+                return dataset
+        # read-only view of the shared array (no copy), unless compact
+        return dataset_from_arrays(arrays, attrs)
+
+    def get_dataset_nbytes(self, algorithm, hw, input_dependent=False):
+        if self.store is None:
+            return None
+        try:
+            version = self._get_dataset_version(algorithm, hw, input_dependent)
+        except FileNotFoundError:
+            return None
+        arrays, _ = self.store.get(self._get_store_key(algorithm, hw, input_dependent), version)
+        return sum(array.nbytes for array in arrays.values()) if arrays is not None else None
+
+    def append_rows(self, algorithm, hw, rows, input_dependent=False):
+        import pandas as pd
+        dataset_path = self._get_dataset_path(algorithm, hw, input_dependent)
+
+        # the file is replaced, so that readers never see partially written rows; other processes (e.g. workers)
+        # adding rows to the same dataset wait, not to replace it with a copy missing these rows (or theirs)
+        with self._lock, file_lock(dataset_path):
+            columns = pd.read_csv(dataset_path, nrows=0).columns
+            with open(dataset_path) as f:
+                content = f.read()
+            if content and not content.endswith('\n'):
+                content += '\n'
+            def write(f):
+                f.write(content)
+                rows[list(columns)].to_csv(f, header=False, index=False)
+            replace_file(dataset_path, write)
+            self._fingerprints.pop((algorithm, hw, input_dependent), None)
 
 class DatasetsRemote(Datasets):
     """Handles retrieval of datasets from the storage web service."""
-    def __init__(self, db, address, categories_path_no_inp, categories_path_inp):
-        super().__init__(db, categories_path_no_inp, categories_path_inp)
+    def __init__(self, db, address, categories_path_no_inp, categories_path_inp, compact=False):
+        super().__init__(db, categories_path_no_inp, categories_path_inp, compact)
         self.address = address
 
     def get_raw_dataset(self, algorithm, hw, input_dependent=False):
+        import pandas as pd
         request_url = f'/datasets/{algorithm}/{hw}'
         if input_dependent:
             request_url += '/input'
@@ -258,7 +674,7 @@ class DatasetsRemote(Datasets):
         # expanding str variables into bin (one-hot encoding) internally
         dataset = self.expander._expand_categoricals(dataset, algorithm, input_dependent)
 
-        return dataset
+        return dataset_from_arrays(*self._to_arrays(dataset, algorithm, input_dependent)) if self.compact else dataset
 
 
 class StrExpander():
@@ -370,9 +786,40 @@ class StrExpander():
 
         """
         categories = self.get_categories_per_str_var(algorithm, input_dependent)
-        return {var:[self._get_onehot_var_name(var, category) for category in var_categories]
+        # categories are sorted, for the order of the one-hot variables not to depend on the process (set order)
+        return {var:[self._get_onehot_var_name(var, category) for category in sorted(var_categories, key=str)]
                 for var, var_categories in categories.items()}
 
+    def get_new_categories(self, df, algorithm, input_dependent=False):
+        """
+        Categories of the str variables in rows of a dataset (not expanded) missing from the mapping of the algorithm.
+
+        Returns:
+            dict: sorted list of new categories, for each str variable with any.
+        """
+        categories = self.get_categories_per_str_var(algorithm, input_dependent)
+        new_categories = {var: set(df[var].unique().tolist()) - set(var_categories) for var, var_categories in categories.items()}
+        return {var: sorted(values, key=str) for var, values in new_categories.items() if values}
+
+    def extend_categories(self, algorithm, new_categories, input_dependent=False):
+        """
+        Adds categories to the mapping of the algorithm (e.g. brought by new rows, see ingestion.ingest_rows). The
+        mapping file is replaced atomically: expanded datasets are built again with the new one-hot columns.
+
+        Args:
+            algorithm (str): algorithm id.
+            new_categories (dict): categories to add, for each str variable.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+        """
+        algo_categories_path = self._get_categories_path(algorithm, input_dependent)
+        categories = self.get_categories_per_str_var(algorithm, input_dependent)
+        with self.datasets._lock, file_lock(algo_categories_path):
+            # read again, as other processes may have extended the mapping meanwhile
+            categories = self.get_categories_per_str_var(algorithm, input_dependent)
+            for var, values in new_categories.items():
+                categories[var] = set(categories[var]).union(values)
+            replace_file(algo_categories_path, lambda f: pickle.dump(categories, f), 'wb')
+
     def get_encoded_selection(self, algorithm, var, selected_category, input_dependent=False):
         """Return dict with encoded variables (for a given categorical var.) as keys, with value being 1 for the selected category, 0 for the rest."""
         categories = self.get_categories_per_str_var(algorithm, input_dependent)
@@ -388,7 +835,8 @@ class StrExpander():
         """
         Expands categorical variables (type "str") to one-hot encoding (type "bin") internally.
         The mapping is stored on disk if not already existing, and is common for all hardwares for a given algorithm; 
-        Assumption: if new hardware platforms are added for a given algorithm, they must have no new categories for the str variables;
+        Categories brought by rows added through ingestion extend the mapping (see extend_categories); new hardware
+        platforms added for a given algorithm by other means must have no new categories for the str variables,
         otherwise the mappings have to be invalidated manually.
 
         Args:
@@ -399,9 +847,11 @@ class StrExpander():
         Returns:
             pd.DataFrame: DataFrame with str variables being one-hot encoded.
         """
+        import pandas as pd
 
         # load mapping (if existing) otherwise make it (based on current dataset) and store it
         algo_categories_path = self._get_categories_path(algorithm, input_dependent)
+        metrics.cache_lookup('categorical_mappings', hit=os.path.exists(algo_categories_path))
         if os.path.exists(algo_categories_path):
             categories = pickle.load(open(algo_categories_path, 'rb'))
         else:
@@ -420,15 +870,15 @@ class StrExpander():
             
             pickle.dump(categories, open(algo_categories_path, 'wb'))
 
-        # expanding variables
+        # expanding variables: the one-hot columns of all the str variables are added at once (a single copy)
+        new_cols = []
         for var, var_categories in categories.items():
             if not set(df[var].unique().tolist()).issubset(var_categories):
                 raise AttributeError(f"Found unexpected categories for algorithm {algorithm}")
             
             # adding all categories (for all harware platforms), even if not present in this specific dataset
-            df[var] = pd.Categorical(df[var], categories=var_categories)
-            new_cols = pd.get_dummies(df[var], prefix=var, prefix_sep='_')
-            df.drop(var, axis=1, inplace=True)
-            df = pd.concat([df,new_cols], axis=1)
-
-        return df
+            values = pd.Categorical(df[var], categories=sorted(var_categories, key=str))
+            new_cols.append(pd.get_dummies(values, prefix=var, prefix_sep='_').set_axis(df.index))
+        if not new_cols:
+            return df
+        return pd.concat([df.drop(columns=list(categories))] + new_cols, axis=1)
@@ -1,18 +1,83 @@
-import docplex
-from eml.backend import cplex_backend
-from eml.tree.reader.sklearn_reader import read_sklearn_tree
-from eml.tree import embed 
-from docplex.mp.model_reader import ModelReader
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import docplex.mp.model
+import numpy as np
 from vemm.core.configdb import ConfigDB
 from vemm.core.datasets import Datasets
-from vemm.core.optimization_request import OptimizationSolution
+from vemm.core.optimization_request import OptimizationSolution, NoSolution, SolverSettings
+from vemm.core.metrics import metrics, input_case
+from vemm.core.presolve import get_fixed_inputs, get_ml_input_bounds, get_target_ranges, prune_hws
+from vemm.core.tree_rules import reachable_leaves
+from vemm.core.model_export import export_model
+
+# CPLEX statuses for which the solution is proven optimal (within the MIP gap tolerances)
+PROVEN_OPTIMAL_STATUSES = {1, 101, 102}
+# CPLEX statuses for which the model is proven infeasible (also when a cutoff excludes every solution)
+PROVEN_INFEASIBLE_STATUSES = {3, 103}
+
+# process pools solving the subproblems of decomposed requests, one per number of workers (created lazily)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ModelSpec():
+    """
+    Everything needed to build the HADA model of a request (or one of its subproblems) and decode its solution,
+    as plain data: unlike the request, it can be sent to the processes solving the subproblems.
+
+    Args:
+        db (ConfigDB): instance of ConfigDB.
+        datasets (Datasets): instance of Datasets.
+        request (OptimizationRequest): represents the user's request.
+        var_bounds (dict): lower and upper bound for each variable.
+    """
+    def __init__(self, db, datasets, request, var_bounds):
+        self.algorithm = request.algorithm
+        self.input_dependent = request.input_dependent
+        self.country = request.country
+        self.target = request.target
+        self.opt_type = request.opt_type
+        self.constraints = dict(request.user_constraints.get_constraints())
+        self.targets = set(list(self.constraints.keys()) + [self.target])
+        self.prices = dict(request.hws_prices.get_prices_per_hw()) if 'price' in self.targets else {}
+        self.solver_settings = dict(request.solver_settings.get_settings())
+
+        # Expand data objects with one-hot encoded categorical variables
+        self.str_vars = datasets.expander.get_expanded_vars_per_str_var(self.algorithm, self.input_dependent)
+        self.hyperparams = datasets.expander.get_expanded_hyperparams(self.algorithm, self.input_dependent)
+        self.str_hyperparams = set(self.str_vars.keys()).intersection(db.get_hyperparams(self.algorithm, self.input_dependent))
+        self.ml_input_vars = datasets.expander.get_expanded_ml_input_vars(self.algorithm, self.input_dependent)
+        self.var_bounds = dict({var : var_bounds[var] for var in var_bounds if var not in self.str_vars},
+                **{category : {'lb' : 0, 'ub' : 1} for var, categories in self.str_vars.items() for category in categories})
+        # Variable types ('bin', 'int' or 'float'), assuming that price is always a float
+        self.var_type = datasets.expander.get_expanded_var_type(self.algorithm, self.input_dependent)
+        self.var_type['price'] = 'float'
+        self.fixed_inputs = get_fixed_inputs(datasets, request)
+
+        # filled by the presolve, see HADA
+        self.ml_lb, self.ml_ub = None, None
+        self.target_ranges = {}
+        self.robust_coeff = None
+        # set when the models of the request are exported (see ModelExporter.sample)
+        self.export = None
+
+    def get_target_bounds(self, hw, target):
+        """Bounds of the variable of a target for a hw: its price, or the values its predictive model can output."""
+        if target == "price":
+            return self.prices[hw], self.prices[hw]
+        return self.target_ranges[(hw, target)]
+
 
 def HADA(db : ConfigDB,
          datasets : Datasets,
          request,
          models,
          var_bounds,
-         robust_coeff):
+         robust_coeff,
+         exporter=None):
     """
     Implement HADA:
         1. Declare variables and basic constraints
@@ -20,6 +85,9 @@ def HADA(db : ConfigDB,
         3. Declare user-defined constraints and objective
         4. Solve the model and output an optimal matching (hw-platform, alg-configuration)
 
+    If the request's solver settings ask for decomposition, instead of a single model selecting the hw, a
+    subproblem is built and solved for each hw (in parallel, see solve_decomposed) and the best solution is kept.
+
     PARAMETERS
     ---------
     db : an instance of class core.configdb.ConfigDB
@@ -28,102 +96,182 @@ def HADA(db : ConfigDB,
     models : an instance of class core.mlmodels.MLModels
     var_bounds : a dict with upper and lower bound for each variable
     robust_coeff : a dict with robustness coefficient to apply for each pair (hardware, target)
+    exporter : an instance of class core.model_export.ModelExporter, if the models built are to be exported
 
     RETURN
     ------
-    sol : a dict with the solution found, or None if no solution is found
+    sol : an instance of OptimizationSolution with the solution found, or of NoSolution (falsy) telling why none is found
+    """
+
+    labels = {'algorithm': request.algorithm, 'input_case': input_case(request.input_dependent)}
+    spec, hws, trees, pruned_hws = prepare_model(db, datasets, request, models, var_bounds, robust_coeff)
+    if not hws:
+        # proven by the presolve, without building the model
+        return NoSolution('infeasible', spec.algorithm, spec.input_dependent, pruned_hws=pruned_hws)
+    if exporter is not None:
+        spec.export = exporter.sample(request)
+
+    if spec.solver_settings.get('decompose', False) and len(hws) > 1:
+        result, solve_stats = solve_decomposed(spec, hws, trees)
+    else:
+        build_start = time.perf_counter()
+        mdl, embed_time = build_model(spec, hws, trees)
+        build_time = time.perf_counter() - build_start - embed_time
+        metrics.observe_phase('embed', embed_time, **labels)
+        metrics.observe_phase('build', build_time, **labels)
+        metrics.observe_milp_size(mdl, **labels)
+        with metrics.span('solve', **labels):
+            result = solve_model(spec, mdl, hws)
+        solve_stats = result['stats']
+        if spec.export is not None and export_model(spec.export, mdl, spec, hws, result,
+                                                    build_time=build_time, embed_time=embed_time):
+            metrics.inc('exported_models_total', **labels)
+
+    solve_stats['pruned_hws'] = len(pruned_hws)
+    if not spec.solver_settings.get('solve_stats', False):
+        solve_stats = None
+    if result['chosen_hw'] is None:
+        return NoSolution(get_no_solution_status(result['proven_infeasible'], result['status']),
+                          spec.algorithm, spec.input_dependent, solve_stats)
+    return decode_solution(spec, result, solve_stats)
+
+
+def get_no_solution_status(proven_infeasible, solver_status):
+    """Why a solve found no solution (see NoSolution), given whether it proved the model infeasible and the solver's status."""
+    if proven_infeasible:
+        return 'infeasible'
+    return 'time_limit' if 'time limit' in solver_status else 'unknown'
+
+
+def prepare_model(db, datasets, request, models, var_bounds, robust_coeff):
+    """
+    Everything needed to build the HADA model of a request (see HADA): its specification, the predictive models
+    (loaded, or trained if needed) and the presolve, dropping the hws that provably cannot satisfy the constraints.
+
+    Returns:
+        spec (ModelSpec): the request's model specification (after the presolve).
+        hws (list[str]): hws left by the presolve (if none, there is no solution).
+        trees (dict): compiled rules (TreeRules) of the trained tree for each (hw, target).
+        pruned_hws (dict): reason each dropped hw is dropped for (see prune_hws).
     """
+    hws = db.get_hws(request.algorithm, request.input_dependent)
+    labels = {'algorithm': request.algorithm, 'input_case': input_case(request.input_dependent)}
+    spec = ModelSpec(db, datasets, request, var_bounds)
+
+    # Predictive models are retrieved (and trained, if needed) before building the model, so that
+    # the time spent in loading/training is not accounted as model building
+    trees = {(hw, target): models.get_rules(request.algorithm, hw, target, request.input_dependent)
+             for target in spec.targets if target != "price"
+             for hw in hws}
+
+    ####### PRESOLVE #######
+    # Hws that provably cannot satisfy the user constraints (given the leaves their predictive models can reach
+    # and their prices) are dropped before building the model; if none is left, there is no solution
+    presolve_start = time.perf_counter()
+    spec.ml_lb, spec.ml_ub = get_ml_input_bounds(spec.ml_input_vars, spec.var_bounds, spec.fixed_inputs)
+    spec.target_ranges = get_target_ranges(trees, spec.var_bounds, spec.ml_lb, spec.ml_ub)
+    pruned_hws = {}
+    hws = prune_hws(request, hws, spec.target_ranges, robust_coeff, pruned_hws)
+    metrics.observe_phase('presolve', time.perf_counter() - presolve_start, **labels)
+    metrics.inc('pruned_hws_total', len(pruned_hws), **labels)
+
+    # If no robustness is required, fix all coefficients to 0
+    if robust_coeff is None:
+        robust_coeff = {(hw, target) : 0
+                        for hw in hws
+                        for target in spec.constraints}
+    spec.robust_coeff = robust_coeff
+    return spec, hws, trees, pruned_hws
+
+
+def build_model(spec, hws, trees):
+    """
+    Builds the HADA model over a set of hws. With a single hw (e.g. a subproblem of a decomposed request),
+    the model has no hw selection: user constraints are plain constraints and the objective is the hw's target.
+
+    Variables are created in bulk and their handles kept (no lookups by name); constraints are added in
+    batches, and the predictive models are embedded by embed_tree.
 
-    ####### MODEL #######
-    bkd = cplex_backend.CplexBackend()
+    Args:
+        spec (ModelSpec): the request's model specification (after the presolve).
+        hws (list[str]): hws to include in the model.
+        trees (dict): compiled rules (TreeRules) of the trained tree for each (hw, target), for (at least) the hws included.
+
+    Returns:
+        mdl (docplex.mp.model.Model): the model.
+        embed_time (float): time spent in embedding the predictive models (seconds).
+    """
     mdl = docplex.mp.model.Model("HADA")
     #mdl.parameters.mip.tolerances.integrality = 0.0
+    select_hw = len(hws) > 1
 
-    hws = db.get_hws(request.algorithm, request.input_dependent)
-    targets = set(list(request.user_constraints.get_constraints().keys()) + [request.target])
-    
-    # Expand data objects with one-hot encoded categorical variables
-    str_vars = datasets.expander.get_expanded_vars_per_str_var(request.algorithm, request.input_dependent)
-    hyperparams = datasets.expander.get_expanded_hyperparams(request.algorithm, request.input_dependent)
-    inputs_and_hyperparams = datasets.expander.get_expanded_ml_input_vars(request.algorithm, request.input_dependent)
-    var_type = datasets.expander.get_expanded_var_type(request.algorithm, request.input_dependent)
-    var_bounds = dict({var : var_bounds[var] for var in var_bounds if var not in str_vars},
-            **{category : {'lb' : 0, 'ub' : 1} for var, categories in str_vars.items() for category in categories})
-
-    # Retrieve variable types, assuming that price is always a float
+    # Retrieve variable types
     cplex_type = {'bin' : mdl.binary_vartype, 'int' : mdl.integer_vartype, 'float' : mdl.continuous_vartype}
-    var_type['price'] = 'float'
-    var_type = {var : cplex_type[var_type[var]] for var in var_type.keys()}
+    var_type = {var : cplex_type[spec.var_type[var]] for var in spec.var_type.keys()}
+    var_bounds = spec.var_bounds
+
+    # constraints (and their names) added at once
+    cts, ct_names = [], []
 
     ####### VARIABLES #######
     # A binary variable for each hw, specifying whether this hw is selected or not
-    for hw in hws:
-        mdl.binary_var(name = f"b_{hw}")
-
-    ml_var = {}
+    if select_hw:
+        b = mdl.binary_var_dict(hws, name = "b")
 
-    # A variable for each hyperparameter, whose type matches the hyperparameter's type
-    # If the hyperparameter is non-continuous, it also requires an auxiliary continuous variable and 
-    # an integrality constraint: the auxiliary variable is used as input to the predictive models (emllib 
-    # accepts only continuous variables), the integrality (equality) constraint is used to convert the 
-    # auxiliary variable back into the binary/integer one
+    # A variable for each hyperparameter, whose type matches the hyperparameter's type; binary/integer ones are
+    # used directly as inputs to the predictive models (whose split conditions on them are snapped to integer
+    # values, see MLModels.get_rules)
     # NEW: now handles both input variables (input-dependent case) and hyperparameters
-    for var in inputs_and_hyperparams:
-    #for hyperparam in hyperparams:
-        mdl.var(name = var, 
-                vartype = var_type[var],
-                lb = var_bounds[var]['lb'],
-                ub = var_bounds[var]['ub'])
-        ml_var[var] = var
-        if var_type[var] != mdl.continuous_vartype:
-            mdl.var(name = f"auxiliary_{var}", 
-                    vartype = mdl.continuous_vartype,
-                    lb = var_bounds[var]['lb'],
-                    ub = var_bounds[var]['ub'])
-            mdl.add_constraint(mdl.get_var_by_name(var) == mdl.get_var_by_name(f"auxiliary_{var}"), ctname = f"{var}_integrality_constraint")
-            ml_var[var] = f'auxiliary_{var}'
+    x = {}
+    for vartype in set(var_type[var] for var in spec.ml_input_vars):
+        keys = [var for var in spec.ml_input_vars if var_type[var] == vartype]
+        x.update(mdl.var_dict(keys, vartype,
+                              lb = [var_bounds[var]['lb'] for var in keys],
+                              ub = [var_bounds[var]['ub'] for var in keys],
+                              name = keys))
+    # variables used as features of the predictive models
+    tree_in = [x[var] for var in spec.ml_input_vars]
 
     # A variable for each target and hw, whose type matches the target's type. 
-    # Also in this case, if the target is non-continuous, it requires auxiliary variables and constraints
-    for target in targets:
+    # Bounds are specific to each hw: the range of values its predictive model can output within the
+    # variables' bounds (see presolve), or its price; tighter bounds give a tighter relaxation.
+    y = {}
+    for target in spec.targets:
+        bounds = [spec.get_target_bounds(hw, target) for hw in hws]
+        y_target = mdl.var_dict(hws, var_type[target],
+                                lb = [lb for lb, _ in bounds],
+                                ub = [ub for _, ub in bounds],
+                                name = [f"{hw}_{target}" for hw in hws])
         for hw in hws:
-            mdl.var(name = f"{hw}_{target}", 
-                    vartype = var_type[target],
-                    lb = var_bounds[target]['lb'],
-                    ub = var_bounds[target]['ub'])
-            ml_var[f'{hw}_{target}'] = f'{hw}_{target}'
-            if var_type[target] != mdl.continuous_vartype:
-                mdl.var(name = f"auxiliary_{hw}_{target}", 
-                    vartype = mdl.continuous_vartype,
-                    lb = var_bounds[target]['lb'],
-                    ub = var_bounds[target]['ub'])
-                mdl.add_constraint(mdl.get_var_by_name(f'{hw}_{target}') == mdl.get_var_by_name(f"auxiliary_{hw}_{target}"), ctname = f"{hw}_{target}_integrality_constraint")
-                ml_var[f'{hw}_{target}'] = f'auxiliary_{hw}_{target}'
+            y[(hw, target)] = y_target[hw]
 
     ####### CONSTRAINTS ######
-    # Constraints on input values
-    if request.input_dependent:
-        inputs = request.inputs.get_inputs()
-        inputs_types = {var:type for var,type in db.get_type_per_var(request.algorithm, request.input_dependent).items()
-                        if var in inputs.keys()}
-        for input_var, type in inputs_types.items():
-            if type == 'str':
-                enc_categories = datasets.expander.get_encoded_selection(request.algorithm, input_var, inputs[input_var], request.input_dependent)
-                for enc_input, enc_value in enc_categories.items():
-                    mdl.add_constraint(mdl.get_var_by_name(enc_input) == enc_value, ctname = f"auxiliary_{enc_input}")
-            else:
-                mdl.add_constraint(mdl.get_var_by_name(input_var) == inputs[input_var], ctname = f"auxiliary_{input_var}")
-
+    # Constraints on input values (str inputs are fixed through their one-hot encoding)
+    for input_var, value in spec.fixed_inputs.items():
+        cts.append(x[input_var] == value)
+        ct_names.append(f"fixed_{input_var}")
 
     # HW Selection Constraint, enabling the selection of a single hw platform
-    mdl.add_constraint(mdl.sum(mdl.get_var_by_name(f"b_{hw}") for hw in hws) == 1, ctname = "hw_selection")
+    if select_hw:
+        cts.append(mdl.sum_vars(b.values()) == 1)
+        ct_names.append("hw_selection")
 
     # Category Selection Constraints, enabling the selection of a single category for each categorical variable
-    for var in str_vars:
-        mdl.add_constraint(mdl.sum(mdl.get_var_by_name(category) for category in str_vars[var]) == 1, ctname = f"{var}_category_selection")
+    for var in spec.str_vars:
+        cts.append(mdl.sum_vars(x[category] for category in spec.str_vars[var]) == 1)
+        ct_names.append(f"{var}_category_selection")
 
-    # Empirical Constraints: embed the predictive models into the system (through emllib)
-    for target in targets:
+    # Handling non-estimated target (price): equality constraints, fixing each price variable hw_price to
+    # the usage price of the corresponding hw, as required by the hw provider
+    if 'price' in spec.targets:
+        for hw in hws: 
+            cts.append(y[(hw, 'price')] == spec.prices[hw])
+            ct_names.append(f"{hw}_price")
+    mdl.add_constraints_(cts, ct_names)
+
+    # Empirical Constraints: embed the predictive models into the system
+    embed_start = time.perf_counter()
+    for target in spec.targets:
         # target price is not predicted, but indicated by the hw provider: it does not require any
         # dedicated predictive model
         if target == "price": 
@@ -131,82 +279,311 @@ def HADA(db : ConfigDB,
         # time and memory depend on both the hw and the algorithm configuration: each of them requires three 
         # dedicated predictive models
         for hw in hws:
-            model = models.get_model(request.algorithm, hw, target, request.input_dependent)
-            if model.tree_.node_count <= 1:
-                continue
-            model = read_sklearn_tree(model)
-            #for i, hyperparam in enumerate(hyperparams):
-            #for i, var in enumerate(inputs_and_hyperparams):
-            for idx in model.attributes_ub.keys():
-                var = inputs_and_hyperparams[idx]
-                model.update_lb(idx, var_bounds[var]['lb'])
-                model.update_ub(idx, var_bounds[var]['ub'])
-
-            embed.encode_backward_implications(
-                    bkd = bkd, mdl = mdl,
-                    tree = model, 
-                    tree_in = [mdl.get_var_by_name(ml_var[var]) for var in inputs_and_hyperparams],
-                    tree_out = mdl.get_var_by_name(ml_var[f"{hw}_{target}"]),
-                    name = f"DT_{hw}_{target}")
-
-    
-    # Handling non-estimated target (price) and robustness coefficients: 
-    # 1.Equality constraints, fixing each price variable hw_price to the usage price of the corresponding hw,
-    # as required by the hw provider
-    if 'price' in targets:
-        for hw in hws: 
-            mdl.add_constraint(mdl.get_var_by_name(f"{hw}_price") == request.hws_prices.get_prices_per_hw()[hw], ctname = f"{hw}_price")
- 
-    # 2. If no robustness is required, fix all coefficients to 0 
-    if robust_coeff is None:
-        robust_coeff = {(hw, target) : 0
-                        for hw in hws
-                        for target in request.user_constraints.get_constraints()}
-    
+            rules = trees[(hw, target)]
+            # bounds of the features (narrowed by the fixed inputs) are used as big-M terms in the embedding
+            embed_tree(mdl, rules, tree_in, y[(hw, target)], spec.ml_lb, spec.ml_ub, name = f"DT_{hw}_{target}")
+    embed_time = time.perf_counter() - embed_start
+
     # User-defined constraints, bounding the performance of the algorithm, as required by the user
-    for target in request.user_constraints.get_constraints():
+    # (tightened by the robustness coefficients); with hw selection, they hold only for the selected hw
+    user_cts, user_ct_names, triggers = [], [], []
+    for target, (constr_type, value) in spec.constraints.items():
         for hw in hws:
-            if request.user_constraints.get_constraints()[target][0] == "leq":
-                mdl.add_indicator(mdl.get_var_by_name(f"b_{hw}"), 
-                        mdl.get_var_by_name(f"{hw}_{target}") <= request.user_constraints.get_constraints()[target][1] - robust_coeff[(hw,target)], 1, name = f"user_constraint_{target}_{hw}")
-            elif request.user_constraints.get_constraints()[target][0] == "geq":
-                mdl.add_indicator(mdl.get_var_by_name(f"b_{hw}"), 
-                        mdl.get_var_by_name(f"{hw}_{target}") >= request.user_constraints.get_constraints()[target][1] + robust_coeff[(hw,target)], 1, name = f"user_constraint_{target}_{hw}")
-            elif request.user_constraints.get_constraints()[target][0] == "eq":
-                mdl.add_indicator(mdl.get_var_by_name(f"b_{hw}"), 
-                        mdl.get_var_by_name(f"{hw}_{target}") >= request.user_constraints.get_constraints()[target][1] - robust_coeff[(hw, target)], 1, name = f"user_constraint_{target}_{hw}_1")
-                mdl.add_indicator(mdl.get_var_by_name(f"b_{hw}"), 
-                        mdl.get_var_by_name(f"{hw}_{target}") <= request.user_constraints.get_constraints()[target][1] + robust_coeff[(hw, target)], 1, name = f"user_constraint_{target}_{hw}_2")
+            target_var = y[(hw, target)]
+            coeff = spec.robust_coeff[(hw, target)]
+            if constr_type == "leq":
+                user_cts.append(target_var <= value - coeff)
+                user_ct_names.append(f"user_constraint_{target}_{hw}")
+            elif constr_type == "geq":
+                user_cts.append(target_var >= value + coeff)
+                user_ct_names.append(f"user_constraint_{target}_{hw}")
+            elif constr_type == "eq":
+                user_cts += [target_var >= value - coeff, target_var <= value + coeff]
+                user_ct_names += [f"user_constraint_{target}_{hw}_1", f"user_constraint_{target}_{hw}_2"]
+            if select_hw:
+                triggers += [b[hw]] * (2 if constr_type == "eq" else 1)
+    if select_hw:
+        mdl.add_indicators(triggers, user_cts, 1, names = user_ct_names)
+    else:
+        mdl.add_constraints_(user_cts, user_ct_names)
 
     ##### OBJECTIVE #####
-    if request.opt_type == "min":
-        mdl.minimize(mdl.sum(mdl.get_var_by_name(f"{hw}_{request.target}") * mdl.get_var_by_name(f"b_{hw}") for hw in hws))
+    if select_hw:
+        objective = mdl.sum(y[(hw, spec.target)] * b[hw] for hw in hws)
+    else:
+        objective = y[(hws[0], spec.target)]
+    if spec.opt_type == "min":
+        mdl.minimize(objective)
     else: 
-        mdl.maximize(mdl.sum(mdl.get_var_by_name(f"{hw}_{request.target}") * mdl.get_var_by_name(f"b_{hw}") for hw in hws))
+        mdl.maximize(objective)
+
+    return mdl, embed_time
+
+
+def embed_tree(mdl, rules, tree_in, tree_out, lb, ub, name):
+    """
+    Embeds a trained regression tree into a model, encoding it with backward implications: a binary
+    variable for each leaf (only one of them active), the output equal to the value of the active leaf, and
+    for each finite bound of each leaf's box (see tree_rules.extract_leaf_boxes) a big-M constraint
+    enforcing it on the feature when the leaf is active. Built in bulk, from the compiled rules of the tree.
+    Leaves that cannot be reached within the bounds of the features, and conditions that always hold within
+    them, are left out; if a single leaf is left, the output is fixed to its value.
+
+    Args:
+        mdl (docplex.mp.model.Model): the model.
+        rules (TreeRules): compiled rules of the tree.
+        tree_in (list): variable (or expression) of each feature.
+        tree_out (docplex.mp.dvar.Var): output variable.
+        lb (np.ndarray), ub (np.ndarray): bounds of the features, used as big-M terms.
+        name (str): prefix of the names of the leaf variables.
+    """
+    leaves = np.nonzero(reachable_leaves(rules.leaf_lb, rules.leaf_ub, lb, ub))[0]
+    if len(leaves) == 1:
+        mdl.add_constraint_(tree_out == rules.values[leaves[0]].item())
+        return
+    paths = mdl.binary_var_list(len(leaves), name = f"{name}_p")
+    mdl.add_constraint_(mdl.sum_vars(paths) == 1)
+    mdl.add_constraint_(tree_out == mdl.scal_prod(paths, rules.values[leaves].tolist()))
+    # position of each reachable leaf among the embedded ones
+    position = np.full(rules.n_leaves, -1)
+    position[leaves] = np.arange(len(leaves))
+
+    # x >= th * z + lb * (1 - z), i.e. x - (th - lb) * z >= lb (and the same for the upper bounds);
+    # when th <= lb (th >= ub for the upper bounds) the condition always holds
+    cts = []
+    for (bound_leaves, features), leaf_bounds, bounds, constraint, sign in [(rules.lb_bounds, rules.leaf_lb, lb, mdl.ge_constraint, 1),
+                                                                            (rules.ub_bounds, rules.leaf_ub, ub, mdl.le_constraint, -1)]:
+        coeffs = leaf_bounds[bound_leaves, features] - bounds[features]
+        keep = (position[bound_leaves] >= 0) & (sign * coeffs > 0)
+        for path, feature, coeff, bound in zip(position[bound_leaves[keep]].tolist(), features[keep].tolist(),
+                                               coeffs[keep].tolist(), bounds[features[keep]].tolist()):
+            cts.append(constraint(mdl.linear_expr({tree_in[feature]: 1, paths[path]: -coeff}), bound))
+    mdl.add_constraints_(cts)
+
 
-         
-    ##### SOLVE #####
+def solve_model(spec, mdl, hws, cutoff=None, settings=None):
+    """
+    Solves a model built by build_model.
+
+    Args:
+        spec (ModelSpec): the request's model specification.
+        mdl (docplex.mp.model.Model): the model.
+        hws (list[str]): hws included in the model.
+        cutoff (float): if given, only solutions strictly better than cutoff are searched for.
+        settings (dict): solver settings to use instead of the request's ones (see SolverSettings.get_settings).
+
+    Returns:
+        dict: the chosen hw (None if no solution is found), the values of its targets and of the
+        hyperparameters, the objective value, the solver's status and the solve statistics (see HADA).
+    """
+    SolverSettings.apply_settings(mdl, spec.solver_settings if settings is None else settings)
+    set_cutoff(mdl, spec.opt_type, cutoff)
     sol = mdl.solve()
-    
-    solution = None
+
+    # when the solver stops on a limit (e.g. time limit), the best incumbent is returned, but it is not proven optimal
+    details = mdl.solve_details
+    result = {'chosen_hw': None,
+              'objective': None,
+              'proven_optimal': details.status_code in PROVEN_OPTIMAL_STATUSES,
+              'proven_infeasible': details.status_code in PROVEN_INFEASIBLE_STATUSES,
+              'status': details.status,
+              'stats': get_solve_stats(mdl, sol)}
     if sol:
-        for hw in hws:
-            if round(sol[f'b_{hw}']) == 1:
-                chosen_hw = hw
-                break
-        targets_values = {target: round(sol[f"{chosen_hw}_{target}"]) if var_type[target] != mdl.continuous_vartype else sol[f"{chosen_hw}_{target}"] for target in targets}
-        hyperparams_values = {hyperparam: round(sol[hyperparam]) if var_type[hyperparam] != mdl.continuous_vartype else sol[hyperparam] for hyperparam in hyperparams}
-        
-        # Decode one-hot hyperparameters
-        for var in set(str_vars.keys()).intersection(db.get_hyperparams(request.algorithm, request.input_dependent)):
-            chosen_category = {var : category.split(var + '_')[1] for category in str_vars[var] if hyperparams_values[category] == 1}
-            hyperparams_values = dict({hyperparam : value for hyperparam, value in hyperparams_values.items() if hyperparam not in str_vars[var]},
-            **chosen_category)
-
-        # return the country selected in the request (can be None)
-        country = request.country
-
-        #solution = {'chosen_hw': chosen_hw, 'hyperparams': hyperparams_values, 'targets': targets_values}
-        solution = OptimizationSolution(chosen_hw, hyperparams_values, targets_values, country)
-
-    return solution
+        if len(hws) > 1:
+            chosen_hw = next(hw for hw in hws if round(sol[f'b_{hw}']) == 1)
+        else:
+            chosen_hw = hws[0]
+        result['chosen_hw'] = chosen_hw
+        result['objective'] = sol.objective_value
+        result['targets'] = {target: sol[f"{chosen_hw}_{target}"] for target in spec.targets}
+        result['hyperparams'] = {hyperparam: sol[hyperparam] for hyperparam in spec.hyperparams}
+    return result
+
+
+def set_cutoff(mdl, opt_type, cutoff):
+    """Only solutions strictly better than cutoff (if not None) are searched for."""
+    if cutoff is None:
+        return
+    if opt_type == "min":
+        mdl.parameters.mip.tolerances.uppercutoff = cutoff
+    else:
+        mdl.parameters.mip.tolerances.lowercutoff = cutoff
+
+
+def get_solve_stats(mdl, sol):
+    """Statistics of the last solve of a model (sol is the solution found, None if none): status, wall time, nodes, objective, best bound, gap and model size."""
+    details = mdl.solve_details
+    return {'status': details.status,
+            'proven_optimal': details.status_code in PROVEN_OPTIMAL_STATUSES,
+            'time': details.time,
+            'nodes': details.nb_nodes_processed,
+            'objective': sol.objective_value if sol else None,
+            'best_bound': details.best_bound if sol else None,
+            'gap': details.mip_relative_gap if sol else None,
+            'variables': mdl.number_of_variables,
+            'binary_variables': mdl.number_of_binary_variables,
+            'constraints': mdl.number_of_constraints}
+
+
+def decode_solution(spec, result, solve_stats=None):
+    """Converts the result of solve_model into an OptimizationSolution (rounding integers, decoding one-hot hyperparameters)."""
+    targets_values = {target: round(value) if spec.var_type[target] != 'float' else value
+                      for target, value in result['targets'].items()}
+    hyperparams_values = {hyperparam: round(value) if spec.var_type[hyperparam] != 'float' else value
+                          for hyperparam, value in result['hyperparams'].items()}
+
+    # Decode one-hot hyperparameters
+    for var in spec.str_hyperparams:
+        chosen_category = {var : category.split(var + '_')[1] for category in spec.str_vars[var] if hyperparams_values[category] == 1}
+        hyperparams_values = dict({hyperparam : value for hyperparam, value in hyperparams_values.items() if hyperparam not in spec.str_vars[var]},
+        **chosen_category)
+
+    # return the country selected in the request (can be None)
+    return OptimizationSolution(result['chosen_hw'], hyperparams_values, targets_values, spec.country,
+                                algorithm=spec.algorithm, input_dependent=spec.input_dependent,
+                                proven_optimal=result['proven_optimal'], solve_stats=solve_stats)
+
+
+def _solve_subproblem(spec, hw, trees, cutoff, settings):
+    """Builds and solves the subproblem of a hw (run by the processes of the pool) with the given solver settings, timing each phase."""
+    try:
+        build_start = time.perf_counter()
+        mdl, embed_time = build_model(spec, [hw], trees)
+        build_time = time.perf_counter() - build_start - embed_time
+        result = solve_model(spec, mdl, [hw], cutoff, settings)
+        result['exported'] = spec.export is not None and export_model(spec.export, mdl, spec, [hw], result, cutoff,
+                                                                      build_time, embed_time, subproblem=True)
+    except Exception as e:
+        # solver exceptions cannot always be unpickled: only their message is sent back to the service
+        raise RuntimeError(str(e)) from None
+    result['hw'] = hw
+    result['build_time'], result['embed_time'] = build_time, embed_time
+    return result
+
+
+def _get_pool(workers):
+    """Process pool with the given number of workers, created at the first use and shared by the requests."""
+    with _pools_lock:
+        if workers not in _pools:
+            # processes are spawned: forking a process running solver threads is not safe
+            _pools[workers] = ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn'))
+        return _pools[workers]
+
+
+def solve_decomposed(spec, hws, trees):
+    """
+    Solves a request by building and solving a subproblem for each hw (with no hw selection), up to
+    `workers` at a time in a process pool, and keeping the best solution.
+    Hws are solved in order of objective bound (the best value their predictive model can output, or their
+    price): a hw whose bound cannot beat the best solution found so far is skipped, and the others are solved
+    with the best objective as cutoff, so that the solver stops as soon as they are proven not to improve it.
+    The time limit (if any) bounds the whole solve: each subproblem gets the time left, and the hws not started
+    by then are left unsolved.
+
+    Args:
+        spec (ModelSpec): the request's model specification (after the presolve).
+        hws (list[str]): hws left by the presolve.
+        trees (dict): compiled rules (TreeRules) of the trained tree for each (hw, target).
+
+    Returns:
+        result (dict): the best result (see solve_model); if no solution is found, its chosen hw is None and
+        it is proven infeasible if every subproblem is.
+        solve_stats (dict): statistics aggregated over the subproblems.
+    """
+    labels = {'algorithm': spec.algorithm, 'input_case': input_case(spec.input_dependent)}
+    minimize = spec.opt_type == "min"
+    workers = min(spec.solver_settings.get('workers', os.cpu_count() or 1), len(hws))
+    # unless set in the request, the solver threads are shared by the subproblems solved at the same time
+    settings = dict(spec.solver_settings)
+    settings.setdefault('threads', max(1, (os.cpu_count() or 1) // workers))
+
+    bounds = {hw: spec.get_target_bounds(hw, spec.target)[0 if minimize else 1] for hw in hws}
+    queue = sorted(hws, key = lambda hw: bounds[hw], reverse = not minimize)
+
+    def improves(value, best):
+        return best is None or (value < best if minimize else value > best)
+
+    best, results, skipped, unsolved = None, [], [], []
+    start = time.perf_counter()
+    deadline = start + settings['time_limit'] if 'time_limit' in settings else None
+    with metrics.span('solve', **labels):
+        pool = _get_pool(workers) if workers > 1 else None
+        pending = set()
+        while queue or pending:
+            while queue and len(pending) < workers:
+                hw = queue.pop(0)
+                cutoff = best['objective'] if best is not None else None
+                if not improves(bounds[hw], cutoff):
+                    skipped.append(hw)
+                    continue
+                if deadline is not None:
+                    # the first subproblem is always solved, as a monolithic model would be, even with no time left
+                    time_left = deadline - time.perf_counter()
+                    if time_left <= 0 and (results or pending):
+                        unsolved.append(hw)
+                        continue
+                    settings['time_limit'] = max(0, time_left)
+                hw_trees = {(hw_, target): tree for (hw_, target), tree in trees.items() if hw_ == hw}
+                if pool is None:
+                    results.append(_solve_subproblem(spec, hw, hw_trees, cutoff, dict(settings)))
+                    if results[-1]['chosen_hw'] is not None and improves(results[-1]['objective'], cutoff):
+                        best = results[-1]
+                else:
+                    pending.add(pool.submit(_solve_subproblem, spec, hw, hw_trees, cutoff, dict(settings)))
+            if not pending:
+                continue
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results.append(result)
+                if result['chosen_hw'] is not None and improves(result['objective'], best['objective'] if best else None):
+                    best = result
+    wall_time = time.perf_counter() - start
+
+    for result in results:
+        metrics.observe_phase('build', result['build_time'], **labels)
+        metrics.observe_phase('embed', result['embed_time'], **labels)
+        if result['exported']:
+            metrics.inc('exported_models_total', **labels)
+        for name in ['variables', 'binary_variables', 'constraints']:
+            metrics.observe(f'milp_{name}', result['stats'][name], **labels)
+
+    # the best solution is proven optimal if every hw was either solved to optimality, proven infeasible
+    # (possibly because of the cutoff) or skipped because of its bound (not left unsolved by the time limit)
+    proven_optimal = not unsolved and all(result['proven_optimal'] or result['proven_infeasible'] for result in results)
+    if best is None:
+        # no hw has a solution (then none was skipped): the status is the one of a subproblem not proven infeasible, if any
+        status = next((result['status'] for result in results if not result['proven_infeasible']), results[0]['status'])
+        if unsolved:
+            status = 'time limit exceeded, no integer solution'
+        best = {'chosen_hw': None, 'objective': None, 'proven_optimal': False, 'proven_infeasible': proven_optimal,
+                'status': status}
+        best_bound, gap = None, None
+    else:
+        # best bound over all hws: the bound of the subproblems not proven optimal (or infeasible) may be better than the solution
+        best_bound = best['objective']
+        for result in results:
+            if result['proven_infeasible'] or result is best and result['proven_optimal']:
+                continue
+            bound = result['stats']['best_bound'] if result['chosen_hw'] is not None else bounds[result['hw']]
+            best_bound = min(best_bound, bound) if minimize else max(best_bound, bound)
+        for hw in unsolved:
+            best_bound = min(best_bound, bounds[hw]) if minimize else max(best_bound, bounds[hw])
+        gap = abs(best['objective'] - best_bound) / (1e-10 + abs(best['objective']))
+        # hws left unsolved: the time limit was reached before the solution could be proven optimal
+        best = dict(best, proven_optimal = proven_optimal, status = 'time limit exceeded' if unsolved else best['status'])
+
+    solve_stats = {'status': best['status'],
+                   'proven_optimal': best['proven_optimal'],
+                   'time': wall_time,
+                   'nodes': sum(result['stats']['nodes'] for result in results),
+                   'objective': best['objective'],
+                   'best_bound': best_bound,
+                   'gap': gap,
+                   'variables': sum(result['stats']['variables'] for result in results),
+                   'binary_variables': sum(result['stats']['binary_variables'] for result in results),
+                   'constraints': sum(result['stats']['constraints'] for result in results),
+                   'subproblems': len(results),
+                   'unsolved_hws': len(unsolved),
+                   'cutoff_hws': len(skipped) + sum(result['chosen_hw'] is None and result['proven_infeasible'] for result in results)}
+    return best, solve_stats
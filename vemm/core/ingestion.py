@@ -0,0 +1,54 @@
+from vemm.core.metrics import metrics, input_case
+
+
+def ingest_rows(datasets, models, algorithm, hw, rows, input_dependent=False, retrain=True, wait=False):
+    """
+    Adds new rows (e.g. new measurements) to the dataset of an (algorithm, hw), updating only what depends on it:
+    the bounds of its variables, the error statistics of its models (with the current models) and its models,
+    retrained in background (see MLModels.retrain). Rows are validated first (see Datasets.validate_rows).
+
+    Categories of str variables not seen before extend the mapping of the algorithm (see
+    StrExpander.extend_categories): the features of all its models change, so the models of every hardware
+    platform are retrained (the current ones are used with the features they were trained on meanwhile).
+
+    Args:
+        datasets (Datasets): instance of Datasets.
+        models (MLModels): instance of MLModels.
+        algorithm (str): algorithm id.
+        hw (str): hardware platform id.
+        rows (list[dict] or pd.DataFrame): new rows, with a value for each column of the dataset.
+        input_dependent (bool): input case (True for input-dependent, False for input_independent).
+        retrain (bool): whether to retrain the models of the (algorithm, hw), or of the algorithm with new categories.
+        wait (bool): whether to wait for the retraining to end.
+
+    Raises:
+        AttributeError: if the datasets cannot be extended (e.g. remote ones) or the rows are not valid.
+
+    Returns:
+        dict: number of rows added, variables whose bounds changed, new categories (per str variable) and whether
+        the models are being retrained.
+    """
+    if not datasets.appendable:
+        raise AttributeError('Adding rows is supported only for local datasets.')
+    if algorithm not in datasets.db.get_algorithms(input_dependent):
+        raise AttributeError(f'Algorithm {algorithm} not available.')
+
+    rows = datasets.validate_rows(algorithm, hw, rows, input_dependent)
+    new_categories = datasets.expander.get_new_categories(rows, algorithm, input_dependent)
+    if new_categories:
+        # before adding the rows, for them to be expanded with the new categories
+        datasets.add_categories(algorithm, new_categories, input_dependent)
+        print(f'New categories for {algorithm}: {new_categories}; its models will be retrained.')
+    datasets.append_rows(algorithm, hw, rows, input_dependent)
+    bounds_changed = datasets.update_bounds_index(algorithm, hw, rows, input_dependent)
+    datasets.extend_error_stats(models, algorithm, hw, rows, input_dependent)
+    metrics.inc('ingested_rows_total', len(rows), algorithm=algorithm, input_case=input_case(input_dependent), hw=hw)
+
+    if retrain:
+        for retrained_hw in (datasets.db.get_hws(algorithm, input_dependent) if new_categories else [hw]):
+            models.retrain(algorithm, retrained_hw, input_dependent, wait=wait)
+
+    return {'rows': len(rows),
+            'bounds_changed': bounds_changed,
+            'new_categories': new_categories,
+            'retraining': retrain and not wait}
@@ -0,0 +1,308 @@
+import os
+import time
+import glob
+import pickle
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+# buckets (seconds) for the per-phase latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# buckets for the MILP size histograms (number of variables/constraints)
+SIZE_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+
+def input_case(input_dependent):
+    """Returns the label used for an input case (same keys used by ConfigDB)."""
+    return 'input-dependent' if input_dependent else 'input-independent'
+
+
+def process_memory(pid='self'):
+    """
+    Resident memory of a process (Linux only), from /proc/<pid>/smaps_rollup (or smaps, on older kernels).
+
+    Args:
+        pid (int or str): process id ('self' for the current process).
+
+    Returns:
+        dict: resident (rss), proportional (pss: shared pages are divided among the processes sharing them) and
+        unique (uss: pages not shared with any other process, freed if the process ends) memory, in bytes.
+    """
+    path = f'/proc/{pid}/smaps_rollup'
+    if not os.path.exists(path):
+        path = f'/proc/{pid}/smaps'
+    fields = defaultdict(int)
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] += int(parts[1]) * 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'], 'uss': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+class Metrics():
+    """
+    Collects histograms, counters and gauges about the service and exports them in the Prometheus text format.
+    Thread-safe; a single instance (core.metrics.metrics) is shared by the whole service.
+
+    Processes serving the same service (e.g. the workers of vemm.serve) can share their metrics through a folder (see
+    share), so that each of them exports the totals of the node.
+    """
+    def __init__(self, namespace='vemm'):
+        self.namespace = namespace
+        # name: (type, help, buckets)
+        self.descriptions = {}
+        # name: callable returning a value, evaluated at export time
+        self.gauge_callbacks = {}
+        # names of the gauges whose callback already returns the value of the whole node (not summed across processes)
+        self.node_gauges = set()
+        # folder where the metrics of each process are written, see share()
+        self.shared_path = None
+        self.reset()
+
+        self.describe('phase_duration_seconds', 'histogram', 'Time spent in each phase of an optimization request.', LATENCY_BUCKETS)
+        self.describe('milp_variables', 'histogram', 'Number of variables of each solved MILP.', SIZE_BUCKETS)
+        self.describe('milp_binary_variables', 'histogram', 'Number of binary variables of each solved MILP.', SIZE_BUCKETS)
+        self.describe('milp_constraints', 'histogram', 'Number of constraints of each solved MILP.', SIZE_BUCKETS)
+        self.describe('cache_requests_total', 'counter', 'Cache lookups, by cache and result (hit/miss).')
+        self.describe('cache_hit_ratio', 'gauge', 'Ratio of cache lookups resulting in a hit, by cache.')
+        self.describe('models_training', 'gauge', 'Models currently being trained.')
+        self.describe('stale_models_total', 'counter', 'Models found stale (e.g. trained on a different dataset) and retrained.')
+        self.describe('ingested_rows_total', 'counter', 'Rows added to the datasets, by algorithm, input case and hardware platform.')
+        self.describe('coalesced_calls_total', 'counter', 'Calls that waited for an identical ongoing one and shared its result (optimization requests, model training).')
+        self.describe('admitted_requests_total', 'counter', 'Optimization requests admitted to be solved, by lane (fast/regular).')
+        self.describe('rejected_requests_total', 'counter', 'Optimization requests rejected by the admission control, by lane and reason (queue_full/timeout).')
+        self.describe('solver_threads_in_use', 'gauge', 'Solver threads assigned to the requests being solved.')
+        self.describe('exported_models_total', 'counter', 'HADA models written to the export corpus (see MODEL_EXPORT_PATH), by algorithm and input case.')
+        self.describe('pruned_hws_total', 'counter', 'Hardware platforms dropped by the presolve, as they cannot satisfy the user constraints.')
+
+    def reset(self):
+        """
+        Drops the recorded values (not the descriptions and gauge callbacks), e.g. in a forked process, not to count
+        again the ones of its parent.
+        """
+        # a new lock, as the parent's one may have been held by another thread when forking
+        self.lock = threading.Lock()
+        # name: {labels: [bucket counts, sum, count]}
+        self.histograms = defaultdict(dict)
+        # name: {labels: value}
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.gauges = defaultdict(dict)
+        # lists collecting raw observations, see recording()
+        self.recorders = []
+
+    def describe(self, name, metric_type, help, buckets=None):
+        """Declares a metric, with its type ('histogram', 'counter' or 'gauge') and description."""
+        self.descriptions[name] = (metric_type, help, buckets)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        """Records a value in a histogram."""
+        buckets = self.descriptions[name][2]
+        key = self._key(labels)
+        with self.lock:
+            if key not in self.histograms[name]:
+                self.histograms[name][key] = [[0] * len(buckets), 0.0, 0]
+            hist = self.histograms[name][key]
+            # counts are stored per bucket, cumulated at export time
+            idx = bisect_left(buckets, value)
+            if idx < len(buckets):
+                hist[0][idx] += 1
+            hist[1] += value
+            hist[2] += 1
+            for recorder in self.recorders:
+                recorder.append((name, labels, value))
+
+    def inc(self, name, value=1, **labels):
+        """Increments a counter."""
+        with self.lock:
+            self.counters[name][self._key(labels)] += value
+
+    def set_gauge(self, name, value, **labels):
+        """Sets the current value of a gauge."""
+        with self.lock:
+            self.gauges[name][self._key(labels)] = value
+
+    def register_gauge(self, name, callback, node=False):
+        """
+        Registers a gauge whose value is computed by callback() each time metrics are exported.
+
+        Args:
+            name (str): name of the gauge.
+            callback (callable): returns the current value.
+            node (bool): whether the value is the one of the whole node (e.g. read from state shared by the processes),
+                rather than of the process: it is then not summed across the processes sharing their metrics.
+        """
+        with self.lock:
+            self.gauge_callbacks[name] = callback
+            if node:
+                self.node_gauges.add(name)
+            else:
+                self.node_gauges.discard(name)
+
+    @contextmanager
+    def recording(self):
+        """Collects the raw (name, labels, value) histogram observations made within the block (e.g. for benchmarks)."""
+        samples = []
+        with self.lock:
+            self.recorders.append(samples)
+        try:
+            yield samples
+        finally:
+            with self.lock:
+                self.recorders.remove(samples)
+
+    @contextmanager
+    def span(self, phase, algorithm=None, input_case=None):
+        """Times the enclosed block, recording it as a phase of an optimization request."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start, algorithm, input_case)
+
+    def observe_phase(self, phase, seconds, algorithm=None, input_case=None):
+        """Records the duration of a phase of an optimization request."""
+        self.observe('phase_duration_seconds', seconds, phase=phase, algorithm=algorithm, input_case=input_case)
+
+    def observe_milp_size(self, mdl, algorithm=None, input_case=None):
+        """Records the size of a (docplex) MILP model."""
+        labels = {'algorithm': algorithm, 'input_case': input_case}
+        self.observe('milp_variables', mdl.number_of_variables, **labels)
+        self.observe('milp_binary_variables', mdl.number_of_binary_variables, **labels)
+        self.observe('milp_constraints', mdl.number_of_constraints, **labels)
+
+    def cache_lookup(self, cache, hit):
+        """Records a lookup in one of the caches (hit or miss)."""
+        self.inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def share(self, path, interval=1.0):
+        """
+        Shares the metrics of this process with the others using the same folder: a snapshot of its values is written
+        there every interval seconds (by a daemon thread), and exports add up the latest snapshots of all the processes.
+        Called in each process after forking (see vemm.serve); snapshots of processes which ended are kept, so that
+        counters do not decrease, but not their gauges.
+
+        Args:
+            path (str): folder shared by the processes (e.g. created by the parent, and removed when all have ended).
+            interval (float): seconds between snapshots.
+        """
+        self.shared_path = path
+        def flush_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+        threading.Thread(target=flush_periodically, daemon=True).start()
+
+    def _snapshot(self, local_gauges=True):
+        with self.lock:
+            gauge_callbacks = {name: callback for name, callback in self.gauge_callbacks.items()
+                               if local_gauges or name not in self.node_gauges}
+        callback_values = {name: callback() for name, callback in gauge_callbacks.items()}
+        with self.lock:
+            gauges = {name: dict(values) for name, values in self.gauges.items()}
+            for name, value in callback_values.items():
+                gauges[name] = {(): value}
+            return {'histograms': {name: {key: [list(counts), total, count] for key, (counts, total, count) in values.items()}
+                                   for name, values in self.histograms.items()},
+                    'counters': {name: dict(values) for name, values in self.counters.items()},
+                    'gauges': gauges}
+
+    def flush(self):
+        """Writes the snapshot of the metrics of this process in the shared folder (see share)."""
+        snapshot = self._snapshot(local_gauges=False)
+        fd, tmp_path = tempfile.mkstemp(dir=self.shared_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(snapshot, f)
+        os.replace(tmp_path, os.path.join(self.shared_path, f'{os.getpid()}.pkl'))
+
+    def _shared_snapshots(self):
+        """Latest snapshots of the other processes sharing the metrics, with the gauges of the running ones only."""
+        snapshots = []
+        for path in glob.glob(os.path.join(self.shared_path, '*.pkl')):
+            pid = os.path.basename(path)[:-len('.pkl')]
+            if pid == str(os.getpid()):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    snapshot = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            if not os.path.exists(f'/proc/{pid}'):
+                snapshot['gauges'] = {}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def _cache_hit_ratios(self, counters):
+        lookups = defaultdict(lambda: {'hit': 0, 'miss': 0})
+        for key, value in counters.get('cache_requests_total', {}).items():
+            labels = dict(key)
+            lookups[labels['cache']][labels['result']] += value
+        return {(('cache', cache),): counts['hit'] / (counts['hit'] + counts['miss'])
+                for cache, counts in lookups.items() if counts['hit'] + counts['miss'] > 0}
+
+    @staticmethod
+    def _format_labels(key, extra=()):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels = [(label, value) for label, value in key if value is not None] + list(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{label}="{escape(value)}"' for label, value in labels) + '}'
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        # callbacks may block (e.g. on a Manager process), they are evaluated without holding the lock
+        snapshot = self._snapshot()
+        histograms, counters, gauges = snapshot['histograms'], snapshot['counters'], snapshot['gauges']
+        if self.shared_path is not None:
+            for shared in self._shared_snapshots():
+                for name, values in shared['histograms'].items():
+                    for key, (counts, total, count) in values.items():
+                        hist = histograms.setdefault(name, {}).setdefault(key, [[0] * len(counts), 0.0, 0])
+                        hist[0] = [a + b for a, b in zip(hist[0], counts)]
+                        hist[1] += total
+                        hist[2] += count
+                for kind, merged in [('counters', counters), ('gauges', gauges)]:
+                    for name, values in shared[kind].items():
+                        if kind == 'gauges' and name in self.node_gauges:
+                            continue
+                        merged_values = merged.setdefault(name, {})
+                        for key, value in values.items():
+                            merged_values[key] = merged_values.get(key, 0) + value
+        gauges['cache_hit_ratio'] = self._cache_hit_ratios(counters)
+
+        for name, (metric_type, help, buckets) in self.descriptions.items():
+            full_name = f'{self.namespace}_{name}'
+            lines.append(f'# HELP {full_name} {help}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            if metric_type == 'histogram':
+                for key, (counts, total, count) in histograms.get(name, {}).items():
+                    cumulated = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulated += bucket_count
+                        lines.append(f'{full_name}_bucket{self._format_labels(key, [("le", bound)])} {cumulated}')
+                    lines.append(f'{full_name}_bucket{self._format_labels(key, [("le", "+Inf")])} {count}')
+                    lines.append(f'{full_name}_sum{self._format_labels(key)} {total}')
+                    lines.append(f'{full_name}_count{self._format_labels(key)} {count}')
+            elif metric_type == 'counter':
+                for key, value in counters.get(name, {}).items():
+                    lines.append(f'{full_name}{self._format_labels(key)} {value}')
+            else:
+                for key, value in gauges.get(name, {}).items():
+                    lines.append(f'{full_name}{self._format_labels(key)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# instance shared by the whole service
+metrics = Metrics()
@@ -1,14 +1,73 @@
 import os
+import json
 import pickle
 import time
+import platform
+import threading
+import traceback
+import hashlib
+import numpy as np
+from collections import defaultdict
 from multiprocessing import Process, Manager
-from sklearn.tree import DecisionTreeRegressor
+# scikit-learn is imported on first use (training, or loading a model), not to delay the start of the service
+from vemm.core.metrics import metrics, input_case
+from vemm.core.tree_rules import TreeRules, RULES_SUFFIX
+from vemm.core.array_store import ArrayStore
+from vemm.core.datasets import dataset_fingerprint
+from vemm.core.single_flight import SingleFlight
+
+# minimum number of samples for selecting the depth on held-out data (auto mode); smaller datasets use max_depth
+MIN_AUTO_SAMPLES = 10
+
+
+class TrainingSettings():
+    """Settings for training the predictive models of an algorithm (global defaults can be overridden in the configs). Arguments are checked."""
+    # settings used when not specified (models trained with these settings keep the original artifact names)
+    DEFAULTS = {'max_depth': 10, 'max_leaf_nodes': None, 'min_samples_leaf': 1, 'auto': False, 'tolerance': 0.05, 'validation_split': 0.2}
+    # setting : (accepted types, description)
+    SETTINGS = {'max_depth': ((int, type(None)), 'Maximum depth'),
+                'max_leaf_nodes': ((int, type(None)), 'Maximum number of leaves'),
+                'min_samples_leaf': ((int,), 'Minimum number of samples per leaf'),
+                'auto': ((bool,), 'Whether to select the smallest depth meeting the tolerance'),
+                'tolerance': ((int, float), 'Tolerance on the held-out error (relative to the best depth)'),
+                'validation_split': ((float,), 'Fraction of held-out samples')}
+
+    @classmethod
+    def check_setting(cls, setting, value):
+        if setting not in cls.SETTINGS:
+            raise AttributeError(f"Training setting {setting} not available; it must be one of {', '.join(cls.SETTINGS)}.")
+
+        accepted_types, description = cls.SETTINGS[setting]
+        # bool is a subclass of int, it must not be accepted for numerical settings
+        if type(value) not in accepted_types:
+            raise AttributeError(f"{description} must be of type {' or '.join(t.__name__ for t in accepted_types if t is not type(None))}{' or None' if type(None) in accepted_types else ''}.")
+
+        if setting in ['max_depth', 'min_samples_leaf'] and value is not None and value < 1:
+            raise AttributeError(f"{description} must be at least 1.")
+        if setting == 'max_leaf_nodes' and value is not None and value < 2:
+            raise AttributeError(f"{description} must be at least 2.")
+        if setting == 'tolerance' and value < 0:
+            raise AttributeError(f"{description} must be non-negative.")
+        if setting == 'validation_split' and not 0 < value < 1:
+            raise AttributeError(f"{description} must be between 0 and 1.")
+
+    @classmethod
+    def get_tag(cls, settings):
+        """Tag identifying the models trained with the given settings (used in the name of their artifacts)."""
+        if settings == cls.DEFAULTS:
+            return str(cls.DEFAULTS['max_depth'])
+        tag = [f"d{settings['max_depth']}", f"l{settings['max_leaf_nodes']}", f"s{settings['min_samples_leaf']}"]
+        if settings['auto']:
+            tag.extend([f"auto{settings['tolerance']}", f"v{settings['validation_split']}"])
+        return '-'.join(tag)
+
 
 class MLModels():
     """
     Class that handles operations that have to be carried out on the ML models.
     """
-    def __init__(self, db, datasets, models_path_no_inp, models_path_inp):
+    def __init__(self, db, datasets, models_path_no_inp, models_path_inp, training_settings=None, compaction_tolerance=0.0,
+                 arrays_path=None):
         """Handles all operations on ML models.
 
         Args:
@@ -16,21 +75,83 @@ class MLModels():
             datasets (Datasets): Datasets instance.
             models_path_no_inp (str): local path containing the models (non input-dependent case).
             models_path_inp (str): local path containing the models (input-dependent case).
+            training_settings (dict): global training settings, overriding TrainingSettings.DEFAULTS
+                (settings in the configs of an algorithm take precedence).
+            compaction_tolerance (float): tolerance for compacting the trees when compiling their rules, relative to
+                the range of their predictions (see tree_rules.extract_leaf_boxes); None for no compaction.
+            arrays_path (str): path of the store where the compiled rules are shared by the processes of the node
+                (see ArrayStore); if None, each process holds its own copy.
         """
         self.db = db
         self.models_path_no_inp = models_path_no_inp
         self.models_path_inp = models_path_inp
         self.datasets = datasets
+        if compaction_tolerance is not None and not 0 <= compaction_tolerance < 1:
+            raise AttributeError('Compaction tolerance must be between 0 and 1 (excluded).')
+        self.compaction_tolerance = compaction_tolerance
+        self.store = ArrayStore(arrays_path) if arrays_path else None
+
+        self.training_settings = dict(TrainingSettings.DEFAULTS)
+        for setting, value in (training_settings or {}).items():
+            TrainingSettings.check_setting(setting, value)
+            self.training_settings[setting] = value
+
+        # (algorithm, hw, input_dependent) being retrained : whether it has to be retrained again (see retrain)
+        self.retraining = {}
+        self._retraining_threads = {}
+        self._retraining_lock = threading.Lock()
+
+        # model path : (modification time, model, info), for the models loaded so far
+        self._loaded = {}
+        # model path : (modification time of the model, current features, compiled rules), see get_rules
+        self._rules = {}
+        # model path : (modification time of the info file, info), see get_model_info
+        self._info = {}
+        # (algorithm, input_dependent) : number of models trained or replaced, see get_generation
+        self._generations = defaultdict(int)
 
-        # tracking state about (algorithm, hw, target) that are currently being trained
-        self.ongoing_training = Manager().dict()
+        # trainings of missing models, shared by the threads needing them (see get_model)
+        self._training_flights = SingleFlight('training')
+        # tracking state about (algorithm, hw, target) that are currently being trained (see ongoing_training)
+        self._ongoing_training = None
+        self._ongoing_training_lock = threading.Lock()
+        # the registry is shared by the processes forked after it is started (see vemm.serve)
+        metrics.register_gauge('models_training', lambda: len(self._ongoing_training) if self._ongoing_training is not None else 0,
+                               node=True)
+
+    @property
+    def ongoing_training(self):
+        # the manager (a process) is started at the first use, not at import time: processes spawned by the
+        # service (e.g. to solve decomposed requests) import it again, and cannot start processes while doing so
+        with self._ongoing_training_lock:
+            if self._ongoing_training is None:
+                self._ongoing_training = Manager().dict()
+            return self._ongoing_training
+
+    def get_training_settings(self, algorithm, input_dependent=False):
+        """Returns the settings used to train the models of an algorithm (global ones, overridden by its configs)."""
+        return dict(self.training_settings, **self.db.get_training_settings(algorithm, input_dependent))
 
     def __get_model_path(self, algorithm, hw, target, input_dependent=False):
         path = self.models_path_inp if input_dependent else self.models_path_no_inp
-        return os.path.join(path, f'{algorithm}_{hw}_{target}_DecisionTree_10')
+        # target names can contain path separators (e.g. "CO2eRate(kg/s)")
+        target = target.replace('/', '-')
+        # models are named after the settings they are trained with, so that changing them triggers a new training
+        tag = TrainingSettings.get_tag(self.get_training_settings(algorithm, input_dependent))
+        return os.path.join(path, f'{algorithm}_{hw}_{target}_DecisionTree_{tag}')
 
-    def get_model(self, algorithm, hw, target, input_dependent=False):
-        """Returns the model (Decision).
+    def __get_integer_features(self, algorithm, input_dependent=False, features=None):
+        """Mask of the integer (or binary, e.g. one-hot encoded) features (default: current ones) of the models of an algorithm."""
+        var_type = self.datasets.expander.get_expanded_var_type(algorithm, input_dependent)
+        if features is None:
+            features = self.datasets.expander.get_expanded_ml_input_vars(algorithm, input_dependent)
+        return np.array([var_type.get(var) in ('int', 'bin') for var in features])
+
+    def get_model_info(self, algorithm, hw, target, input_dependent=False):
+        """Returns the information stored along with a trained model (None if the model is not trained).
+
+        The information is read once per version of the model (e.g. again when retrained, also by another process),
+        and kept in memory; it must not be modified.
 
         Args:
             algorithm (str): algorithm id.
@@ -38,25 +159,47 @@ class MLModels():
             target (str): target id.
             input_dependent (bool): input case (True for input-dependent, False for input_independent).
 
-        Raises:
-            Exception: if model is not found and is already being trained.
-
         Returns:
-            sklearn.tree.DecisionTreeRegressor: DT model.
+            dict: fingerprint of the training dataset, features, training settings and selected parameters,
+            held-out error (auto mode only), depth, number of leaves (before and after the compaction, see get_rules),
+            expected size of its MILP encoding and versions of the libraries used for training.
         """
-        model_path = self.__get_model_path(algorithm, hw, target, input_dependent) 
+        model_path = self.__get_model_path(algorithm, hw, target, input_dependent)
+        try:
+            mtime = os.stat(model_path + '.json').st_mtime_ns
+        except FileNotFoundError:
+            self._info.pop(model_path, None)
+            return None
+        cached = self._info.get(model_path)
+        metrics.cache_lookup('model_info', hit=cached is not None and cached[0] == mtime)
+        if cached is None or cached[0] != mtime:
+            with open(model_path + '.json') as f:
+                cached = self._info[model_path] = (mtime, json.load(f))
+        return cached[1]
 
-        if not os.path.exists(model_path):
-            if (algorithm, hw, target, input_dependent) in self.ongoing_training:
-                raise Exception(f'Model for ({algorithm}, {hw}, {target}) training is ongoing. Come back later.')
-            else:
-                # launching training in background
-                dataset = self.datasets.get_dataset(algorithm, hw, input_dependent)
-                self.ongoing_training[(algorithm, hw, target, input_dependent)] = True
+    def __train(self, algorithm, hw, target, input_dependent=False):
+        """Trains a missing model (see get_model), or waits for another process training it."""
+        key = (algorithm, hw, target, input_dependent)
+        model_path = self.__get_model_path(algorithm, hw, target, input_dependent)
+        labels = {'algorithm': algorithm, 'input_case': input_case(input_dependent)}
+
+        # trained meanwhile
+        if os.path.exists(model_path):
+            return
+        if self.ongoing_training.setdefault(key, os.getpid()) != os.getpid():
+            print(f'Model for ({algorithm}, {hw}, {target}) is being trained by another process; waiting for it.')
+            while key in self.ongoing_training:
+                time.sleep(0.1)
+            if not os.path.exists(model_path):
+                raise Exception(f'Training of the model for ({algorithm}, {hw}, {target}) failed.')
+            return
+
+        try:
+            # launching training in background
+            with metrics.span('model_training', **labels):
                 p = Process(target=self.__run_training, args=(algorithm, 
                                                               hw,
                                                               target,
-                                                              dataset,
                                                               input_dependent))
                 p.start()
                 #raise FileNotFoundError(f'Model for ({algorithm}, {hw}, {target}) does not exist. Training started. Come back later.')
@@ -64,45 +207,403 @@ class MLModels():
                 # request, while still keeping all the training part incapsulated in "get_model"
                 print(f'Model for ({algorithm}, {hw}, {target}) does not exist. Training started.')
                 p.join()
-                del self.ongoing_training[(algorithm, hw, target, input_dependent)]
-                print(f'Finished training model for ({algorithm}, {hw}, {target}).')
+        finally:
+            del self.ongoing_training[key]
+        if not os.path.exists(model_path):
+            raise Exception(f'Training of the model for ({algorithm}, {hw}, {target}) failed.')
+        self._info.pop(model_path, None)
+        self._generations[(algorithm, input_dependent)] += 1
+        print(f'Finished training model for ({algorithm}, {hw}, {target}).')
 
+    def get_model_nbytes(self, algorithm, hw, target, input_dependent=False):
+        """Bytes of the node arrays of a loaded model and of its compiled rules, if any (None if not loaded, see get_model)."""
+        model_path = self.__get_model_path(algorithm, hw, target, input_dependent)
+        loaded = self._loaded.get(model_path)
+        if loaded is None:
+            return None
+        state = loaded[1].tree_.__getstate__()
+        rules = self._rules.get(model_path)
+        return state['nodes'].nbytes + state['values'].nbytes + (rules[2].nbytes if rules is not None else 0)
+
+    def __load(self, algorithm, hw, target, input_dependent=False):
+        """Loads a trained model, unless already loaded and not replaced since then; returns (mtime, model, info)."""
+        model_path = self.__get_model_path(algorithm, hw, target, input_dependent)
+        mtime = os.stat(model_path).st_mtime_ns
+        loaded = self._loaded.get(model_path)
+        metrics.cache_lookup('loaded_models', hit=loaded is not None and loaded[0] == mtime)
+        if loaded is None or loaded[0] != mtime:
+            with metrics.span('model_load', algorithm=algorithm, input_case=input_case(input_dependent)):
+                with open(model_path, 'rb') as f:
+                    model = pickle.load(f)
+                info = self.get_model_info(algorithm, hw, target, input_dependent)
+            if loaded is not None:
+                # replaced (e.g. retrained by another process): errors have to be computed again with the new model
+                self.datasets.reset_error_stats(algorithm, hw, input_dependent)
+                self._generations[(algorithm, input_dependent)] += 1
+            loaded = self._loaded[model_path] = (mtime, model, info)
+        return loaded
+
+    def get_model(self, algorithm, hw, target, input_dependent=False):
+        """Returns the model (Decision).
+
+        Args:
+            algorithm (str): algorithm id.
+            hw (str): hardware platform id
+            target (str): target id.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+
+        Raises:
+            Exception: if the model is not found and its training fails.
 
-        # model exists, load it
-        model = pickle.load(open(model_path, 'rb'))
+        Returns:
+            sklearn.tree.DecisionTreeRegressor: DT model.
+        """
+        model_path = self.__get_model_path(algorithm, hw, target, input_dependent) 
+        labels = {'algorithm': algorithm, 'input_case': input_case(input_dependent)}
+
+        metrics.cache_lookup('models', hit=os.path.exists(model_path))
+        if not os.path.exists(model_path):
+            # concurrent callers (threads) wait for the same training and share the model it loads
+            def train_and_load():
+                self.__train(algorithm, hw, target, input_dependent)
+                return self.__load(algorithm, hw, target, input_dependent)
+            _, model, info = self._training_flights.do((algorithm, hw, target, input_dependent), train_and_load)
+        else:
+            _, model, info = self.__load(algorithm, hw, target, input_dependent)
+
+        # a model trained on a different dataset (or features, settings, library) is retrained in background,
+        # while still being used until the new one is ready
+        stale_reasons = self.get_stale_reasons(algorithm, hw, target, input_dependent, info)
+        if stale_reasons and (algorithm, hw, input_dependent) not in self.retraining:
+            print(f'Model for ({algorithm}, {hw}, {target}) is stale ({", ".join(stale_reasons)}). Retraining started.')
+            metrics.inc('stale_models_total', **labels)
+            self.retrain(algorithm, hw, input_dependent, reschedule=False)
         return model
 
-    def __run_training(self, algorithm, hw, target, dataset, input_dependent=False):
+    def get_model_features(self, algorithm, hw, target, input_dependent=False):
+        """
+        Features a loaded model (see get_model) was trained on, in its order: they differ from the current ones
+        when categories are added to the algorithm (see StrExpander.extend_categories) until the model is retrained.
+
+        Returns:
+            list[str]: names of the features.
+        """
+        current = self.datasets.expander.get_expanded_ml_input_vars(algorithm, input_dependent)
+        loaded = self._loaded.get(self.__get_model_path(algorithm, hw, target, input_dependent))
+        if loaded is None or loaded[2] is None or loaded[2]['features'] == current:
+            return current
+        return loaded[2]['features']
+
+    def get_rules(self, algorithm, hw, target, input_dependent=False):
+        """Returns the compiled rules of a model (see TreeRules), as used by the presolve and the embedding.
+
+        Rules are compiled once per model (when it is trained, or at the first use of a model trained before),
+        compacting the tree (see compaction_tolerance) and snapping the bounds of the integer features to integer
+        values, and stored next to the model, for the other processes and the next restarts. With a store (see
+        ArrayStore), their arrays are held once per node, memory-mapped by all the processes; otherwise each process
+        keeps them in memory.
+
+        Args:
+            algorithm (str): algorithm id.
+            hw (str): hardware platform id
+            target (str): target id.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+
+        Raises:
+            Exception: if the model is not found and its training fails.
+
+        Returns:
+            TreeRules: compiled rules of the model, over the current features (see get_model_features).
+        """
+        self.get_model(algorithm, hw, target, input_dependent)
+        model_path = self.__get_model_path(algorithm, hw, target, input_dependent)
+        # model and modification time are read together, as the model may be replaced meanwhile
+        mtime, model, info = self._loaded[model_path]
+        current = self.datasets.expander.get_expanded_ml_input_vars(algorithm, input_dependent)
+        features = info['features'] if info is not None else current
+
+        cached = self._rules.get(model_path)
+        metrics.cache_lookup('tree_rules', hit=cached is not None and cached[:2] == (mtime, current))
+        if cached is None or cached[:2] != (mtime, current):
+            integer = self.__get_integer_features(algorithm, input_dependent, features)
+            rules = None
+            if self.store is not None:
+                key = f'rules/{input_case(input_dependent)}/{os.path.basename(model_path)}'
+                version = f'{mtime}-{self.compaction_tolerance}-{hashlib.sha256(np.asarray(integer).tobytes()).hexdigest()[:12]}'
+                arrays, attrs = self.store.get(key, version)
+                metrics.cache_lookup('stored_rules', hit=arrays is not None)
+                if arrays is not None:
+                    rules = TreeRules.from_arrays(arrays, attrs)
+            if rules is None:
+                rules = TreeRules.load(model_path + RULES_SUFFIX, mtime, self.compaction_tolerance, integer)
+                if rules is None:
+                    rules = TreeRules.from_model(model, model.n_features_in_, self.compaction_tolerance, integer)
+                    print(f'Rules of the model for ({algorithm}, {hw}, {target}) compiled: {rules.n_leaves} leaves '
+                          f'({rules.trained_leaves} before compaction).')
+                    try:
+                        rules.save(model_path + RULES_SUFFIX, mtime)
+                    except OSError as e:
+                        print(f'Rules of the model for ({algorithm}, {hw}, {target}) not stored: {e}')
+                if self.store is not None:
+                    arrays, attrs = self.store.put(key, version, *rules.to_arrays())
+                    # (unless replaced meanwhile by a newer version) the stored arrays are used, not this copy
+                    if arrays is not None:
+                        rules = TreeRules.from_arrays(arrays, attrs)
+            if features != current:
+                # trained before new categories were added: used with the new features until retrained
+                rules = rules.reindex(features, current)
+            cached = self._rules[model_path] = (mtime, current, rules)
+        return cached[2]
+
+    def get_generation(self, algorithm, input_dependent=False):
+        """Counter increased whenever a model of the algorithm is trained or replaced, e.g. to refresh data derived from them."""
+        return self._generations[(algorithm, input_dependent)]
+
+    def get_stale_reasons(self, algorithm, hw, target, input_dependent=False, info=None):
         """
-        Trains a Decision Tree and stores it with pickle.
+        Checks whether a trained model is stale, comparing the information stored along with it (see get_model_info)
+        with the current dataset (fingerprint), features, training settings and scikit-learn version.
+
+        Args:
+            algorithm (str): algorithm id.
+            hw (str): hardware platform id
+            target (str): target id.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+            info (dict): information stored along with the model (read from disk if None).
+
+        Returns:
+            list[str]: reasons why the model is stale (empty if it is up to date).
+        """
+        if info is None:
+            info = self.get_model_info(algorithm, hw, target, input_dependent)
+        if info is None or 'dataset_hash' not in info:
+            return ['no metadata']
+
+        reasons = []
+        fingerprint = self.datasets.get_fingerprint(algorithm, hw, input_dependent)
+        if info['dataset_hash'] != fingerprint:
+            # the dataset may have been changed since it was last read (e.g. rows added by another process)
+            fingerprint = self.datasets.get_fingerprint(algorithm, hw, input_dependent, refresh=True)
+        if info['dataset_hash'] != fingerprint:
+            reasons.append('dataset changed')
+        if info['features'] != self.datasets.expander.get_expanded_ml_input_vars(algorithm, input_dependent):
+            reasons.append('features changed')
+        if info['settings'] != self.get_training_settings(algorithm, input_dependent):
+            reasons.append('training settings changed')
+        # scikit-learn is already loaded, along with the model
+        import sklearn
+        if info['versions']['sklearn'] != sklearn.__version__:
+            reasons.append('scikit-learn version changed')
+        return reasons
+
+    def scan_stale(self):
+        """
+        Checks the trained models of all (algorithm, hw), reading the datasets again (e.g. to detect datasets
+        changed by other means), and retrains the stale ones in background.
+
+        Returns:
+            list[tuple]: (algorithm, hw, input_dependent) whose models are being retrained.
+        """
+        scheduled = []
+        for input_dependent in [False, True]:
+            for algorithm in self.db.get_algorithms(input_dependent):
+                for hw in self.db.get_hws(algorithm, input_dependent):
+                    key = (algorithm, hw, input_dependent)
+                    targets = [target for target in self.db.get_targets(algorithm, input_dependent) if target != 'price'
+                               and os.path.exists(self.__get_model_path(algorithm, hw, target, input_dependent))]
+                    # models never trained are trained when needed
+                    if not targets or key in self.retraining:
+                        continue
+                    try:
+                        self.datasets.get_fingerprint(algorithm, hw, input_dependent, refresh=True)
+                        if any(self.get_stale_reasons(algorithm, hw, target, input_dependent) for target in targets):
+                            metrics.inc('stale_models_total', algorithm=algorithm, input_case=input_case(input_dependent))
+                            self.retrain(algorithm, hw, input_dependent, reschedule=False)
+                            scheduled.append(key)
+                    except Exception:
+                        traceback.print_exc()
+        return scheduled
+
+    def start_staleness_scan(self, interval):
+        """Starts a background thread checking the trained models every interval seconds (see scan_stale)."""
+        def scan():
+            while True:
+                time.sleep(interval)
+                scheduled = self.scan_stale()
+                if scheduled:
+                    print(f'Retraining stale models for {scheduled}.')
+        thread = threading.Thread(target=scan, daemon=True)
+        thread.start()
+        return thread
+
+    def retrain(self, algorithm, hw, input_dependent=False, wait=False, reschedule=True):
+        """
+        Retrains the models for all the targets of an (algorithm, hw) in background (e.g. after new rows are added
+        to its dataset); each model is replaced as soon as the new one is trained, the current one being used
+        until then. If the (algorithm, hw) is already being retrained, it is retrained once more afterwards
+        (unless reschedule is False).
+
+        Args:
+            algorithm (str): algorithm id.
+            hw (str): hardware platform id.
+            input_dependent (bool): input case (True for input-dependent, False for input_independent).
+            wait (bool): whether to wait for the retraining to end (including the ongoing one, if any).
+            reschedule (bool): whether to retrain again if a retraining is ongoing.
+
+        Returns:
+            threading.Thread: thread retraining the models, or None if a retraining is ongoing.
+        """
+        key = (algorithm, hw, input_dependent)
+        with self._retraining_lock:
+            if key in self.retraining:
+                self.retraining[key] = self.retraining[key] or reschedule
+                ongoing = self._retraining_threads[key]
+            else:
+                self.retraining[key] = False
+                ongoing = None
+                thread = self._retraining_threads[key] = threading.Thread(target=self.__retrain, args=key, daemon=True)
+                thread.start()
+        if ongoing is not None:
+            if wait:
+                ongoing.join()
+            return None
+        if wait:
+            thread.join()
+        return thread
+
+    def wait_retraining(self):
+        """Waits for the ongoing retrainings (see retrain) to end."""
+        while True:
+            with self._retraining_lock:
+                threads = list(self._retraining_threads.values())
+            if not threads:
+                return
+            for thread in threads:
+                thread.join()
+
+    def __retrain(self, algorithm, hw, input_dependent=False):
+        key = (algorithm, hw, input_dependent)
+        labels = {'algorithm': algorithm, 'input_case': input_case(input_dependent)}
+        try:
+            while True:
+                for target in self.db.get_targets(algorithm, input_dependent):
+                    if target == 'price':
+                        continue
+                    with metrics.span('model_training', **labels):
+                        p = Process(target=self.__run_training, args=(algorithm, hw, target, input_dependent))
+                        p.start()
+                        p.join()
+                    self._info.pop(self.__get_model_path(algorithm, hw, target, input_dependent), None)
+                    self._generations[(algorithm, input_dependent)] += 1
+                # errors have to be computed again with the new models
+                self.datasets.reset_error_stats(algorithm, hw, input_dependent)
+                print(f'Finished retraining models for ({algorithm}, {hw}).')
+
+                with self._retraining_lock:
+                    if not self.retraining[key]:
+                        del self.retraining[key]
+                        del self._retraining_threads[key]
+                        return
+                    self.retraining[key] = False
+        except Exception:
+            traceback.print_exc()
+            with self._retraining_lock:
+                del self.retraining[key]
+                del self._retraining_threads[key]
+
+    def __run_training(self, algorithm, hw, target, input_dependent=False):
+        """
+        Trains a Decision Tree and stores it with pickle. The dataset is read in the training process (from the
+        shared store, if any, see DatasetsLocal), rather than passed by the parent.
 
         Args:
             algorithm (str): algorithm id.
             hw (str): hardware platform id.
             target (str): target id.
-            dataset (pd.DataFrame): training dataset.
             input_dependent (bool): input case (True for input-dependent, False for input_independent).
         
         """
         #s = time.time()
+        import sklearn
+        from sklearn.tree import DecisionTreeRegressor
         model_path = self.__get_model_path(algorithm, hw, target, input_dependent)
+        settings = self.get_training_settings(algorithm, input_dependent)
 
         # filtering dataset for the specific hyperparams and target
         #hyperparams = self.db.get_hyperparams(algorithm)
         # handling str variables, substituting them with one-hot encoded ones
+        dataset = self.datasets.get_dataset(algorithm, hw, input_dependent)
         input_vars = self.datasets.expander.get_expanded_ml_input_vars(algorithm, input_dependent)
         X = dataset[input_vars].values
         y = dataset[[target]].values
 
         # training the DT
-        dt = DecisionTreeRegressor(max_depth=10, random_state=42)
+        params = {'max_depth': settings['max_depth'],
+                  'max_leaf_nodes': settings['max_leaf_nodes'],
+                  'min_samples_leaf': settings['min_samples_leaf']}
+        validation_error = None
+        if settings['auto'] and len(X) >= MIN_AUTO_SAMPLES:
+            params['max_depth'], validation_error = self.__select_depth(X, y, params, settings)
+        dt = DecisionTreeRegressor(random_state=42, **params)
         #dt = DecisionTreeRegressor(max_depth=None, random_state=42)
         dt.fit(X, y)
 
-        # storing the DT
-        pickle.dump(dt, open(model_path, 'wb'))
+        # storing the DT, along with its information (see get_model_info): the info is written first, so that
+        # a model is never found without it; files are replaced atomically, as the previous model (if any)
+        # may be in use
+        rules = TreeRules.from_model(dt, len(input_vars), self.compaction_tolerance,
+                                     self.__get_integer_features(algorithm, input_dependent))
+        info = {'dataset_hash': dataset_fingerprint(dataset),
+                'features': input_vars,
+                'settings': settings,
+                'params': params,
+                'validation_error': validation_error,
+                'depth': int(dt.get_depth()),
+                'leaves': int(dt.get_n_leaves()),
+                'compacted_leaves': rules.n_leaves,
+                'milp': rules.embedding_size(),
+                'versions': {'sklearn': sklearn.__version__, 'numpy': np.__version__, 'python': platform.python_version()}}
+        with open(model_path + '.json.tmp', 'w') as f:
+            json.dump(info, f, indent=2)
+        os.replace(model_path + '.json.tmp', model_path + '.json')
+        with open(model_path + '.tmp', 'wb') as f:
+            pickle.dump(dt, f)
+        os.replace(model_path + '.tmp', model_path)
+        # the rules are compiled along with the model (see get_rules)
+        rules.save(model_path + RULES_SUFFIX, os.stat(model_path).st_mtime_ns)
+        print(f"Model for ({algorithm}, {hw}, {target}): depth {info['depth']}, {info['leaves']} leaves ({info['compacted_leaves']} after compaction), "
+              f"{info['milp']['binary_variables']} binary variables and {info['milp']['constraints']} constraints when embedded.")
 
         #print(self.ongoing_training)
         #print(f'Done in {time.time()-s}')
         #del self.ongoing_training[(algorithm, hw, target)]
         #print(self.ongoing_training)
+
+    def __select_depth(self, X, y, params, settings):
+        """
+        Selects the smallest depth (up to max_depth) whose error on held-out data is within the tolerance of
+        the best one, i.e. at most (1 + tolerance) times the smallest mean absolute error among all depths.
+
+        Returns:
+            int: selected depth.
+            float: held-out (mean absolute) error with the selected depth.
+        """
+        from sklearn.tree import DecisionTreeRegressor
+        from sklearn.model_selection import train_test_split
+        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=settings['validation_split'], random_state=42)
+        max_depth = params['max_depth']
+        if max_depth is None:
+            max_depth = DecisionTreeRegressor(random_state=42, **params).fit(X_train, y_train).get_depth()
+
+        errors = {}
+        for depth in range(1, max(max_depth, 1) + 1):
+            dt = DecisionTreeRegressor(random_state=42, **dict(params, max_depth=depth)).fit(X_train, y_train)
+            errors[depth] = float(np.mean(np.abs(dt.predict(X_val) - y_val.ravel())))
+            # deeper trees are not grown once the tree stops growing
+            if dt.get_depth() < depth:
+                break
+
+        best_error = min(errors.values())
+        depth = min(depth for depth, error in errors.items() if error <= best_error * (1 + settings['tolerance']))
+        return depth, errors[depth]
+
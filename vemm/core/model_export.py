@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import random
+import threading
+from vemm.core.metrics import input_case
+
+FORMATS = ('mps', 'lp')
+
+
+class ModelExporter():
+    """
+    Writes a sample of the HADA models built by the service to a corpus folder, to be solved again offline
+    (see vemm.utils.replay). Each model is written as <name>.mps (or .lp), along with <name>.json: the request
+    it was built for (/optimize schema), the solver settings and cutoff it was solved with, and the statistics
+    of that solve. Subproblems of decomposed requests are exported as one model per hw (<name>-<hw>).
+    The metadata file is written last: models without it are incomplete, and ignored.
+
+    Args:
+        path (str): corpus folder (created if missing).
+        sample_rate (float): fraction of the requests whose models are exported.
+        max_models (int): maximum number of requests exported in the folder, counting each model already
+            there as one (no limit if None).
+        format (str): 'mps' or 'lp' (names of the embedded tree variables are not valid in LP, and get replaced).
+    """
+    def __init__(self, path, sample_rate=1.0, max_models=None, format='mps'):
+        if format not in FORMATS:
+            raise AttributeError(f"Export format can only be one of {', '.join(FORMATS)}.")
+        if not 0 <= sample_rate <= 1:
+            raise AttributeError('Export sample rate must be between 0 and 1.')
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_models = max_models
+        self.format = format
+        os.makedirs(path, exist_ok=True)
+        # models already in the corpus (e.g. exported before a restart) count towards max_models
+        self._exported = sum(name.endswith('.json') and not name.startswith('.') for name in os.listdir(path))
+        self._lock = threading.Lock()
+
+    def sample(self, request):
+        """
+        Decides whether the models of a request are exported.
+
+        Args:
+            request (OptimizationRequest): represents the user's request.
+
+        Returns:
+            dict: what the models are exported with (see export_model), or None if not sampled.
+        """
+        with self._lock:
+            if self.max_models is not None and self._exported >= self.max_models:
+                return None
+            if random.random() >= self.sample_rate:
+                return None
+            self._exported += 1
+        fingerprint = request.get_fingerprint()
+        return {'path': self.path,
+                'format': self.format,
+                'name': f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{fingerprint[:12]}",
+                'request': request.to_json(),
+                'fingerprint': fingerprint}
+
+
+def export_model(export, mdl, spec, hws, result, cutoff=None, build_time=None, embed_time=None, subproblem=False):
+    """
+    Writes a solved model and its metadata to the corpus. Failures are reported, but do not fail the request.
+
+    Args:
+        export (dict): returned by ModelExporter.sample.
+        mdl (docplex.mp.model.Model): the model.
+        spec (ModelSpec): the request's model specification.
+        hws (list[str]): hws included in the model.
+        result (dict): result of solve_model.
+        cutoff (float): cutoff the model was solved with, if any.
+        build_time (float): time spent building the model, embedding excluded (seconds).
+        embed_time (float): time spent embedding the predictive models (seconds).
+        subproblem (bool): whether the model is the subproblem of a hw, in decomposition mode.
+
+    Returns:
+        bool: whether the model was exported.
+    """
+    name = f"{export['name']}-{hws[0]}" if subproblem else export['name']
+    model_file = f"{name}.{export['format']}"
+    tmp_file = os.path.join(export['path'], f'.tmp-{os.getpid()}-{model_file}')
+    try:
+        if export['format'] == 'mps':
+            mdl.export_as_mps(tmp_file)
+        else:
+            mdl.export_as_lp(tmp_file)
+        os.replace(tmp_file, os.path.join(export['path'], model_file))
+
+        metadata = {'name': name,
+                    # same for the subproblems of a request
+                    'request_name': export['name'],
+                    'model': model_file,
+                    'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'algorithm': spec.algorithm,
+                    'input_case': input_case(spec.input_dependent),
+                    'fingerprint': export['fingerprint'],
+                    'request': export['request'],
+                    'hws': list(hws),
+                    'opt_type': spec.opt_type,
+                    'solver_settings': spec.solver_settings,
+                    'cutoff': cutoff,
+                    'build_time': build_time,
+                    'embed_time': embed_time,
+                    'stats': result['stats']}
+        with open(os.path.join(export['path'], f'.tmp-{os.getpid()}-{name}.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(f.name, os.path.join(export['path'], f'{name}.json'))
+    except OSError as e:
+        print(f'Model {name} not exported: {e}')
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return False
+    return True
+
+
+def list_models(path):
+    """Metadata (see export_model) of the complete models in a corpus folder, sorted by name."""
+    corpus = []
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith('.json') and not file_name.startswith('.'):
+            with open(os.path.join(path, file_name)) as f:
+                corpus.append(json.load(f))
+    return corpus
@@ -1,3 +1,7 @@
+import json
+import hashlib
+
+
 class OptimizationRequest():
     """Class that represents and handles an optimization request for HADA. Arguments are checked."""
     def __init__(self,
@@ -9,7 +13,8 @@ class OptimizationRequest():
                  user_constraints,
                  hws_prices,
                  country,
-                 inputs=None):
+                 inputs=None,
+                 solver_settings=None):
 
         self.input_dependent=False
         if inputs:
@@ -53,12 +58,52 @@ class OptimizationRequest():
                 raise AttributeError("Hardware prices must be specified via HardwarePrices class.")
             self.inputs = inputs
 
-        # country
+        # country (or list of countries, or 'all'), used to convert emissions (see app.convert_emissions)
+        if country is not None and db.has_emission_data(algorithm, self.input_dependent) and country != 'all':
+            countries = country if isinstance(country, list) else [country]
+            available_countries = db.get_countries()
+            if not countries or any(type(c) is not str or c not in available_countries for c in countries):
+                raise AttributeError("Country must be one of the countries with carbon intensity data, a list of them or 'all'.")
         self.country = country
 
+        # when not specified, the defaults for the algorithm are used
+        if solver_settings is None:
+            solver_settings = SolverSettings(db, algorithm, self.input_dependent)
+        if not isinstance(solver_settings, SolverSettings):
+            raise AttributeError("Solver settings must be specified via SolverSettings class.")
+        self.solver_settings = solver_settings
+
     def is_input_dependent(self):
         return self.input_dependent
 
+    def get_fingerprint(self):
+        """Hash of the content of the request, regardless of the order of constraints, prices, inputs and settings (e.g. to detect identical requests)."""
+        content = {'algorithm': self.algorithm,
+                   'input_dependent': self.input_dependent,
+                   'target': self.target,
+                   'opt_type': self.opt_type,
+                   'robustness_fact': self.robustness_fact,
+                   'constraints': self.user_constraints.get_constraints(),
+                   'prices': self.hws_prices.get_prices(),
+                   'inputs': self.inputs.get_inputs() if self.input_dependent else None,
+                   'country': self.country,
+                   'solver_settings': self.solver_settings.get_settings()}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def to_json(self):
+        """The request in the /optimize schema (see app.parse_request_json), e.g. to be submitted again."""
+        data = {'algorithm': self.algorithm,
+                'objective': {'target': self.target, 'type': self.opt_type},
+                'robustness_fact': self.robustness_fact,
+                'constraints': [{'target': target, 'type': constr_type, 'value': value}
+                                for target, (constr_type, value) in self.user_constraints.get_constraints().items()],
+                'price_per_hw': [{'hw': hw, 'price': price} for hw, price in self.hws_prices.get_prices().items()],
+                'country': self.country,
+                'solver': dict(self.solver_settings.get_settings())}
+        if self.input_dependent:
+            data['inputs'] = [{'name': name, 'value': value} for name, value in self.inputs.get_inputs().items()]
+        return data
+
 class Inputs():
     """Class that represents an user's input to be included in a Request. Arguments are checked."""
     def __init__(self, configdb, algorithm) -> None:
@@ -156,6 +201,10 @@ class HardwarePrices():
 
         self.__price_per_hw[hw] = price
 
+    def get_prices(self):
+        """Prices specified so far (including the defaults), not checked for completeness (see get_prices_per_hw)."""
+        return self.__price_per_hw
+
     def get_prices_per_hw(self):
         # checking that all prices for the algorithms are specified
         hws = self.db.get_hws(self.algorithm, self.input_dependent)
@@ -165,13 +214,131 @@ class HardwarePrices():
         return self.__price_per_hw
 
 
+class SolverSettings():
+    """Class that represents the settings of the solver for a Request (algorithm-specific defaults can be overridden). Arguments are checked."""
+    # values accepted for "emphasis", mapped to CPLEX's MIP emphasis parameter
+    EMPHASIS = {'balanced': 0, 'feasibility': 1, 'optimality': 2, 'bestbound': 3, 'hiddenfeas': 4, 'heuristic': 5}
+    # setting : (accepted types, description)
+    SETTINGS = {'time_limit': ((int, float), 'Time limit (seconds)'),
+                'mip_gap': ((int, float), 'Relative MIP gap'),
+                'mip_gap_abs': ((int, float), 'Absolute MIP gap'),
+                'threads': ((int,), 'Number of threads (0 lets the solver decide)'),
+                'emphasis': ((str,), 'MIP emphasis'),
+                'solve_stats': ((bool,), 'Whether to return solve statistics'),
+                'decompose': ((bool,), 'Whether to solve one subproblem per hardware platform'),
+                'workers': ((int,), 'Number of processes solving subproblems')}
+
+    def __init__(self, configdb, algorithm, input_dependent=False) -> None:
+
+        self.db = configdb
+        self.input_dependent = input_dependent
+
+        if algorithm not in self.db.get_algorithms(self.input_dependent):
+            raise AttributeError(f'Algorithm {algorithm} not available.')
+        self.algorithm = algorithm
+
+        # setting : value
+        # loading default values for the algorithm when specified
+        self.__settings = {}
+        for setting, value in self.db.get_solver_settings(self.algorithm, self.input_dependent).items():
+            self.add_setting(setting, value)
+
+    @classmethod
+    def check_setting(cls, setting, value):
+        if setting not in cls.SETTINGS:
+            raise AttributeError(f"Solver setting {setting} not available; it must be one of {', '.join(cls.SETTINGS)}.")
+
+        accepted_types, description = cls.SETTINGS[setting]
+        # bool is a subclass of int, it must not be accepted for numerical settings
+        if type(value) not in accepted_types:
+            raise AttributeError(f"{description} must be of type {' or '.join(t.__name__ for t in accepted_types)}.")
+
+        if setting in ['time_limit', 'mip_gap', 'mip_gap_abs', 'threads'] and value < 0:
+            raise AttributeError(f"{description} must be non-negative.")
+        if setting == 'workers' and value < 1:
+            raise AttributeError(f"{description} must be at least 1.")
+        if setting == 'emphasis' and value not in cls.EMPHASIS:
+            raise AttributeError(f"MIP emphasis must be one of {', '.join(cls.EMPHASIS)}.")
+
+    def add_setting(self, setting, value):
+        # ignore if value is None (default is kept)
+        if value is None:
+            return
+
+        self.check_setting(setting, value)
+        self.__settings[setting] = value
+
+    def get_settings(self):
+        return self.__settings
+
+    def apply(self, mdl):
+        """Sets the parameters of a docplex model accordingly to the settings."""
+        self.apply_settings(mdl, self.__settings)
+
+    @classmethod
+    def apply_settings(cls, mdl, settings):
+        """Sets the parameters of a docplex model accordingly to settings (dict, see get_settings)."""
+        if 'time_limit' in settings:
+            mdl.parameters.timelimit = settings['time_limit']
+        if 'mip_gap' in settings:
+            mdl.parameters.mip.tolerances.mipgap = settings['mip_gap']
+        if 'mip_gap_abs' in settings:
+            mdl.parameters.mip.tolerances.absmipgap = settings['mip_gap_abs']
+        if 'threads' in settings:
+            mdl.parameters.threads = settings['threads']
+        if 'emphasis' in settings:
+            mdl.parameters.emphasis.mip = cls.EMPHASIS[settings['emphasis']]
+
+
 class OptimizationSolution():
     """Class containing a solution produced by HADA."""
-    def __init__(self, chosen_hw, hyperparams_values, targets_values, country):
+    def __init__(self, chosen_hw, hyperparams_values, targets_values, country, algorithm=None, input_dependent=False,
+                 proven_optimal=True, solve_stats=None):
         self.chosen_hw = chosen_hw
         self.hyperparams_values = hyperparams_values
         self.targets_values = targets_values
         self.country = country
+        # request the solution refers to
+        self.algorithm = algorithm
+        self.input_dependent = input_dependent
+        # False when the solver stopped on a limit (e.g. time limit), returning its best incumbent
+        self.proven_optimal = proven_optimal
+        # statistics about the solve (only if requested, otherwise None)
+        self.solve_stats = solve_stats
 
     def __str__(self):
         return f'chosen hw: {self.chosen_hw}; hyperparams values: {self.hyperparams_values}; targets values: {self.targets_values}; country: {self.country}'
+
+
+class NoSolution():
+    """
+    Outcome of HADA when no solution is found, with the reason. It is falsy, so that it can be checked as a
+    missing solution.
+
+    Args:
+        status (str): one of STATUSES.
+        algorithm (str): algorithm of the request.
+        input_dependent (bool): input case of the request.
+        solve_stats (dict): statistics about the solve (only if requested, otherwise None).
+        pruned_hws (dict): reason each hw dropped by the presolve is dropped for (see presolve.prune_hws).
+    """
+    # status : description
+    STATUSES = {'infeasible': 'the request is proven to have no solution',
+                'time_limit': 'the time limit was reached before a solution was found',
+                'unknown': 'the solver stopped before a solution was found'}
+
+    def __init__(self, status, algorithm=None, input_dependent=False, solve_stats=None, pruned_hws=None):
+        if status not in self.STATUSES:
+            raise AttributeError(f"Status {status} not available; it must be one of {', '.join(self.STATUSES)}.")
+        self.status = status
+        self.algorithm = algorithm
+        self.input_dependent = input_dependent
+        self.solve_stats = solve_stats
+        self.pruned_hws = pruned_hws or {}
+
+    def __bool__(self):
+        return False
+
+    def __str__(self):
+        pruned = ''.join(f' {hw}: {reason}.' for hw, reason in self.pruned_hws.items())
+        return f'No solution: {self.STATUSES[self.status]}.{pruned}'
@@ -0,0 +1,114 @@
+import numpy as np
+
+# absolute/relative tolerance used when comparing predictions with the user constraints
+# (a constraint is considered violated only beyond the solver's feasibility tolerance)
+TOLERANCE = 1e-6
+
+
+def get_fixed_inputs(datasets, request):
+    """
+    Values of the inputs fixed in the request, with str inputs one-hot encoded.
+
+    Args:
+        datasets (Datasets): instance of Datasets.
+        request (OptimizationRequest): represents the user's request.
+
+    Returns:
+        dict: value for each fixed (expanded) input variable; empty for input-independent requests.
+    """
+    fixed = {}
+    if request.input_dependent:
+        inputs = request.inputs.get_inputs()
+        types = datasets.db.get_type_per_input(request.algorithm)
+        for input_var, value in inputs.items():
+            if types[input_var] == 'str':
+                fixed.update(datasets.expander.get_encoded_selection(request.algorithm, input_var, value, request.input_dependent))
+            else:
+                fixed[input_var] = value
+    return fixed
+
+
+def get_ml_input_bounds(ml_input_vars, var_bounds, fixed_inputs):
+    """
+    Bounds for the features of the predictive models, narrowed by the inputs fixed in the request (if any).
+
+    Args:
+        ml_input_vars (list[str]): features of the predictive models (str variables one-hot encoded).
+        var_bounds (dict): lower and upper bound for each (expanded) variable.
+        fixed_inputs (dict): value for each fixed (expanded) input variable, see get_fixed_inputs.
+
+    Returns:
+        lb (np.ndarray), ub (np.ndarray): lower and upper bound for each feature.
+    """
+    lb = np.array([fixed_inputs.get(var, var_bounds[var]['lb']) for var in ml_input_vars], dtype=float)
+    ub = np.array([fixed_inputs.get(var, var_bounds[var]['ub']) for var in ml_input_vars], dtype=float)
+    return lb, ub
+
+
+def get_target_ranges(trees, var_bounds, lb, ub):
+    """
+    Minimum and maximum value each (hw, target) variable can take, given the leaves of its predictive model
+    that are reachable within the features' bounds, and the bounds of the target.
+
+    Args:
+        trees (dict): compiled rules (TreeRules) of the trained tree for each (hw, target).
+        var_bounds (dict): lower and upper bound for each variable.
+        lb (np.ndarray), ub (np.ndarray): bounds for the features, see get_ml_input_bounds.
+
+    Returns:
+        dict: (min, max) for each (hw, target), or None if the target cannot take any value.
+    """
+    ranges = {}
+    for (hw, target), rules in trees.items():
+        target_lb, target_ub = var_bounds[target]['lb'], var_bounds[target]['ub']
+        pred_range = rules.prediction_range(lb, ub)
+        if pred_range is None or pred_range[0] > target_ub or pred_range[1] < target_lb:
+            ranges[(hw, target)] = None
+        else:
+            ranges[(hw, target)] = (max(pred_range[0], target_lb), min(pred_range[1], target_ub))
+    return ranges
+
+
+def prune_hws(request, hws, target_ranges, robust_coeff, reasons=None):
+    """
+    Drops the hws that provably cannot satisfy the user constraints: those whose predictions (see
+    get_target_ranges) or price can never meet a constraint, or whose targets cannot take any value.
+
+    Args:
+        request (OptimizationRequest): represents the user's request.
+        hws (list[str]): hardware platforms for the algorithm.
+        target_ranges (dict): (min, max) for each (hw, target), see get_target_ranges.
+        robust_coeff (dict): robustness coefficient for each (hw, target), or None.
+        reasons (dict): if given, filled with the reason each dropped hw is dropped for.
+
+    Returns:
+        list[str]: hws that may satisfy the constraints (in the original order).
+    """
+    constraints = request.user_constraints.get_constraints()
+    reasons = {} if reasons is None else reasons
+    feasible_hws = []
+    for hw in hws:
+        empty = [target for (hw_, target) in target_ranges if hw_ == hw and target_ranges[(hw_, target)] is None]
+        if empty:
+            reasons[hw] = f'{empty[0]} cannot take any value within the bounds of the variables'
+            continue
+
+        feasible = True
+        for target, (constr_type, value) in constraints.items():
+            if target == 'price':
+                price = request.hws_prices.get_prices_per_hw()[hw]
+                min_value, max_value = price, price
+            else:
+                min_value, max_value = target_ranges[(hw, target)]
+            coeff = robust_coeff[(hw, target)] if robust_coeff is not None else 0
+            tol = TOLERANCE * max(1, abs(value))
+
+            if (constr_type in ['leq', 'eq'] and min_value > value + (coeff if constr_type == 'eq' else -coeff) + tol
+                    or constr_type in ['geq', 'eq'] and max_value < value - (coeff if constr_type == 'eq' else -coeff) - tol):
+                feasible = False
+                reasons.setdefault(hw, f'{target} {constr_type} {value} cannot be met: {target} is within '
+                                       f'[{min_value}, {max_value}]' + (f' (robustness margin {coeff})' if coeff else ''))
+        if feasible:
+            feasible_hws.append(hw)
+
+    return feasible_hws
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import Future
+from vemm.core.metrics import metrics
+
+
+class SingleFlight():
+    """
+    Coalesces concurrent calls with the same key (single-flight): the first caller runs the function, the callers
+    arriving while it runs wait for it and share its result (or exception), counted in the coalesced_calls_total
+    metric. Results are not kept once the call ends: later calls run the function again.
+    Thread-safe; calls are coalesced within a process.
+    """
+    def __init__(self, name):
+        # label of the calls in the metrics
+        self.name = name
+        # key : future of the ongoing call
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Runs fn, unless a call with the same key is ongoing: in that case, waits for it and returns its result.
+
+        Args:
+            key (hashable): identifies the calls that can share a result.
+            fn (callable): function without arguments.
+
+        Returns:
+            the result of fn (raises its exception, if any).
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            metrics.inc('coalesced_calls_total', call=self.name)
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
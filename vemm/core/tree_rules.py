@@ -0,0 +1,291 @@
+import os
+import numpy as np
+
+# suffix of the file storing the compiled rules of a model, next to the model (see MLModels.get_rules)
+RULES_SUFFIX = '.rules.npz'
+
+
+class TreeRules():
+    """
+    Rules of a trained regression tree compiled into arrays, i.e. what the presolve and the embedding need of it:
+    the value of each leaf and its box over the features (see extract_leaf_boxes). They depend only on the
+    trained tree (and the compaction tolerance), and are compiled once per model (see MLModels.get_rules) rather
+    than for each request.
+
+    Args:
+        values (np.ndarray): value of each leaf, shape (n_leaves,).
+        leaf_lb (np.ndarray): lower bound of each feature for each leaf (-inf if unbounded), shape (n_leaves, n_features).
+        leaf_ub (np.ndarray): upper bound of each feature for each leaf (+inf if unbounded), shape (n_leaves, n_features).
+        trained_leaves (int): leaves of the trained tree, before the compaction (same as the leaves if None).
+        tolerance (float): compaction tolerance the rules are compiled with (None if not compacted, see extract_leaf_boxes).
+        integer (np.ndarray): mask of the integer (or binary) features the boxes are snapped for (see snap_integer_boxes).
+    """
+    def __init__(self, values, leaf_lb, leaf_ub, trained_leaves=None, tolerance=None, integer=None):
+        self.values = values
+        self.leaf_lb = leaf_lb
+        self.leaf_ub = leaf_ub
+        self.trained_leaves = len(values) if trained_leaves is None else trained_leaves
+        self.tolerance = tolerance
+        self.integer = np.zeros(leaf_lb.shape[1], dtype=bool) if integer is None else np.asarray(integer, dtype=bool)
+        # (leaf, feature) of the finite bounds, i.e. of the big-M constraints of the embedding
+        self.lb_bounds = np.nonzero(np.isfinite(leaf_lb))
+        self.ub_bounds = np.nonzero(np.isfinite(leaf_ub))
+        # features tested by at least one split
+        self.features = np.isfinite(leaf_lb).any(axis=0) | np.isfinite(leaf_ub).any(axis=0)
+
+    @property
+    def n_leaves(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return (self.values.nbytes + self.leaf_lb.nbytes + self.leaf_ub.nbytes + self.features.nbytes + self.integer.nbytes
+                + sum(index.nbytes for index in self.lb_bounds + self.ub_bounds))
+
+    @classmethod
+    def from_model(cls, model, n_features, tolerance=None, integer=None):
+        """
+        Compiles the rules of a trained tree (sklearn.tree.DecisionTreeRegressor) with n_features features,
+        compacting it with the given tolerance (see extract_leaf_boxes) and snapping the bounds of the integer
+        features, if a mask of them is given (see snap_integer_boxes).
+        """
+        values, leaf_lb, leaf_ub = extract_leaf_boxes(model, n_features, tolerance)
+        if integer is not None:
+            values, leaf_lb, leaf_ub = snap_integer_boxes(values, leaf_lb, leaf_ub, np.asarray(integer, dtype=bool))
+        return cls(values, leaf_lb, leaf_ub, trained_leaves=model.tree_.n_leaves, tolerance=tolerance, integer=integer)
+
+    def save(self, path, model_mtime):
+        """
+        Stores the rules as .npz, along with the modification time (ns) of the model file they are compiled from,
+        replacing the file atomically.
+        """
+        tmp_path = f'{path}.tmp-{os.getpid()}.npz'
+        np.savez(tmp_path, values=self.values, leaf_lb=self.leaf_lb, leaf_ub=self.leaf_ub, model_mtime=np.int64(model_mtime),
+                 trained_leaves=np.int64(self.trained_leaves), tolerance=np.float64(np.nan if self.tolerance is None else self.tolerance),
+                 integer=self.integer)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, model_mtime, tolerance=None, integer=None):
+        """
+        Rules stored by save, or None if missing, compiled from another version of the model (see save), with
+        another compaction tolerance or for other integer features.
+        """
+        try:
+            with np.load(path) as data:
+                stored_tolerance = None if np.isnan(data['tolerance']) else float(data['tolerance'])
+                integer = np.zeros(data['leaf_lb'].shape[1], dtype=bool) if integer is None else np.asarray(integer, dtype=bool)
+                if (int(data['model_mtime']) != model_mtime or stored_tolerance != tolerance
+                        or not np.array_equal(data['integer'], integer)):
+                    return None
+                return cls(data['values'], data['leaf_lb'], data['leaf_ub'], int(data['trained_leaves']), tolerance, integer)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def to_arrays(self):
+        """Arrays and attributes of the rules, as held by an ArrayStore (see from_arrays)."""
+        arrays = {'values': self.values, 'leaf_lb': self.leaf_lb, 'leaf_ub': self.leaf_ub, 'integer': self.integer,
+                  'lb_bounds': np.array(self.lb_bounds), 'ub_bounds': np.array(self.ub_bounds), 'features': self.features}
+        return arrays, {'trained_leaves': int(self.trained_leaves), 'tolerance': self.tolerance}
+
+    @classmethod
+    def from_arrays(cls, arrays, attrs):
+        """Rules over the arrays returned by to_arrays (e.g. memory-mapped from an ArrayStore), without copying them."""
+        rules = cls.__new__(cls)
+        rules.values, rules.leaf_lb, rules.leaf_ub = arrays['values'], arrays['leaf_lb'], arrays['leaf_ub']
+        rules.integer, rules.features = arrays['integer'], arrays['features']
+        rules.lb_bounds, rules.ub_bounds = tuple(arrays['lb_bounds']), tuple(arrays['ub_bounds'])
+        rules.trained_leaves, rules.tolerance = attrs['trained_leaves'], attrs['tolerance']
+        return rules
+
+    def prediction_range(self, lb, ub):
+        """Minimum and maximum prediction within the box [lb, ub] over the features (see prediction_range)."""
+        mask = reachable_leaves(self.leaf_lb, self.leaf_ub, np.asarray(lb), np.asarray(ub))
+        if not mask.any():
+            return None
+        return self.values[mask].min().item(), self.values[mask].max().item()
+
+    def reindex(self, features, new_features):
+        """
+        Rules over other features, matched by name (e.g. the tree's features along with new one-hot columns,
+        see MLModels.get_model_features): features the tree was not trained on are unbounded in every leaf.
+
+        Args:
+            features (list[str]): features the rules are over.
+            new_features (list[str]): features of the new rules.
+
+        Returns:
+            TreeRules: the rules over new_features.
+        """
+        position = {feature: i for i, feature in enumerate(features)}
+        leaf_lb = np.full((self.n_leaves, len(new_features)), -np.inf)
+        leaf_ub = np.full((self.n_leaves, len(new_features)), np.inf)
+        integer = np.zeros(len(new_features), dtype=bool)
+        for j, feature in enumerate(new_features):
+            if feature in position:
+                leaf_lb[:, j] = self.leaf_lb[:, position[feature]]
+                leaf_ub[:, j] = self.leaf_ub[:, position[feature]]
+                integer[j] = self.integer[position[feature]]
+        return TreeRules(self.values, leaf_lb, leaf_ub, self.trained_leaves, self.tolerance, integer)
+
+    def embedding_size(self):
+        """Size of the MILP encoding of the tree (see embedding_size)."""
+        if self.n_leaves <= 1:
+            return {'variables': 0, 'binary_variables': 0, 'constraints': 1}
+        return {'variables': self.n_leaves,
+                'binary_variables': self.n_leaves,
+                'constraints': 2 + len(self.lb_bounds[0]) + len(self.ub_bounds[0])}
+
+
+def extract_leaf_boxes(model, n_features, tolerance=None):
+    """
+    Describes each leaf of a trained regression tree as a box over the features.
+    Conditions follow the semantics of the embedding (see hada.embed_tree): the left branch of a split on x with threshold th
+    requires x <= th, the right one x >= th (both closed).
+
+    If a tolerance is given, the tree is compacted on the way: a subtree whose leaf values differ by at most tolerance times the range of
+    all the leaf values (e.g. sibling leaves with the same value, or splits that do not change the prediction) is
+    described as a single leaf, with the midpoint of its values; predictions change by at most half the tolerance
+    (relative to the range), and not at all with a null tolerance.
+
+    Args:
+        model (sklearn.tree.DecisionTreeRegressor): trained tree.
+        n_features (int): number of features the tree was trained on.
+        tolerance (float): compaction tolerance, relative to the range of the leaf values (None for no compaction).
+
+    Returns:
+        values (np.ndarray): value of each leaf, shape (n_leaves,).
+        lb (np.ndarray): lower bound of each feature for each leaf (-inf if unbounded), shape (n_leaves, n_features).
+        ub (np.ndarray): upper bound of each feature for each leaf (+inf if unbounded), shape (n_leaves, n_features).
+    """
+    tree = model.tree_
+    values, lbs, ubs = [], [], []
+
+    node_values, sub_min, sub_max = _subtree_ranges(tree)
+    max_spread = tolerance * (sub_max[0] - sub_min[0]) if tolerance is not None else -np.inf
+
+    # iterative depth-first visit, left branches first (leaves are numbered in this order by the embedding)
+    stack = [(0, np.full(n_features, -np.inf), np.full(n_features, np.inf))]
+    while stack:
+        node, lb, ub = stack.pop()
+        left, right = tree.children_left[node], tree.children_right[node]
+        if left == right or sub_max[node] - sub_min[node] <= max_spread:
+            values.append(node_values[node].item() if left == right else (sub_min[node] + sub_max[node]).item() / 2)
+            lbs.append(lb)
+            ubs.append(ub)
+            continue
+        feature, threshold = tree.feature[node], tree.threshold[node]
+        left_ub = ub.copy()
+        left_ub[feature] = min(ub[feature], threshold)
+        right_lb = lb.copy()
+        right_lb[feature] = max(lb[feature], threshold)
+        stack.append((right, right_lb, ub))
+        stack.append((left, lb, left_ub))
+
+    return np.array(values), np.array(lbs).reshape(-1, n_features), np.array(ubs).reshape(-1, n_features)
+
+
+def _subtree_ranges(tree):
+    """Value of each node of a tree (sklearn.tree._tree.Tree), and minimum and maximum leaf value of each subtree."""
+    node_values = tree.value.reshape(tree.node_count, -1)[:, 0]
+    is_leaf = tree.children_left == tree.children_right
+    sub_min, sub_max = node_values.copy(), node_values.copy()
+    # children always come after their parent
+    for node in reversed(np.nonzero(~is_leaf)[0]):
+        children = [tree.children_left[node], tree.children_right[node]]
+        sub_min[node], sub_max[node] = sub_min[children].min(), sub_max[children].max()
+    return node_values, sub_min, sub_max
+
+
+def compacted_predict(model, X, tolerance=None):
+    """
+    Predictions of a trained tree once compacted with the given tolerance (see extract_leaf_boxes), i.e. of the tree
+    as embedded: rows reaching a leaf of a compacted subtree get the midpoint of its values. Same as model.predict(X)
+    if not compacted, or with a null tolerance (only subtrees with identical values are compacted).
+
+    Args:
+        model (sklearn.tree.DecisionTreeRegressor): trained tree.
+        X (np.ndarray): features of the rows, shape (n_rows, n_features).
+        tolerance (float): compaction tolerance, relative to the range of the leaf values (None for no compaction).
+
+    Returns:
+        np.ndarray: prediction for each row.
+    """
+    if not tolerance:
+        return model.predict(X)
+    tree = model.tree_
+    node_values, sub_min, sub_max = _subtree_ranges(tree)
+    max_spread = tolerance * (sub_max[0] - sub_min[0])
+    # value predicted by each node once compacted, set top-down (parents come before their children)
+    compacted = node_values.copy()
+    merged = np.zeros(tree.node_count, dtype=bool)
+    for node in range(tree.node_count):
+        left, right = tree.children_left[node], tree.children_right[node]
+        if left == right:
+            continue
+        if not merged[node] and sub_max[node] - sub_min[node] <= max_spread:
+            merged[node] = True
+            compacted[node] = (sub_min[node] + sub_max[node]) / 2
+        if merged[node]:
+            merged[[left, right]] = True
+            compacted[[left, right]] = compacted[node]
+    return compacted[model.apply(X)]
+
+
+def snap_integer_boxes(values, leaf_lb, leaf_ub, integer):
+    """
+    Snaps the bounds of the integer features in the leaf boxes to integer values: the left branch of a split on an
+    integer x with threshold th (x <= th, e.g. 3.5) becomes x <= floor(th), the right one x >= floor(th) + 1, which
+    is how the tree assigns integer values. Leaves left with no integer value for some feature (e.g. 3.2 < x <= 3.7)
+    can never be reached, and are dropped.
+
+    Args:
+        values (np.ndarray), leaf_lb (np.ndarray), leaf_ub (np.ndarray): leaves and boxes, see extract_leaf_boxes.
+        integer (np.ndarray): mask of the integer (or binary) features.
+
+    Returns:
+        values (np.ndarray), lb (np.ndarray), ub (np.ndarray): snapped leaves and boxes.
+    """
+    leaf_lb, leaf_ub = leaf_lb.copy(), leaf_ub.copy()
+    # infinite bounds are left as they are
+    leaf_lb[:, integer] = np.floor(leaf_lb[:, integer]) + 1
+    leaf_ub[:, integer] = np.floor(leaf_ub[:, integer])
+    nonempty = np.all(leaf_lb <= leaf_ub, axis=1)
+    return values[nonempty], leaf_lb[nonempty], leaf_ub[nonempty]
+
+
+def reachable_leaves(leaf_lb, leaf_ub, lb, ub):
+    """Mask of the leaves whose box intersects the box [lb, ub] over the features."""
+    return np.all((leaf_lb <= ub) & (leaf_ub >= lb), axis=1)
+
+
+def prediction_range(model, lb, ub):
+    """
+    Minimum and maximum prediction of a tree when its features are restricted to the box [lb, ub].
+
+    Args:
+        model (sklearn.tree.DecisionTreeRegressor): trained tree.
+        lb (np.ndarray): lower bound for each feature.
+        ub (np.ndarray): upper bound for each feature.
+
+    Returns:
+        tuple(float, float): (min, max) prediction, or None if no leaf can be reached within the bounds.
+    """
+    return TreeRules.from_model(model, len(lb)).prediction_range(lb, ub)
+
+
+def embedding_size(model, n_features):
+    """
+    Size of the MILP encoding of a tree (backward implications, see hada.embed_tree): a binary variable for each leaf,
+    the leaf selection and output constraints, and a big-M constraint for each finite bound of each leaf's box.
+    The output of a single-leaf tree is just fixed to its value. Bounds of the features are not accounted: within
+    those of a request, some leaves and conditions may be left out (see hada.embed_tree).
+
+    Args:
+        model (sklearn.tree.DecisionTreeRegressor): trained tree.
+        n_features (int): number of features the tree was trained on.
+
+    Returns:
+        dict: number of variables, binary variables and constraints.
+    """
+    return TreeRules.from_model(model, n_features).embedding_size()
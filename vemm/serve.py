@@ -0,0 +1,205 @@
+"""
+Multi-process serving mode: the service state (configs, categorical mappings, bounds, trained models and their
+error statistics) is loaded and warmed once in a master process, which then forks the workers. Workers share that
+state copy-on-write (the garbage collector is frozen before forking, not to touch the shared objects), and accept
+requests on the same listening socket. Dead workers are replaced.
+
+The unique resident memory of each worker (memory not shared with the other processes, see
+metrics.process_memory) is reported after start-up and then periodically, to size the number of workers per node.
+
+The store of the shared arrays (see ArrayStore) is emptied at start-up and removed at exit.
+
+Each worker exports (at /metrics) the metrics of the whole node: the processes write snapshots of their metrics in a
+shared folder, every second, and exports add them up (see Metrics.share).
+
+Linux only (fork, /proc). The periodic check of the trained models (MODELS_SCAN_INTERVAL, see app) runs in the
+master only; workers load the retrained models as soon as they are written.
+
+Usage (from the root folder):
+    python -m vemm.serve --workers 4
+    python -m vemm.serve --host 0.0.0.0 --port 5000 --workers 8 --train-missing --report-interval 600
+"""
+import os
+import gc
+import sys
+import atexit
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import traceback
+import multiprocessing
+from werkzeug.serving import make_server
+
+# the staleness scan is started by the master, after forking (see main)
+models_scan_interval = float(os.getenv('MODELS_SCAN_INTERVAL', 0))
+os.environ['MODELS_SCAN_INTERVAL'] = '0'
+from vemm import app as service
+from vemm.core.metrics import metrics, process_memory, input_case
+from vemm.core.array_store import ArrayStore
+
+
+def warm_up(db, datasets, models, train_missing=False):
+    """
+    Loads the solver and ML libraries, and the read-only state of the service for all the algorithms: categorical
+    mappings, bounds of the variables, trained models, their compiled rules and error statistics (used for robustness). Stale models are retrained
+    (see MLModels.get_model), and the retraining waited for.
+
+    Args:
+        db (ConfigDB): instance of ConfigDB.
+        datasets (Datasets): instance of Datasets.
+        models (MLModels): instance of MLModels.
+        train_missing (bool): whether to train the models never trained (otherwise trained on first use).
+
+    Returns:
+        dict: number of algorithms and models loaded, and algorithms which could not be loaded (with the error).
+    """
+    # the solver and ML stacks are otherwise imported on first use (i.e. in each worker)
+    import sklearn.tree
+    import vemm.core.hada
+
+    # started before forking, so that the workers share the registry of the ongoing trainings (and wait for each
+    # other's, see MLModels.get_model)
+    models.ongoing_training
+    loaded = {'algorithms': 0, 'models': 0, 'errors': {}}
+    for input_dependent in [False, True]:
+        for algorithm in db.get_algorithms(input_dependent):
+            try:
+                datasets.extract_var_bounds(algorithm, input_dependent)
+                datasets.expander.get_expanded_ml_input_vars(algorithm, input_dependent)
+                for hw in db.get_hws(algorithm, input_dependent):
+                    targets = [target for target in db.get_targets(algorithm, input_dependent) if target != 'price'
+                               and (train_missing or models.get_model_info(algorithm, hw, target, input_dependent) is not None)]
+                    datasets.get_error_stats_per_target(models, algorithm, hw, targets, input_dependent)
+                    for target in targets:
+                        models.get_rules(algorithm, hw, target, input_dependent)
+                    loaded['models'] += len(targets)
+                loaded['algorithms'] += 1
+            except Exception as e:
+                traceback.print_exc()
+                loaded['errors'][f'{algorithm} ({input_case(input_dependent)})'] = str(e)
+    models.wait_retraining()
+    return loaded
+
+
+def serve_worker(fd, host, port, metrics_path):
+    """Serves requests on the listening socket inherited from the master."""
+    # the master handles termination of the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # metrics recorded by the master are exported through its own snapshot, not counted again by each worker
+    metrics.reset()
+    metrics.share(metrics_path)
+    server = make_server(host, port, service.app, threaded=True, fd=fd)
+    server.serve_forever()
+
+
+def memory_report(workers):
+    """Resident memory of the master and of each worker (see metrics.process_memory), in MiB."""
+    def mib(memory):
+        return {key: round(value / 2**20, 1) for key, value in memory.items()}
+    report = {'master': mib(process_memory())}
+    for worker in workers:
+        try:
+            report[f'worker {worker.pid}'] = mib(process_memory(worker.pid))
+        except OSError:
+            pass
+    return report
+
+
+def print_memory_report(workers):
+    report = memory_report(workers)
+    print('Memory (MiB):')
+    for process, memory in report.items():
+        print(f'  {process}: rss {memory["rss"]}, pss {memory["pss"]}, unique {memory["uss"]}')
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves the service with multiple processes, sharing the warmed-up state.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--backlog', type=int, default=128, help='maximum number of pending connections')
+    parser.add_argument('--train-missing', action='store_true', help='train the models never trained before forking')
+    parser.add_argument('--report-interval', type=float, default=0,
+                        help='seconds between memory reports (0: only after start-up)')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    # the solver threads of the node are shared by the workers (see admission)
+    if 'SOLVER_THREADS' not in os.environ:
+        service.admission.set_thread_budget(max(1, (os.cpu_count() or 1) // args.workers))
+
+    # the store of the shared arrays (expanded datasets, compiled rules) starts empty, dropping the entries left by a
+    # previous run that did not stop cleanly, and is removed at exit
+    if service.arrays_path:
+        store = ArrayStore(service.arrays_path)
+        store.clear()
+        atexit.register(store.remove)
+
+    start = time.time()
+    loaded = warm_up(service.db, service.datasets, service.models, args.train_missing)
+    service.catalog.build()
+    print(f'Loaded {loaded["algorithms"]} algorithms and {loaded["models"]} models in {time.time() - start:.1f} s.')
+    for algorithm, error in loaded['errors'].items():
+        print(f'Could not load {algorithm}: {error}')
+
+    # objects created so far are moved out of the collector's reach, so that collections in the workers do not
+    # write to their pages (which would be copied in each worker)
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+
+    # metrics of the master and of all the workers (including the ones replaced) are exported by each worker
+    metrics_path = tempfile.mkdtemp(prefix='vemm-metrics-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+    context = multiprocessing.get_context('fork')
+    def start_worker():
+        worker = context.Process(target=serve_worker, args=(sock.fileno(), args.host, args.port, metrics_path))
+        worker.start()
+        return worker
+    workers = [start_worker() for _ in range(args.workers)]
+    print(f'Serving on http://{args.host}:{args.port} with {args.workers} workers.')
+    metrics.share(metrics_path)
+
+    if models_scan_interval > 0:
+        service.models.start_staleness_scan(models_scan_interval)
+
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    report_time = time.time() + 1
+    reported = False
+    while not stopping:
+        time.sleep(0.2)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive() and not stopping:
+                print(f'Worker {worker.pid} exited with code {worker.exitcode}; starting a new one.')
+                workers[i] = start_worker()
+        if time.time() >= report_time and (not reported or args.report_interval > 0):
+            print_memory_report(workers)
+            reported = True
+            report_time = time.time() + args.report_interval
+
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    sock.close()
+    shutil.rmtree(metrics_path, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+End-to-end latency benchmark over every bundled algorithm.
+
+For each algorithm (and input case) found in the local configs, a representative request is generated and
+solved in-process through run_hada, with and without robustness, with cold caches (no stored models nor
+categorical mappings) and warm ones. Per-phase latency percentiles and MILP sizes are reported as JSON;
+a stored report can be used as a baseline to flag regressions.
+
+Runs offline (local init modality only), on CPU-only machines.
+
+Usage (from the root folder):
+    python -m vemm.utils.benchmark --output bench.json
+    python -m vemm.utils.benchmark --algorithms toyalg anticipate --repeats 3 --baseline bench.json
+    python -m vemm.utils.benchmark --load bench_new.json --baseline bench.json
+    python -m vemm.utils.benchmark --build-only --algorithms toyalg anticipate --output build.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import traceback
+from collections import defaultdict
+from contextlib import redirect_stdout
+
+os.environ.setdefault('INIT_TYPE', 'local')
+from vemm import app as service
+from vemm.core.datasets import Datasets
+from vemm.core.ml_models import MLModels
+from vemm.core.catalog import Catalog
+from vemm.core.metrics import metrics, input_case
+
+ROBUSTNESS_FACTOR = 0.5
+PERCENTILES = (50, 95, 99)
+
+
+def generate_request(algorithm, input_dependent, robustness_fact=None):
+    """
+    Generates a representative /optimize request (JSON schema) for an algorithm: minimizing its first target,
+    with a constraint on the second one (if any) at 75% of its range; inputs are set in the middle of their range.
+    """
+    db = service.db
+    lb_per_var, ub_per_var = service.datasets.extract_var_bounds(algorithm, input_dependent)
+    targets = [target for target in db.get_targets(algorithm, input_dependent) if target != 'price']
+
+    data = {'algorithm': algorithm,
+            'objective': {'target': targets[0], 'type': 'min'},
+            'robustness_fact': robustness_fact,
+            'constraints': [],
+            'country': db.get_countries()[0] if db.has_emission_data(algorithm, input_dependent) else None}
+
+    if len(targets) > 1:
+        constrained = targets[1]
+        value = lb_per_var[constrained] + 0.75 * (ub_per_var[constrained] - lb_per_var[constrained])
+        data['constraints'].append({'target': constrained, 'type': 'leq', 'value': float(value)})
+
+    if input_dependent:
+        types = db.get_type_per_input(algorithm)
+        data['inputs'] = []
+        for input in db.get_inputs(algorithm):
+            if types[input] == 'str':
+                value = sorted(service.datasets.expander.get_categories_per_str_var(algorithm, input_dependent)[input])[0]
+            elif types[input] == 'bin':
+                value = 0
+            elif types[input] == 'int':
+                value = int((lb_per_var[input] + ub_per_var[input]) // 2)
+            else:
+                value = float((lb_per_var[input] + ub_per_var[input]) / 2)
+            data['inputs'].append({'name': input, 'value': value})
+
+    return data
+
+
+def reset_caches(tmp_dir):
+    """
+    Replaces the service state with one whose stored models, categorical mappings and expanded datasets are empty
+    (cold caches), configured as the service (array store, compact datasets and compaction tolerance). The objects
+    built on them (the catalog) are rebuilt too; the admission controller holds no reference to them (the cost of
+    each request is estimated with the current service.models).
+    """
+    paths = {}
+    for name in ['categories_no_inp', 'categories_inp', 'models_no_inp', 'models_inp']:
+        paths[name] = os.path.join(tmp_dir, name)
+        os.makedirs(paths[name])
+    # a new store, not to reuse the arrays of the datasets expanded and the rules compiled so far (unless the store is disabled)
+    arrays_path = os.path.join(tmp_dir, 'arrays') if service.arrays_path else None
+
+    service.datasets = Datasets.from_local(service.db,
+                                           service.data_path_no_inp,
+                                           service.data_path_inp,
+                                           paths['categories_no_inp'],
+                                           paths['categories_inp'],
+                                           arrays_path,
+                                           service.compact_datasets)
+    service.models = MLModels(service.db, service.datasets, paths['models_no_inp'], paths['models_inp'],
+                              compaction_tolerance=service.models.compaction_tolerance, arrays_path=arrays_path)
+    service.catalog = Catalog(service.db, service.datasets, service.models)
+
+
+def run_once(data):
+    """Runs a request in-process, returning the wall time, the recorded observations and the error (if any)."""
+    error = None
+    with metrics.recording() as samples:
+        start = time.perf_counter()
+        try:
+            optimization_request = service.parse_request_json(data)
+            solution = service.run_hada(optimization_request)
+            if solution:
+                service.format_solution(solution)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        elapsed = time.perf_counter() - start
+    return elapsed, samples, error
+
+
+def percentile(values, q):
+    """Percentile with linear interpolation (same as numpy's default)."""
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+    pos = (len(values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def summarize(values):
+    summary = {f'p{q}': percentile(values, q) for q in PERCENTILES}
+    summary['mean'] = sum(values) / len(values)
+    summary['count'] = len(values)
+    return summary
+
+
+def summarize_runs(runs):
+    """Aggregates the runs of a scenario into per-phase latency percentiles and MILP sizes."""
+    phases = defaultdict(list)
+    milp = defaultdict(list)
+    errors = []
+    for elapsed, samples, error in runs:
+        # phases completed before a failure (e.g. building a model the solver refuses) are still reported
+        if error:
+            errors.append(error)
+        else:
+            phases['total'].append(elapsed)
+        # phases can be observed more than once per run (e.g. one model_load per tree)
+        per_run = defaultdict(float)
+        for name, labels, value in samples:
+            if name == 'phase_duration_seconds':
+                per_run[labels['phase']] += value
+            elif name.startswith('milp_'):
+                milp[name[len('milp_'):]].append(value)
+        for phase, value in per_run.items():
+            phases[phase].append(value)
+
+    return {'runs': len(runs),
+            'errors': sorted(set(errors)),
+            'phases': {phase: summarize(values) for phase, values in phases.items()},
+            'milp': {name: max(values) for name, values in milp.items()}}
+
+
+def run_benchmark(algorithms=None, input_cases=('input-independent', 'input-dependent'), repeats=5):
+    """
+    Runs the benchmark, returning the report (a JSON-serializable dict).
+
+    Args:
+        algorithms (list[str]): algorithms to benchmark (all, if None).
+        input_cases (list[str]): input cases to benchmark.
+        repeats (int): number of runs with warm caches for each scenario.
+    """
+    results = []
+    for input_dependent in [False, True]:
+        if input_case(input_dependent) not in input_cases:
+            continue
+        for algorithm in service.db.get_algorithms(input_dependent):
+            if algorithms and algorithm not in algorithms:
+                continue
+            for robustness_fact in [None, ROBUSTNESS_FACTOR]:
+                print(f'Benchmarking ({algorithm}, {input_case(input_dependent)}, robustness={robustness_fact})', file=sys.stderr)
+                with tempfile.TemporaryDirectory() as tmp_dir, redirect_stdout(sys.stderr):
+                    reset_caches(tmp_dir)
+                    try:
+                        data = generate_request(algorithm, input_dependent, robustness_fact)
+                    except Exception as e:
+                        traceback.print_exc()
+                        results.append({'algorithm': algorithm, 'input_case': input_case(input_dependent),
+                                        'robustness_fact': robustness_fact, 'cache': 'cold',
+                                        'runs': 0, 'errors': [f'{type(e).__name__}: {e}'], 'phases': {}, 'milp': {}})
+                        continue
+                    cold_runs = [run_once(data)]
+                    warm_runs = [run_once(data) for _ in range(repeats)]
+
+                for cache, runs in [('cold', cold_runs), ('warm', warm_runs)]:
+                    results.append(dict({'algorithm': algorithm,
+                                         'input_case': input_case(input_dependent),
+                                         'robustness_fact': robustness_fact,
+                                         'cache': cache,
+                                         'request': data},
+                                        **summarize_runs(runs)))
+
+    return {'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'repeats': repeats},
+            'results': results}
+
+
+def run_build_benchmark(algorithms=None, input_cases=('input-independent', 'input-dependent'), repeats=5):
+    """
+    Times the construction of the models only (no solve), with warm caches: the model of a representative
+    request (see generate_request) is built repeats times for each algorithm. Construction is pure Python
+    overhead paid by every request, dominated by the embedding of the predictive models of the largest ones.
+    Results have the same format as those of run_benchmark (phases construction, build and embed), with cache 'build'.
+    """
+    from vemm.core.hada import prepare_model, build_model
+
+    results = []
+    for input_dependent in [False, True]:
+        if input_case(input_dependent) not in input_cases:
+            continue
+        for algorithm in service.db.get_algorithms(input_dependent):
+            if algorithms and algorithm not in algorithms:
+                continue
+            print(f'Building ({algorithm}, {input_case(input_dependent)})', file=sys.stderr)
+            phases, milp, errors = defaultdict(list), {}, []
+            data = None
+            try:
+                with redirect_stdout(sys.stderr):
+                    data = generate_request(algorithm, input_dependent)
+                    request = service.parse_request_json(data)
+                    var_bounds = service.datasets.get_var_bounds_all(request)
+                    spec, hws, trees, _ = prepare_model(service.db, service.datasets, request, service.models, var_bounds, None)
+                if not hws:
+                    raise ValueError('no hardware platform left by the presolve')
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    mdl, embed_time = build_model(spec, hws, trees)
+                    elapsed = time.perf_counter() - start
+                    phases['construction'].append(elapsed)
+                    phases['embed'].append(embed_time)
+                    phases['build'].append(elapsed - embed_time)
+                    milp = {'variables': mdl.number_of_variables,
+                            'binary_variables': mdl.number_of_binary_variables,
+                            'constraints': mdl.number_of_constraints}
+                    mdl.end()
+            except Exception as e:
+                traceback.print_exc()
+                errors.append(f'{type(e).__name__}: {e}')
+            results.append({'algorithm': algorithm,
+                            'input_case': input_case(input_dependent),
+                            'robustness_fact': None,
+                            'cache': 'build',
+                            'request': data,
+                            'runs': len(phases['construction']),
+                            'errors': errors,
+                            'phases': {phase: summarize(values) for phase, values in phases.items()},
+                            'milp': milp})
+
+    return {'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'repeats': repeats,
+                     'build_only': True},
+            'results': results}
+
+
+def _scenario_key(result):
+    return (result['algorithm'], result['input_case'], result['robustness_fact'], result['cache'])
+
+
+def compare(report, baseline, threshold=0.2, min_delta=0.005, percentile_key='p95'):
+    """
+    Compares a report against a baseline, returning the list of regressions.
+    A phase regresses when its latency percentile grows more than threshold (relative) and min_delta (seconds);
+    a MILP regresses when its size grows at all. Scenarios failing only in the report are regressions too.
+    """
+    regressions = []
+    baseline_results = {_scenario_key(result): result for result in baseline['results']}
+    for result in report['results']:
+        key = _scenario_key(result)
+        if key not in baseline_results:
+            continue
+        base = baseline_results[key]
+        if result['errors'] and not base['errors']:
+            regressions.append({'scenario': key, 'kind': 'errors', 'baseline': None, 'current': result['errors']})
+            continue
+        for phase, summary in result['phases'].items():
+            if phase not in base['phases']:
+                continue
+            old, new = base['phases'][phase][percentile_key], summary[percentile_key]
+            if new - old > min_delta and new > old * (1 + threshold):
+                regressions.append({'scenario': key, 'kind': f'latency:{phase}:{percentile_key}', 'baseline': old, 'current': new})
+        for name, size in result['milp'].items():
+            if name in base['milp'] and size > base['milp'][name]:
+                regressions.append({'scenario': key, 'kind': f'milp:{name}', 'baseline': base['milp'][name], 'current': size})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end latency benchmark over the bundled algorithms.')
+    parser.add_argument('--algorithms', nargs='*', help='algorithms to benchmark (default: all)')
+    parser.add_argument('--input-cases', nargs='*', default=['input-independent', 'input-dependent'],
+                        choices=['input-independent', 'input-dependent'])
+    parser.add_argument('--repeats', type=int, default=5, help='runs with warm caches per scenario')
+    parser.add_argument('--build-only', action='store_true', help='time the construction of the models only (no solve)')
+    parser.add_argument('--output', help='where to store the report (default: stdout)')
+    parser.add_argument('--load', help='load a stored report instead of running the benchmark')
+    parser.add_argument('--baseline', help='stored report to compare against; exits with status 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative latency increase considered a regression')
+    parser.add_argument('--min-delta', type=float, default=0.005, help='absolute latency increase (s) considered a regression')
+    args = parser.parse_args(argv)
+
+    if args.load:
+        report = json.load(open(args.load))
+    else:
+        benchmark = run_build_benchmark if args.build_only else run_benchmark
+        report = benchmark(args.algorithms, args.input_cases, args.repeats)
+        if args.output:
+            json.dump(report, open(args.output, 'w'), indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions = compare(report, json.load(open(args.baseline)), args.threshold, args.min_delta)
+        print(json.dumps({'regressions': regressions}, indent=2), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
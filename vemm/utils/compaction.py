@@ -0,0 +1,95 @@
+"""
+Report of the compaction of the trained trees (see tree_rules.extract_leaf_boxes), to choose the service's
+TREE_COMPACTION_TOLERANCE: for each (algorithm, hw, target) whose model is trained, the leaves and the size of its
+MILP encoding before and after compacting it with each of the given tolerances, along with the largest change of
+its predictions (half the tolerance times the range of the tree's predictions).
+
+Models are not trained: only those already stored are reported.
+
+Usage (from the root folder):
+    python -m vemm.utils.compaction --tolerances 0 0.01 0.05 --output compaction.json
+    python -m vemm.utils.compaction --algorithms toyalg anticipate --tolerances 0.02
+"""
+import os
+import sys
+import json
+import argparse
+from contextlib import redirect_stdout
+
+os.environ.setdefault('INIT_TYPE', 'local')
+from vemm import app as service
+from vemm.core.metrics import input_case
+from vemm.core.tree_rules import TreeRules
+
+
+def compaction_report(algorithms=None, input_cases=('input-independent', 'input-dependent'), tolerances=(0.0,)):
+    """
+    Compacts the trained trees with each tolerance, returning the report (a JSON-serializable dict).
+
+    Args:
+        algorithms (list[str]): algorithms to report (default: all).
+        input_cases (list[str]): input cases to report.
+        tolerances (list[float]): compaction tolerances, relative to the range of the predictions of each tree.
+    """
+    db, models = service.db, service.models
+    results = []
+    for input_dependent in [False, True]:
+        if input_case(input_dependent) not in input_cases:
+            continue
+        for algorithm in db.get_algorithms(input_dependent):
+            if algorithms and algorithm not in algorithms:
+                continue
+            for hw in db.get_hws(algorithm, input_dependent):
+                for target in db.get_targets(algorithm, input_dependent):
+                    info = models.get_model_info(algorithm, hw, target, input_dependent) if target != 'price' else None
+                    if info is None:
+                        continue
+                    with redirect_stdout(sys.stderr):
+                        model = models.get_model(algorithm, hw, target, input_dependent)
+                    trained = TreeRules.from_model(model, len(info['features']))
+                    prediction_range = float(trained.values.max() - trained.values.min())
+                    compacted = {}
+                    for tolerance in tolerances:
+                        rules = TreeRules.from_model(model, len(info['features']), tolerance)
+                        compacted[str(tolerance)] = dict(rules.embedding_size(), leaves=rules.n_leaves,
+                                                         max_change=tolerance * prediction_range / 2)
+                    results.append({'algorithm': algorithm,
+                                    'input_case': input_case(input_dependent),
+                                    'hw': hw,
+                                    'target': target,
+                                    'prediction_range': prediction_range,
+                                    'trained': dict(trained.embedding_size(), leaves=trained.n_leaves),
+                                    'compacted': compacted})
+
+    summary = {str(tolerance): {'leaves': sum(result['compacted'][str(tolerance)]['leaves'] for result in results),
+                                'constraints': sum(result['compacted'][str(tolerance)]['constraints'] for result in results)}
+               for tolerance in tolerances}
+    summary['trained'] = {'leaves': sum(result['trained']['leaves'] for result in results),
+                          'constraints': sum(result['trained']['constraints'] for result in results)}
+    return {'tolerances': list(tolerances), 'summary': summary, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Leaves of the trained trees before and after their compaction.')
+    parser.add_argument('--algorithms', nargs='*', help='algorithms to report (default: all)')
+    parser.add_argument('--input-cases', nargs='*', default=['input-independent', 'input-dependent'],
+                        choices=['input-independent', 'input-dependent'])
+    parser.add_argument('--tolerances', nargs='*', type=float, default=[0.0],
+                        help='compaction tolerances, relative to the range of the predictions of each tree')
+    parser.add_argument('--output', help='where to store the report (default: stdout)')
+    args = parser.parse_args(argv)
+
+    report = compaction_report(args.algorithms, args.input_cases, args.tolerances)
+    if args.output:
+        json.dump(report, open(args.output, 'w'), indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    for result in report['results']:
+        leaves = ', '.join(f"{result['compacted'][str(tolerance)]['leaves']} ({tolerance})" for tolerance in args.tolerances)
+        print(f"({result['algorithm']}, {result['hw']}, {result['target']}): {result['trained']['leaves']} leaves -> {leaves}",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Adds rows (e.g. new measurements) to the dataset of an (algorithm, hw), from a CSV file (with header) or a JSON
+file ({"rows": [...]}, or a list of rows).
+
+By default, rows are sent to a running service (see the /datasets endpoint), which retrains the affected models
+in background; with --local, the local datasets are updated directly and the models retrained before exiting
+(the service must not be running).
+
+Usage (from the root folder):
+    python -m vemm.utils.ingest toyalg pc new_rows.csv
+    python -m vemm.utils.ingest anticipate leonardo new_rows.json --input-dependent --url http://localhost:5000
+    python -m vemm.utils.ingest toyalg pc new_rows.csv --local
+"""
+import os
+import sys
+import json
+import argparse
+import requests
+import pandas as pd
+from urllib.parse import urljoin
+
+
+def load_rows(path):
+    """Loads rows from a CSV or JSON file."""
+    if path.endswith('.json'):
+        data = json.load(open(path))
+        rows = data['rows'] if isinstance(data, dict) else data
+        return pd.DataFrame(rows)
+    return pd.read_csv(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Adds rows to the dataset of an (algorithm, hw).')
+    parser.add_argument('algorithm')
+    parser.add_argument('hw')
+    parser.add_argument('file', help='CSV (with header) or JSON file with the rows to add')
+    parser.add_argument('--input-dependent', action='store_true', help='add rows to the input-dependent dataset')
+    parser.add_argument('--url', default='http://localhost:5000', help='address of the service')
+    parser.add_argument('--local', action='store_true', help='update local datasets and models directly')
+    args = parser.parse_args(argv)
+
+    rows = load_rows(args.file)
+
+    if args.local:
+        os.environ.setdefault('INIT_TYPE', 'local')
+        from vemm import app as service
+        from vemm.core.ingestion import ingest_rows
+        ret = ingest_rows(service.datasets, service.models, args.algorithm, args.hw, rows,
+                          args.input_dependent, wait=True)
+    else:
+        request_url = f'/datasets/{args.algorithm}/{args.hw}'
+        if args.input_dependent:
+            request_url += '/input'
+        response = requests.post(urljoin(args.url, request_url), data=rows.to_csv(index=False),
+                                 headers={'Content-Type': 'text/csv'})
+        ret = response.json()
+
+    print(json.dumps(ret, indent=2))
+    return 1 if 'error' in ret else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
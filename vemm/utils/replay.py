@@ -0,0 +1,188 @@
+"""
+Offline replay of a corpus of HADA models exported by the service (see MODEL_EXPORT_PATH), to judge solver
+settings and formulation changes on the instances production actually builds.
+
+By default, each exported model is read back and solved again, with the settings (and cutoff) it was solved
+with in production, overridden by --settings: this measures solver settings on the same formulation.
+With --rebuild, the request each model was built for is solved again through the service instead (one
+solve per request, also for decomposed ones): models are rebuilt with the current formulation, which
+can then be compared with the exported one (or with a previous replay, see --baseline).
+
+For each instance, wall time, nodes, status and objective are reported as JSON, along with the time and
+nodes of the reference (production, or the baseline replay) and whether the objectives differ.
+
+Usage (from the root folder):
+    python -m vemm.utils.replay corpus/ --output replay.json
+    python -m vemm.utils.replay corpus/ --settings '{"emphasis": "feasibility", "threads": 1}' --repeats 3
+    python -m vemm.utils.replay corpus/ --rebuild --baseline replay.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+from contextlib import redirect_stdout
+from vemm.core.model_export import list_models
+
+
+def solve_exported(corpus_path, metadata, settings):
+    """Reads an exported model and solves it with its recorded settings, overridden by settings; returns the solve statistics."""
+    from docplex.mp.model_reader import ModelReader
+    from vemm.core.hada import set_cutoff, get_solve_stats
+    from vemm.core.optimization_request import SolverSettings
+
+    mdl = ModelReader.read(os.path.join(corpus_path, metadata['model']))
+    # MPS files do not record the sense: maximization problems are read as the minimization of the opposite
+    if metadata['opt_type'] == 'max' and mdl.is_minimized():
+        mdl.maximize(-mdl.objective_expr)
+    SolverSettings.apply_settings(mdl, dict(metadata['solver_settings'], **settings))
+    set_cutoff(mdl, metadata['opt_type'], metadata['cutoff'])
+    sol = mdl.solve()
+    stats = get_solve_stats(mdl, sol)
+    mdl.end()
+    return stats
+
+
+def solve_rebuilt(metadata, settings):
+    """Solves the request of an exported model again through the service (current formulation); returns the solve statistics."""
+    from vemm import app as service
+
+    data = metadata['request']
+    data = dict(data, solver=dict(data.get('solver', {}), solve_stats=True, **settings))
+    solution = service.run_hada(service.parse_request_json(data))
+    if not solution and solution.solve_stats is None:
+        # no solve (e.g. every hw pruned by the presolve)
+        return {'status': solution.status, 'proven_optimal': False, 'time': None, 'nodes': None, 'objective': None}
+    return solution.solve_stats
+
+
+def get_instances(corpus, rebuild=False):
+    """
+    Exported models to replay. With rebuild, one per request: the subproblems of a decomposed request are
+    merged, their statistics summed (the objective is the best one, proven optimal if all of them were);
+    hws skipped in production because of their bound are not accounted.
+    """
+    if not rebuild:
+        return corpus
+    per_request = {}
+    for metadata in corpus:
+        per_request.setdefault(metadata['request_name'], []).append(metadata)
+
+    instances = []
+    for request_name, models in per_request.items():
+        if models[0]['name'] == request_name:
+            instances.append(models[0])
+            continue
+        objectives = [metadata['stats']['objective'] for metadata in models if metadata['stats']['objective'] is not None]
+        best = min if models[0]['opt_type'] == 'min' else max
+        stats = {'status': 'decomposed',
+                 'proven_optimal': all(metadata['stats']['proven_optimal'] or metadata['stats']['objective'] is None for metadata in models),
+                 'time': sum(metadata['stats']['time'] for metadata in models),
+                 'nodes': sum(metadata['stats']['nodes'] for metadata in models),
+                 'objective': best(objectives) if objectives else None}
+        instances.append(dict(models[0], name=request_name,
+                              hws=[hw for metadata in models for hw in metadata['hws']], stats=stats))
+    return instances
+
+
+def summarize_instance(metadata, runs, reference, tolerance):
+    """Aggregates the runs of an instance (median time) and compares them with its reference statistics."""
+    times = sorted(run['time'] for run in runs if run['time'] is not None)
+    replayed = dict(runs[-1], time=times[len(times) // 2] if times else None)
+    mismatch = (replayed['proven_optimal'] and reference.get('proven_optimal', False)
+                and abs(replayed['objective'] - reference['objective']) > tolerance * max(1, abs(reference['objective'])))
+    return {'name': metadata['name'],
+            'algorithm': metadata['algorithm'],
+            'input_case': metadata['input_case'],
+            'hws': metadata['hws'],
+            'reference': {name: reference.get(name) for name in ['status', 'proven_optimal', 'time', 'nodes', 'objective']},
+            'replayed': replayed,
+            'objective_mismatch': mismatch}
+
+
+def geometric_mean(values):
+    values = [value for value in values if value > 0]
+    return math.exp(sum(math.log(value) for value in values) / len(values)) if values else None
+
+
+def run_replay(corpus_path, settings=None, rebuild=False, repeats=1, baseline=None, tolerance=1e-4):
+    """
+    Replays a corpus, returning the report (a JSON-serializable dict).
+
+    Args:
+        corpus_path (str): folder of the exported models.
+        settings (dict): solver settings overriding the recorded ones (/optimize schema).
+        rebuild (bool): whether to rebuild the models from their requests (current formulation).
+        repeats (int): solves of each instance (the median time is reported).
+        baseline (dict): report of a previous replay, used as reference instead of the production statistics.
+        tolerance (float): relative difference of the objectives (both proven optimal) reported as a mismatch.
+    """
+    settings = settings or {}
+    baseline_results = {result['name']: result['replayed'] for result in baseline['results']} if baseline else {}
+    results, errors = [], []
+    for metadata in get_instances(list_models(corpus_path), rebuild):
+        print(f"Replaying {metadata['name']} ({metadata['algorithm']}, {metadata['input_case']})", file=sys.stderr)
+        try:
+            with redirect_stdout(sys.stderr):
+                runs = [solve_rebuilt(metadata, settings) if rebuild else solve_exported(corpus_path, metadata, settings)
+                        for _ in range(repeats)]
+        except Exception as e:
+            errors.append({'name': metadata['name'], 'error': f'{type(e).__name__}: {e}'})
+            continue
+        reference = baseline_results.get(metadata['name'], metadata['stats'])
+        results.append(summarize_instance(metadata, runs, reference, tolerance))
+
+    compared = [result for result in results if result['replayed']['time'] and result['reference']['time']]
+    summary = {'instances': len(results),
+               'errors': len(errors),
+               'time': sum(result['replayed']['time'] or 0 for result in results),
+               'reference_time': sum(result['reference']['time'] or 0 for result in results),
+               'nodes': sum(result['replayed']['nodes'] or 0 for result in results),
+               'reference_nodes': sum(result['reference']['nodes'] or 0 for result in results),
+               # below 1, the replay is faster than the reference
+               'time_ratio_geomean': geometric_mean([result['replayed']['time'] / result['reference']['time'] for result in compared]),
+               'not_proven_optimal': sum(not result['replayed']['proven_optimal'] for result in results),
+               'objective_mismatches': sum(result['objective_mismatch'] for result in results)}
+
+    return {'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'corpus': os.path.abspath(corpus_path),
+                     'mode': 'rebuild' if rebuild else 'exported',
+                     'settings': settings,
+                     'repeats': repeats,
+                     'reference': 'baseline' if baseline else 'production'},
+            'summary': summary,
+            'results': results,
+            'errors': errors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solves again a corpus of HADA models exported by the service.')
+    parser.add_argument('corpus', help='folder of the exported models (MODEL_EXPORT_PATH)')
+    parser.add_argument('--settings', type=json.loads, default={},
+                        help='solver settings (JSON, /optimize schema) overriding the recorded ones')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the models from their requests, with the current formulation')
+    parser.add_argument('--repeats', type=int, default=1, help='solves of each instance (the median time is reported)')
+    parser.add_argument('--baseline', help='report of a previous replay, used as reference instead of the production statistics')
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='relative difference of the objectives reported as a mismatch')
+    parser.add_argument('--output', help='where to store the report (default: stdout)')
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        os.environ.setdefault('INIT_TYPE', 'local')
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+    report = run_replay(args.corpus, args.settings, args.rebuild, args.repeats, baseline, args.tolerance)
+    if args.output:
+        json.dump(report, open(args.output, 'w'), indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    print(json.dumps(report['summary'], indent=2), file=sys.stderr)
+    return 1 if report['errors'] or report['summary']['objective_mismatches'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())